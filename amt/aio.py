@@ -0,0 +1,165 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""asyncio version of amt.client.
+
+This needs python 3.6 or later and the optional ``httpx`` library
+(``pip install amt[async]``). A single httpx connection pool can be
+shared by any number of AsyncClients, so one event loop can drive
+operations against a whole fleet of AMT hosts.
+"""
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+import amt.client
+from amt.client import (AMTError, CIM_AssociatedPowerManagementService,
+                        CIM_BootConfigSetting, CIM_BootService,
+                        CIM_KVMRedirectionSAP, CIM_PowerManagementService,
+                        IPS_KVMRedirectionSettingData, Result,
+                        _find_value, _result)
+import amt.utils
+import amt.wsman
+
+
+def shared_pool(max_connections=100, max_keepalive_connections=None,
+                timeout=None):
+    """Build an httpx client that can be shared between AsyncClients."""
+    _require_httpx()
+    limits = httpx.Limits(max_connections=max_connections,
+                          max_keepalive_connections=max_keepalive_connections)
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+def _require_httpx():
+    if httpx is None:
+        raise ImportError("amt.aio requires the httpx library, "
+                          "install it with ``pip install amt[async]``")
+
+
+class AsyncClient(object):
+    """asyncio AMT client.
+
+    Has the same interface as amt.client.Client, but every operation
+    is a coroutine. If ``pool`` (an ``httpx.AsyncClient``, see
+    shared_pool) is given its connections are shared with other
+    clients, and it is up to the caller to close it. Otherwise the
+    client creates its own pool, closed by aclose().
+    """
+    def __init__(self, address, password,
+                 username='admin', protocol='http',
+                 vncpasswd=None, pool=None, port=None):
+        _require_httpx()
+        self.uri = amt.client.wsman_uri(address, protocol, port)
+        self.username = username
+        self.password = password
+        self.vncpassword = vncpasswd
+        # The digest auth handler is per host, it remembers the last
+        # challenge so later requests skip the 401 round trip.
+        self._auth = httpx.DigestAuth(username, password)
+        self._pool = pool
+        self._owns_pool = pool is None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = httpx.AsyncClient()
+        return self._pool
+
+    async def aclose(self):
+        """Close the connection pool, if this client created it."""
+        if self._owns_pool and self._pool is not None:
+            await self._pool.aclose()
+            self._pool = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def _send(self, payload):
+        resp = await self.pool.post(
+            self.uri, content=payload, auth=self._auth,
+            headers={'content-type': 'application/soap+xml;charset=UTF-8'})
+        resp.raise_for_status()
+        return resp
+
+    async def post(self, payload, ns=None):
+        """Send a request, returning its amt.client.Result.
+
+        As with Client.post, ReturnValueError is raised if ns is given
+        and the ReturnValue in it isn't 0.
+        """
+        start = amt.utils.now()
+        resp = await self._send(payload)
+        return _result(resp.content, ns, amt.utils.now() - start)
+
+    async def power_on(self):
+        """Power on the box."""
+        payload = amt.wsman.power_state_request(self.uri, "on")
+        return await self.post(payload, CIM_PowerManagementService)
+
+    async def power_off(self):
+        """Power off the box."""
+        payload = amt.wsman.power_state_request(self.uri, "off")
+        return await self.post(payload, CIM_PowerManagementService)
+
+    async def power_cycle(self):
+        """Power cycle the box."""
+        payload = amt.wsman.power_state_request(self.uri, "reboot")
+        return await self.post(payload, CIM_PowerManagementService)
+
+    async def pxe_next_boot(self):
+        """Sets the machine to PXE boot on its next reboot
+
+        Will default back to normal boot list on the reboot that follows.
+        """
+        return await self.set_next_boot(boot_device='pxe')
+
+    async def set_next_boot(self, boot_device):
+        """Sets the machine to boot to boot_device on its next reboot
+
+        Will default back to normal boot list on the reboot that follows.
+        """
+        payload = amt.wsman.change_boot_order_request(self.uri, boot_device)
+        await self.post(payload, CIM_BootConfigSetting)
+
+        payload = amt.wsman.enable_boot_config_request(self.uri)
+        return await self.post(payload, CIM_BootService)
+
+    async def power_status(self):
+        payload = amt.wsman.get_request(
+            self.uri,
+            CIM_AssociatedPowerManagementService)
+        resp = await self._send(payload)
+        return _find_value(
+            resp.content,
+            CIM_AssociatedPowerManagementService,
+            "PowerState")
+
+    async def enable_vnc(self):
+        if self.vncpassword is None:
+            raise AMTError("VNC Password was not set")
+        payload = amt.wsman.enable_remote_kvm(self.uri, self.vncpassword)
+        await self.post(payload)
+        payload = amt.wsman.kvm_redirect(self.uri)
+        return await self.post(payload, CIM_KVMRedirectionSAP)
+
+    async def vnc_status(self):
+        payload = amt.wsman.get_request(
+            self.uri, IPS_KVMRedirectionSettingData)
+        start = amt.utils.now()
+        resp = await self._send(payload)
+        return Result(resp.content, elapsed=amt.utils.now() - start)
@@ -0,0 +1,113 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A small cache for read only CIM queries.
+
+AMT management engines handle concurrent requests poorly, so when the
+same host is asked about the same thing many times a second (a
+dashboard refreshing, say) it is much kinder to answer from memory.
+"""
+
+import collections
+import threading
+
+import amt.utils
+
+MISSING = object()
+
+
+class TTLCache(object):
+    """A thread safe, size bounded, LRU cache with expiring entries.
+
+    Keys are (host, resource, property) tuples, which lets everything
+    cached for a (host, resource) be dropped at once with invalidate().
+    One cache can be shared by many clients.
+
+    A value fetched while its key was invalidated may already be out
+    of date, so take generation(key) before fetching and pass it to
+    set(), which then drops the value if there was an invalidation in
+    between.
+    """
+
+    def __init__(self, ttl=5.0, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        # (host, resource) => set of keys, for invalidation
+        self._groups = {}
+        # (host, resource) => times invalidated, and times cleared
+        self._generations = {}
+        self._cleared = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """The value for key, or MISSING if absent or expired."""
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return MISSING
+            if expires <= amt.utils.now():
+                self._remove(key)
+                return MISSING
+            # mark as recently used
+            del self._data[key]
+            self._data[key] = (expires, value)
+            return value
+
+    def generation(self, key):
+        """A token that changes whenever key is invalidated."""
+        with self._lock:
+            return self._cleared, self._generations.get(key[:2], 0)
+
+    def set(self, key, value, generation=None):
+        """Cache value for key.
+
+        If generation (from generation()) is given and key has been
+        invalidated since, value is not stored.
+        """
+        with self._lock:
+            if generation is not None and generation != (
+                    self._cleared, self._generations.get(key[:2], 0)):
+                return
+            if key in self._data:
+                del self._data[key]
+            self._data[key] = (amt.utils.now() + self.ttl, value)
+            self._groups.setdefault(key[:2], set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key):
+        del self._data[key]
+        group = self._groups.get(key[:2])
+        if group is not None:
+            group.discard(key)
+            if not group:
+                del self._groups[key[:2]]
+
+    def invalidate(self, host, resource):
+        """Drop everything cached about resource on host."""
+        with self._lock:
+            group = (host, resource)
+            self._generations[group] = self._generations.get(group, 0) + 1
+            for key in self._groups.pop(group, ()):
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._cleared += 1
+            self._generations.clear()
+            self._data.clear()
+            self._groups.clear()
@@ -17,12 +17,20 @@
 # Open Source software that acts as one of the few bits of example
 # code for this interface.
 
-import xml.dom.minidom
-from xml.etree import ElementTree
+import functools
+import ssl
+import threading
+import time
+import weakref
+from xml.parsers import expat
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPDigestAuth
+import urllib3
 
+import amt.cache
+import amt.utils
 import amt.wsman
 
 
@@ -43,13 +51,32 @@ CIM_BootService = SCHEMA_BASE + 'CIM_BootService'
 CIM_ComputerSystem = SCHEMA_BASE + 'CIM_ComputerSystem'
 CIM_BootConfigSetting = SCHEMA_BASE + 'CIM_BootConfigSetting'
 CIM_BootSourceSetting = SCHEMA_BASE + 'CIM_BootSourceSetting'
+CIM_KVMRedirectionSAP = SCHEMA_BASE + 'CIM_KVMRedirectionSAP'
+CIM_OrderedComponent = SCHEMA_BASE + 'CIM_OrderedComponent'
+CIM_ElementSettingData = SCHEMA_BASE + 'CIM_ElementSettingData'
+CIM_SoftwareIdentity = SCHEMA_BASE + 'CIM_SoftwareIdentity'
+
+IPS_KVMRedirectionSettingData = ('http://intel.com/wbem/wscim/1/ips-schema/1/'
+                                 'IPS_KVMRedirectionSettingData')
+
+# What cached reads each kind of change makes stale
+_POWER_RESOURCES = (CIM_AssociatedPowerManagementService,
+                    CIM_ComputerSystem, CIM_ElementSettingData)
+_BOOT_RESOURCES = (CIM_BootConfigSetting, CIM_BootSourceSetting,
+                   CIM_BootService, CIM_OrderedComponent,
+                   CIM_ElementSettingData)
+_KVM_RESOURCES = (IPS_KVMRedirectionSettingData, CIM_KVMRedirectionSAP)
 
 # Additional useful constants
 _SOAP_ENVELOPE = 'http://www.w3.org/2003/05/soap-envelope'
 _ADDRESS = 'http://schemas.xmlsoap.org/ws/2004/08/addressing'
 _ANONYMOUS = 'http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous'
 _WSMAN = 'http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd'
+_XSI = 'http://www.w3.org/2001/XMLSchema-instance'
 
+# The one boot config AMT has, and boot device names by source
+_BOOT_CONFIG = 'Intel(r) AMT: Boot Configuration 0'
+_BOOT_DEVICE_NAMES = dict((v, k) for k, v in amt.wsman.BOOT_DEVICES.items())
 
 # magic ports to connect to
 AMT_PROTOCOL_PORT_MAP = {
@@ -57,135 +84,1054 @@ AMT_PROTOCOL_PORT_MAP = {
     'https': 16993,
 }
 
+# (connect, read) timeouts in seconds. Management engines can take a
+# while to answer power actions, but one that hasn't answered in a
+# minute has wedged.
+DEFAULT_TIMEOUT = (10, 60)
+# How many times to retry reads that fail with a connection error or
+# timeout.
+DEFAULT_RETRIES = 2
+# AMT copes badly with parallel sessions, so keep it to a couple of
+# connections per host.
+DEFAULT_MAX_CONNECTIONS = 2
+
+
+def wsman_uri(address, protocol='http', port=None):
+    """The WS-Man endpoint for an AMT host.
+
+    port defaults to the standard AMT port for the protocol.
+    """
+    if port is None:
+        port = AMT_PROTOCOL_PORT_MAP[protocol]
+    path = '/wsman'
+    return "%(protocol)s://%(address)s:%(port)s%(path)s" % {
+        'address': address,
+        'protocol': protocol,
+        'port': port,
+        'path': path}
+
 
 def pp_xml(body):
     """Pretty print format some XML so it's readable."""
+    # minidom is slow to import and only needed for display
+    import xml.dom.minidom
     pretty = xml.dom.minidom.parseString(body)
     return pretty.toprettyxml(indent="  ")
 
 
+class AMTError(Exception):
+    """Base class for errors reported by amt.client."""
+
+
+class ReturnValueError(AMTError):
+    """A method invoked on the AMT host returned a non zero ReturnValue.
+
+    The full response is available as result.
+    """
+
+    def __init__(self, result):
+        self.result = result
+        self.return_value = result.return_value
+        method = None
+        for key in _parse_body(result.raw):
+            method = key[:-len('_OUTPUT')] if key.endswith('_OUTPUT') else key
+            break
+        self.method = method
+        super(ReturnValueError, self).__init__(
+            "%s failed with ReturnValue %s" % (method or 'Request',
+                                               result.return_value))
+
+
+class HostUnavailable(AMTError, requests.exceptions.ConnectionError):
+    """The host failed to connect recently, so the request wasn't made.
+
+    See amt.health. It is a ConnectionError, so callers that expect
+    hosts to come and go treat it like any other.
+    """
+
+
+class Result(object):
+    """The response to a request made by a Client.
+
+    return_value is the ReturnValue of a method call (None for requests
+    that don't have one), elapsed the seconds the request took
+    (including any retries) and raw the response bytes. fields, the
+    properties in the response body as a dict, is only parsed on first
+    use, and pretty() only formats the XML when asked to.
+    """
+
+    __slots__ = ('raw', 'return_value', 'elapsed', '_fields')
+
+    def __init__(self, raw, return_value=None, elapsed=None):
+        self.raw = raw
+        self.return_value = return_value
+        self.elapsed = elapsed
+        self._fields = None
+
+    @property
+    def ok(self):
+        return not self.return_value
+
+    @property
+    def fields(self):
+        if self._fields is None:
+            self._fields = _body_fields(self.raw)
+        return self._fields
+
+    def pretty(self):
+        return pp_xml(self.raw)
+
+    def __repr__(self):
+        return "<Result return_value=%r elapsed=%r>" % (self.return_value,
+                                                        self.elapsed)
+
+
+class _DigestState(object):
+    """HTTPDigestAuth's thread local state, with the server's challenge
+    and nonce count shared by all threads.
+    """
+    _shared = ('chal', 'last_nonce', 'nonce_count')
+
+    def __init__(self):
+        self.__dict__.update(_local=threading.local(), chal={},
+                             last_nonce='', nonce_count=0)
+
+    def __getattr__(self, name):
+        # only called for the per request attributes, the shared ones
+        # are found in __dict__
+        return getattr(self._local, name)
+
+    def __setattr__(self, name, value):
+        if name in self._shared:
+            self.__dict__[name] = value
+        else:
+            setattr(self._local, name, value)
+
+
+class _DigestAuth(HTTPDigestAuth):
+    """Digest auth that reuses the nonce across threads.
+
+    requests keeps the challenge per thread, so a Client used from a
+    pool of threads (amt.fleet, amt.daemon) would go through a 401
+    round trip on every new thread.
+    """
+
+    def __init__(self, username, password):
+        super(_DigestAuth, self).__init__(username, password)
+        self._thread_local = _DigestState()
+        self._lock = threading.Lock()
+
+    def init_per_thread_state(self):
+        state = self._thread_local
+        if not hasattr(state, 'init'):
+            state.init = True
+            state.pos = None
+            state.num_401_calls = None
+
+    def build_digest_header(self, method, url):
+        # the nonce count has to go up by one per request
+        with self._lock:
+            return super(_DigestAuth, self).build_digest_header(method, url)
+
+
+class _TLSSocket(ssl.SSLSocket):
+    """Hands its TLS session back to the context when closed."""
+
+    def close(self):
+        self.context._remember(self)
+        super(_TLSSocket, self).close()
+
+
+class _TLSContext(ssl.SSLContext):
+    """An SSLContext that resumes TLS sessions.
+
+    The TLS stack in the management engine is slow enough that a full
+    handshake costs far more than the request that follows it. urllib3
+    has no notion of session resumption, but it does wrap its sockets
+    with the context it is given, so this hands each new connection
+    the most recent session seen on the host's other connections.
+    Use one per host, a session can only be resumed with the server
+    that issued it.
+    """
+    sslsocket_class = _TLSSocket
+
+    def __new__(cls):
+        return super(_TLSContext, cls).__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self):
+        # urllib3 sets verify_mode per connection and checks the
+        # hostname (or pinned fingerprint) itself
+        self.check_hostname = False
+        self.handshakes = 0
+        self.resumed = 0
+        self._session = None
+        self._sockets = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def _remember(self, sock):
+        session = sock.session
+        if session is not None:
+            self._session = session
+
+    def _latest_session(self):
+        # with TLS 1.3 the session ticket arrives after the handshake,
+        # so look at the open connections for the freshest one
+        for sock in list(self._sockets):
+            self._remember(sock)
+        return self._session
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        with self._lock:
+            if kwargs.get('session') is None:
+                kwargs['session'] = self._latest_session()
+        sock = super(_TLSContext, self).wrap_socket(sock, *args, **kwargs)
+        with self._lock:
+            self.handshakes += 1
+            if sock.session_reused:
+                self.resumed += 1
+            self._sockets.add(sock)
+        return sock
+
+
+class _ExchangeTimer(threading.local):
+    """How long this thread's current request spent connecting, and
+    waiting for the response headers of each HTTP exchange.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.connect = 0.0
+        # (connect, wait) per response, the digest challenge is one
+        self.exchanges = []
+        self._pending = 0.0
+
+    def connected(self, seconds):
+        self.connect += seconds
+        self._pending += seconds
+
+    def responded(self, seconds):
+        self.exchanges.append((self._pending, seconds))
+        self._pending = 0.0
+
+
+_timer = _ExchangeTimer()
+
+
+class _TimedConnectionMixin(object):
+
+    def connect(self):
+        start = amt.utils.now()
+        try:
+            super(_TimedConnectionMixin, self).connect()
+        finally:
+            _timer.connected(amt.utils.now() - start)
+
+    def getresponse(self, *args, **kwargs):
+        start = amt.utils.now()
+        resp = super(_TimedConnectionMixin, self).getresponse(*args, **kwargs)
+        _timer.responded(amt.utils.now() - start)
+        return resp
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin,
+                           urllib3.connection.HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin,
+                            urllib3.connection.HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TLSAdapter(HTTPAdapter):
+    """An HTTPAdapter that passes extra TLS options to urllib3.
+
+    With timed=True its connections record connect and response times
+    in _timer, for metrics.
+    """
+
+    def __init__(self, tls_options, timed=False, **kwargs):
+        self.tls_options = tls_options
+        self.timed = timed
+        super(_TLSAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.update(self.tls_options)
+        super(_TLSAdapter, self).init_poolmanager(*args, **kwargs)
+        if self.timed:
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': _TimedHTTPConnectionPool,
+                'https': _TimedHTTPSConnectionPool,
+            }
+
+
+def _change_op(func):
+    # with a guard, run the whole operation as one turn on the host
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.guard is None:
+            return func(self, *args, **kwargs)
+        with self.guard.turn(self.uri):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def _read_op(func):
+    # with a guard, share the result of identical reads in flight
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.guard is None:
+            return func(self, *args, **kwargs)
+        key = (func.__name__, repr(args), repr(sorted(kwargs.items())))
+        return self.guard.read(self.uri, key,
+                               lambda: func(self, *args, **kwargs))
+    return wrapper
+
+
 class Client(object):
     """AMT client.
 
     Manage interactions with AMT host.
+
+    Passing an amt.cache.TTLCache as cache turns on caching of read
+    only queries (power_status, vnc_status, get, get_properties). The
+    cache may be shared between clients. Anything this client changes
+    is dropped from the cache straight away.
+
+    timeout is a (connect, read) tuple, or a single number for both.
+    Reads (Get, Enumerate) that fail with a connection error, timeout
+    or 503 are retried up to retries times, with backoff starting at
+    retry_backoff seconds. Changes (power actions, boot config, etc)
+    are only retried if the connection could not be made at all, so
+    they are never sent twice. At most max_connections requests are in
+    flight to the host at once, further requests wait their turn.
+
+    With protocol='https' the host's certificate is checked against the
+    system CAs, or the CA bundle given as verify (verify=False turns
+    checking off). Alternatively the certificate can be pinned by
+    passing the hex md5, sha1 or sha256 of it as fingerprint, which is
+    the easiest way to trust AMT's self signed certificates. TLS
+    sessions are resumed across connections, and across close().
+
+    Passing an amt.metrics.Metrics as metrics records the timing, by
+    phase, and outcome of every request. It may be shared between
+    clients.
+
+    Passing an amt.health.Health as health fails requests straight
+    away, with HostUnavailable, to a host that recently failed to
+    connect, rather than waiting for it to time out again. It may be
+    shared between clients.
+
+    Passing an amt.guard.HostGuard as guard makes calls to the same
+    host, from any thread and any client sharing the guard, take
+    turns in the order they were made, and lets identical reads in
+    flight share one request (and its result, which callers mustn't
+    modify).
     """
     def __init__(self, address, password,
                  username='admin', protocol='http',
-                 vncpasswd=None):
-        port = AMT_PROTOCOL_PORT_MAP[protocol]
-        path = '/wsman'
-        self.uri = "%(protocol)s://%(address)s:%(port)s%(path)s" % {
-            'address': address,
-            'protocol': protocol,
-            'port': port,
-            'path': path}
+                 vncpasswd=None, cache=None,
+                 timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 retry_backoff=0.5,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, port=None,
+                 verify=True, fingerprint=None, metrics=None,
+                 guard=None, health=None):
+        self.uri = wsman_uri(address, protocol, port)
         self.username = username
         self.password = password
         self.vncpassword = vncpasswd
+        self.cache = cache
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.max_connections = max_connections
+        self.verify = verify
+        self.fingerprint = fingerprint
+        self.metrics = metrics
+        self.guard = guard
+        self.health = health
+        # set while this thread waits for a power state change
+        self._waiting = threading.local()
+        self.tls_context = None
+        if protocol == 'https':
+            self.tls_context = _TLSContext()
+            if verify is True and not fingerprint:
+                # the CAs requests would have used
+                self.tls_context.load_verify_locations(
+                    requests.utils.DEFAULT_CA_BUNDLE_PATH)
+        self._session = None
+
+    @classmethod
+    def from_server(cls, server, **kwargs):
+        """A client for a server, as returned by HostDB.get_server."""
+        return cls(server['host'], server['passwd'],
+                   vncpasswd=server.get('vncpasswd'),
+                   protocol=server.get('protocol') or 'http',
+                   verify=server.get('cafile') or True,
+                   fingerprint=server.get('fingerprint'), **kwargs)
+
+    @property
+    def session(self):
+        """The HTTP session used to talk to the AMT host.
+
+        The session is created on first use and kept for the life of
+        the client so that the TCP connection is kept alive between
+        calls. The digest auth handler is attached to the session, so
+        once the first challenge has been answered the nonce is reused
+        (with an incrementing nonce count), from any thread, and follow
+        on requests don't need to go through another 401 round trip.
+        """
+        if self._session is None:
+            session = requests.Session()
+            tls_options = {}
+            if self.tls_context is not None:
+                tls_options['ssl_context'] = self.tls_context
+            if self.fingerprint:
+                tls_options['assert_fingerprint'] = self.fingerprint
+            adapter = _TLSAdapter(tls_options,
+                                  timed=self.metrics is not None,
+                                  pool_connections=1,
+                                  pool_maxsize=self.max_connections,
+                                  pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.auth = _DigestAuth(self.username, self.password)
+            session.headers['content-type'] = (
+                'application/soap+xml;charset=UTF-8')
+            self._session = session
+        return self._session
+
+    def close(self):
+        """Close any connections held open to the AMT host."""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def _verify(self):
+        # passed on every request, as the session's setting loses out
+        # to REQUESTS_CA_BUNDLE in the environment
+        if self.fingerprint:
+            # the pin replaces CA checks, AMT certs are self signed
+            return False
+        return self.verify
+
+    def _send(self, payload, idempotent=False, event=None):
+        """Send a request, retrying it where that is safe."""
+        health = self.health
+        if health is None:
+            return self._attempts(payload, idempotent, event)
+        if getattr(self._waiting, 'power', False):
+            # the host is expected to drop off while its power changes,
+            # so don't wait on its breaker or count that against it.
+            # An answer still shows it's back.
+            try:
+                resp = self._attempts(payload, idempotent, event)
+            except requests.exceptions.HTTPError:
+                health.succeeded(self.uri)
+                raise
+            health.succeeded(self.uri)
+            return resp
+        if not health.allow(self.uri):
+            raise HostUnavailable(
+                "%s failed to connect recently, not trying again for "
+                "%ds" % (self.uri, health.retry_in(self.uri)))
+        try:
+            resp = self._attempts(payload, idempotent, event)
+        except requests.exceptions.SSLError:
+            # it's there, it just doesn't have the right certificate
+            health.succeeded(self.uri)
+            raise
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout):
+            health.failed(self.uri)
+            raise
+        except requests.exceptions.HTTPError:
+            health.succeeded(self.uri)
+            raise
+        except BaseException:
+            health.abandon(self.uri)
+            raise
+        health.succeeded(self.uri)
+        return resp
+
+    def _attempts(self, payload, idempotent=False, event=None):
+        delays = amt.utils.backoff(self.retry_backoff, 5.0)
+        attempt = 0
+        while True:
+            attempt += 1
+            retry = attempt <= self.retries
+            if event is not None:
+                event.attempt()
+                _timer.reset()
+            try:
+                resp = self.session.post(self.uri, data=payload,
+                                         timeout=self.timeout,
+                                         verify=self._verify)
+                if not (retry and idempotent and resp.status_code == 503):
+                    resp.raise_for_status()
+                    return resp
+            except requests.exceptions.SSLError:
+                # a bad certificate isn't going to get any better
+                raise
+            except requests.exceptions.ConnectTimeout:
+                # never got as far as sending anything
+                if not retry:
+                    raise
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                if not (retry and idempotent):
+                    raise
+            time.sleep(next(delays))
+
+    def _exchange(self, payload, parse, idempotent=False):
+        """Send a request, and return parse(response content)."""
+        metrics = self.metrics
+        if metrics is None:
+            return parse(self._send(payload, idempotent).content)
+
+        event = metrics.start(self.uri, amt.wsman.action_name(payload))
+        try:
+            resp = self._send(payload, idempotent, event)
+            event.status = resp.status_code
+            _record_phases(event, resp)
+            start = amt.utils.now()
+            value = parse(resp.content)
+            event.phases['parse'] = amt.utils.now() - start
+            return value
+        except Exception as e:
+            event.error = e
+            response = getattr(e, 'response', None)
+            if response is not None:
+                event.status = response.status_code
+            raise
+        finally:
+            metrics.finish(event)
+
+    def _cached(self, resource, prop, fetch, use_cache=True):
+        if self.cache is None or not use_cache:
+            return fetch()
+        key = (self.uri, resource, prop)
+        value = self.cache.get(key)
+        if value is amt.cache.MISSING:
+            # not stored if a change invalidates it mid fetch
+            generation = self.cache.generation(key)
+            value = fetch()
+            self.cache.set(key, value, generation)
+        return value
 
+    def _invalidate(self, resources):
+        if self.cache is not None:
+            for resource in resources:
+                self.cache.invalidate(self.uri, resource)
+
+    def _change(self, resources, payload, ns=None):
+        try:
+            return self.post(payload, ns)
+        finally:
+            self._invalidate(resources)
+
+    @_change_op
     def post(self, payload, ns=None):
-        resp = requests.post(self.uri,
-                             headers={'content-type':
-                                      'application/soap+xml;charset=UTF-8'},
-                             auth=HTTPDigestAuth(self.username, self.password),
-                             data=payload)
-        resp.raise_for_status()
-        if ns:
-            rv = _return_value(resp.content, ns)
-            if rv == 0:
-                return 0
-            print(pp_xml(resp.content))
-        else:
-            return 0
+        """Send a request, returning its Result.
+
+        If ns is given the response must carry a ReturnValue in that
+        namespace, and ReturnValueError is raised if it isn't 0.
+        """
+        start = amt.utils.now()
+        return self._exchange(
+            payload,
+            lambda content: _result(content, ns, amt.utils.now() - start))
+
+    @_change_op
+    def _power_change(self, state):
+        payload = amt.wsman.power_state_request(self.uri, state)
+        return self._change(_POWER_RESOURCES, payload,
+                            CIM_PowerManagementService)
 
     def power_on(self):
         """Power on the box."""
-        payload = amt.wsman.power_state_request(self.uri, "on")
-        return self.post(payload, CIM_PowerManagementService)
+        return self._power_change("on")
 
     def power_off(self):
         """Power off the box."""
-        payload = amt.wsman.power_state_request(self.uri, "off")
-        return self.post(payload, CIM_PowerManagementService)
+        return self._power_change("off")
 
     def power_cycle(self):
         """Power cycle the box."""
-        payload = amt.wsman.power_state_request(self.uri, "reboot")
-        return self.post(payload, CIM_PowerManagementService)
+        return self._power_change("reboot")
 
     def pxe_next_boot(self):
         """Sets the machine to PXE boot on its next reboot
 
         Will default back to normal boot list on the reboot that follows.
         """
-        self.set_next_boot(boot_device='pxe')
+        return self.set_next_boot(boot_device='pxe')
 
+    @_change_op
     def set_next_boot(self, boot_device):
         """Sets the machine to boot to boot_device on its next reboot
 
         Will default back to normal boot list on the reboot that follows.
+
+        Both the boot order and the boot config role are always
+        written. The role is used up by any boot, including ones this
+        client didn't cause, so nothing remembered about it can be
+        trusted. Returns the Result of the last request.
         """
         payload = amt.wsman.change_boot_order_request(self.uri, boot_device)
-        self.post(payload)
+        self._change(_BOOT_RESOURCES, payload, CIM_BootConfigSetting)
 
         payload = amt.wsman.enable_boot_config_request(self.uri)
-        self.post(payload)
-
-    def power_status(self):
-        payload = amt.wsman.get_request(
-            self.uri,
-            CIM_AssociatedPowerManagementService)
-        resp = requests.post(self.uri,
-                             auth=HTTPDigestAuth(self.username, self.password),
-                             data=payload)
-        resp.raise_for_status()
-        value = _find_value(
-            resp.content,
-            CIM_AssociatedPowerManagementService,
-            "PowerState")
-        return value
+        return self._change(_BOOT_RESOURCES, payload, CIM_BootService)
+
+    @_read_op
+    def boot_source(self, use_cache=True):
+        """The boot device the boot config points at.
+
+        This is a name from amt.wsman.BOOT_DEVICES ('pxe', 'hd', ...),
+        the InstanceID of a source that isn't one of those, or None if
+        no source is set. Cached like power_status.
+        """
+        return self._cached(
+            CIM_OrderedComponent, 'boot_source',
+            lambda: _boot_source(self.enumerate(CIM_OrderedComponent)),
+            use_cache)
+
+    @_read_op
+    def boot_config_role(self, use_cache=True):
+        """Whether the boot config will be used on the next boot.
+
+        Cached like power_status.
+        """
+        return self._cached(
+            CIM_ElementSettingData, 'IsNext',
+            lambda: _boot_config_next(
+                self.enumerate(CIM_ElementSettingData)),
+            use_cache)
+
+    @_read_op
+    def power_status(self, use_cache=True):
+        def fetch():
+            payload = amt.wsman.get_request(
+                self.uri,
+                CIM_AssociatedPowerManagementService)
+            return self._exchange(
+                payload,
+                lambda content: _find_value(
+                    content,
+                    CIM_AssociatedPowerManagementService,
+                    "PowerState"),
+                idempotent=True)
+
+        return self._cached(CIM_AssociatedPowerManagementService,
+                            "PowerState", fetch, use_cache)
+
+    def _poll_power(self, reached, timeout, interval, max_interval):
+        # poll the power state until reached(state) is true, a state of
+        # None meaning the box didn't answer
+        deadline = amt.utils.now() + timeout
+        delays = amt.utils.backoff(interval, max_interval)
+        self._waiting.power = True
+        try:
+            while True:
+                try:
+                    current = self.power_status(use_cache=False)
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout):
+                    current = None
+                else:
+                    if current is None:
+                        raise AMTError("No PowerState in response")
+                    current = int(current)
+                if reached(current):
+                    return True
+                remaining = deadline - amt.utils.now()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(next(delays), remaining))
+        finally:
+            self._waiting.power = False
+
+    def wait_for_power_state(self, state, timeout=120, interval=1.0,
+                             max_interval=10.0):
+        """Wait for the box to reach a power state.
+
+        state is a name from amt.wsman.POWER_STATES ('on', 'off', ...)
+        or its CIM value, anything else is a ValueError. The power
+        state is polled, starting every
+        interval seconds and backing off to max_interval. Connection
+        errors are expected while a box is mid reboot, so they are
+        treated as not being in the state yet.
 
+        Returns True once the state is reached, or False if it isn't
+        within timeout seconds. The polls bypass health: a host that
+        drops off while it reboots isn't marked down, and one that
+        answers is marked up again.
+        """
+        wanted = amt.wsman.power_state_value(state)
+        return self._poll_power(lambda current: current == wanted,
+                                timeout, interval, max_interval)
+
+    def wait_for_power_change(self, state, timeout=120, interval=1.0,
+                              max_interval=10.0):
+        """Wait for the box to leave a power state.
+
+        The counterpart of wait_for_power_state, for telling that a
+        reset has actually started: a box that was on keeps saying so
+        for a moment after power_cycle. Not answering counts as having
+        left the state.
+
+        Returns True once the state is left, or False if the box is
+        still in it after timeout seconds.
+        """
+        wanted = amt.wsman.power_state_value(state)
+        return self._poll_power(lambda current: current != wanted,
+                                timeout, interval, max_interval)
+
+    @_read_op
+    def get(self, resource, selectors=None, use_cache=True):
+        """Get an instance of resource, as a dict of its properties.
+
+        resource is a uri or class name (see amt.wsman.resource_uri),
+        and selectors (a dict) picks out the instance if there are
+        several.
+        """
+        resource = amt.wsman.resource_uri(resource)
+
+        def fetch():
+            payload = amt.wsman.get_request(self.uri, resource, selectors)
+            return self._exchange(payload, _body_fields, idempotent=True)
+
+        key = tuple(sorted(selectors.items())) if selectors else None
+        return dict(self._cached(resource, key, fetch, use_cache))
+
+    def get_properties(self, resource, keys=None):
+        """Get the properties of an instance of resource.
+
+        Returns a dict of all the instance's properties, or only of
+        those named in keys (missing ones are None).
+        """
+        instance = self.get(resource)
+        if keys is None:
+            return instance
+        return dict((key, instance.get(key)) for key in keys)
+
+    @_change_op
+    def put(self, resource, properties, selectors=None, affects=()):
+        """Replace the properties of an instance of resource, returning
+        the Result (whose fields are the instance as updated).
+
+        See amt.wsman.put_request for properties. Anything cached about
+        resource, or the resources listed in affects, is dropped.
+        """
+        resource = amt.wsman.resource_uri(resource)
+        payload = amt.wsman.put_request(self.uri, resource, properties,
+                                        selectors)
+        return self._change(self._affected(resource, affects), payload)
+
+    @_change_op
+    def invoke(self, resource, method, selectors=None, params=None,
+               affects=()):
+        """Invoke method of an instance of resource, returning the
+        Result.
+
+        See amt.wsman.invoke_request for selectors and params.
+        ReturnValueError is raised if the method returns anything but
+        0. Anything cached about resource, or the resources listed in
+        affects (those whose state the method changes), is dropped.
+        """
+        resource = amt.wsman.resource_uri(resource)
+        payload = amt.wsman.invoke_request(self.uri, resource, method,
+                                           selectors, params)
+        return self._change(self._affected(resource, affects), payload,
+                            resource)
+
+    def _affected(self, resource, affects):
+        resources = set([resource])
+        resources.update(amt.wsman.resource_uri(r) for r in affects)
+        return resources
+
+    @_read_op
+    def enumerate(self, resource,
+                  max_elements=amt.wsman.DEFAULT_MAX_ELEMENTS):
+        """Get all the instances of resource, as a list of dicts.
+
+        resource is a uri or class name (see amt.wsman.resource_uri).
+        This uses an optimized enumeration, so up to max_elements
+        instances come back with the Enumerate itself, and Pull is only
+        needed for larger collections.
+        """
+        resource = amt.wsman.resource_uri(resource)
+        payload = amt.wsman.enumerate_request(
+            self.uri, resource, max_elements=max_elements)
+        response = self._exchange(payload, _parse_body, idempotent=True).get(
+            'EnumerateResponse') or {}
+        items = _enumeration_items(response)
+        while 'EndOfSequence' not in response:
+            context = response.get('EnumerationContext')
+            if not context:
+                break
+            payload = amt.wsman.pull_request(
+                self.uri, resource, context, max_elements=max_elements)
+            response = self._exchange(payload, _parse_body).get(
+                'PullResponse') or {}
+            items.extend(_enumeration_items(response))
+        return items
+
+    @_change_op
     def enable_vnc(self):
         if self.vncpassword is None:
-            print("VNC Password was not set")
-            return False
+            raise AMTError("VNC Password was not set")
         payload = amt.wsman.enable_remote_kvm(self.uri, self.vncpassword)
-        self.post(payload)
+        self._change(_KVM_RESOURCES, payload)
         payload = amt.wsman.kvm_redirect(self.uri)
-        self.post(payload)
-        return True
+        return self._change(_KVM_RESOURCES, payload, CIM_KVMRedirectionSAP)
 
+    @_read_op
     def vnc_status(self):
-        payload = amt.wsman.get_request(
-            self.uri,
-            ('http://intel.com/wbem/wscim/1/ips-schema/1/'
-             'IPS_KVMRedirectionSettingData'))
-        resp = requests.post(self.uri,
-                             auth=HTTPDigestAuth(self.username, self.password),
-                             data=payload)
-        resp.raise_for_status()
-        return pp_xml(resp.content)
+        """The KVM redirection settings, as a Result."""
+        def fetch():
+            payload = amt.wsman.get_request(
+                self.uri, IPS_KVMRedirectionSettingData)
+            start = amt.utils.now()
+            return self._exchange(
+                payload,
+                lambda content: Result(content,
+                                       elapsed=amt.utils.now() - start),
+                idempotent=True)
 
+        return self._cached(IPS_KVMRedirectionSettingData, "*", fetch)
+
+
+class _Found(Exception):
+    pass
 
-def _find_value(content, ns, key):
-    """Find the return value in a CIM response.
+
+class _Extractor(object):
+    """Pull the text of the first ns:key element out of a CIM response.
 
     The xmlns is needed because everything in CIM is a million levels
     of namespace indirection.
+
+    Responses are fed straight through expat, with no tree built, and
+    parsing stops as soon as the element we want is closed. Extractors
+    are built once per (namespace, key), see _extractor.
     """
-    doc = ElementTree.fromstring(content)
-    query = './/{%(ns)s}%(item)s' % {'ns': ns, 'item': key}
-    rv = doc.find(query)
-    return rv.text
+    def __init__(self, ns, key):
+        self.name = '%s %s' % (ns, key)
+
+    def __call__(self, content):
+        parser = expat.ParserCreate(namespace_separator=' ')
+        parser.buffer_text = True
+        text = []
+
+        def end(name):
+            if name == self.name:
+                raise _Found()
+
+        def start(name, attrs):
+            if name == self.name:
+                parser.CharacterDataHandler = text.append
+                parser.EndElementHandler = end
+
+        parser.StartElementHandler = start
+        try:
+            parser.Parse(content, True)
+        except _Found:
+            return ''.join(text)
+
+
+_extractors = {}
+
+
+def _extractor(ns, key):
+    try:
+        return _extractors[(ns, key)]
+    except KeyError:
+        return _extractors.setdefault((ns, key), _Extractor(ns, key))
+
+
+def _find_value(content, ns, key):
+    """Find the value of key in a CIM response.
+
+    Returns None if there is no such element.
+    """
+    return _extractor(ns, key)(content)
 
 
 def _return_value(content, ns):
     """Find the return value in a CIM response.
 
-    The xmlns is needed because everything in CIM is a million levels
-    of namespace indirection.
+    Returns None if there isn't one.
+    """
+    value = _find_value(content, ns, 'ReturnValue')
+    if value is None:
+        return None
+    return int(value)
+
+
+def _result(content, ns, elapsed):
+    """The Result of a response, checking its ReturnValue if ns is given."""
+    if not ns:
+        return Result(content, elapsed=elapsed)
+    result = Result(content, _return_value(content, ns), elapsed)
+    if result.return_value is None:
+        raise AMTError("No ReturnValue in response")
+    if result.return_value != 0:
+        raise ReturnValueError(result)
+    return result
+
+
+def _local(name):
+    return name.rpartition(' ')[2]
+
+
+def _parse_body(content):
+    """Turn the SOAP Body of a response into python dicts.
+
+    Every element becomes a key, by its local name (CIM namespaces
+    repeat the class name anyway). Elements that only hold text become
+    strings (None for xsi:nil), elements with children become dicts,
+    and repeated elements become lists.
     """
-    doc = ElementTree.fromstring(content)
-    query = './/{%(ns)s}%(item)s' % {'ns': ns, 'item': 'ReturnValue'}
-    rv = doc.find(query)
-    return int(rv.text)
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.buffer_text = True
+    body_name = _SOAP_ENVELOPE + ' Body'
+    nil_name = _XSI + ' nil'
+    # stack of [children dict, text chunks, nil] for open elements
+    # inside the body
+    stack = []
+    result = {}
+
+    def start(name, attrs):
+        if stack:
+            stack.append([None, [], attrs.get(nil_name) == 'true'])
+        elif name == body_name:
+            stack.append([result, [], False])
+
+    def end(name):
+        if not stack:
+            return
+        children, text, nil = stack.pop()
+        if not stack:
+            # closed the body itself, nothing else we care about
+            raise _Found()
+        if children is not None:
+            value = children
+        elif nil:
+            value = None
+        else:
+            value = ''.join(text)
+        parent = stack[-1]
+        if parent[0] is None:
+            parent[0] = {}
+        key = _local(name)
+        if key in parent[0]:
+            existing = parent[0][key]
+            if not isinstance(existing, list):
+                existing = parent[0][key] = [existing]
+            existing.append(value)
+        else:
+            parent[0][key] = value
+
+    def data(chunk):
+        if stack:
+            stack[-1][1].append(chunk)
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = data
+    try:
+        parser.Parse(content, True)
+    except _Found:
+        pass
+    return result
+
+
+def _record_phases(event, resp):
+    """Split the time of the last attempt at a request into phases."""
+    now = amt.utils.now()
+    exchanges = _timer.exchanges
+    connect = _timer.connect
+    server = exchanges[-1][1] if exchanges else 0.0
+    # the 401 round trips, less any connecting done for them
+    challenge = max(sum(r.elapsed.total_seconds() for r in resp.history) -
+                    sum(c for c, wait in exchanges[:-1]), 0.0)
+    event.phases.update(
+        retry=event.attempt_start - event.start,
+        connect=connect,
+        challenge=challenge,
+        server=server,
+        transfer=max(now - event.attempt_start - connect - challenge -
+                     server, 0.0))
+
+
+def _selector(reference):
+    """The selector value of an endpoint reference, None if it has none."""
+    try:
+        value = reference['ReferenceParameters']['SelectorSet']['Selector']
+    except (KeyError, TypeError):
+        return None
+    values = _as_list(value)
+    return values[0] if values else None
+
+
+def _boot_source(components):
+    """The first boot source of the boot config, from the instances of
+    CIM_OrderedComponent."""
+    for item in components:
+        if _selector(item.get('GroupComponent')) not in (None, _BOOT_CONFIG):
+            continue
+        if item.get('AssignedSequence') == '1':
+            source = _selector(item.get('PartComponent'))
+            return _BOOT_DEVICE_NAMES.get(source, source)
+    return None
+
+
+def _boot_config_next(settings):
+    """Whether the boot config is set for the next boot, from the
+    instances of CIM_ElementSettingData."""
+    for item in settings:
+        if _selector(item.get('SettingData')) == _BOOT_CONFIG:
+            return item.get('IsNext') == '1'
+    return False
+
+
+def _body_fields(content):
+    """The properties of the (first) element in a response's Body."""
+    for value in _parse_body(content).values():
+        return value or {}
+    return {}
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _enumeration_items(response):
+    """The instances carried in an Enumerate or Pull response."""
+    items = []
+    for instances in (response.get('Items') or {}).values():
+        items.extend(_as_list(instances))
+    return items
@@ -0,0 +1,55 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""The control commands exposed by amtctrl.
+
+These are kept out of the amtctrl script so that the same dispatch can
+be used for a single host, or fanned out across a fleet.
+"""
+
+import amt.wsman
+
+COMMANDS = ('on', 'off', 'reboot', 'pxeboot', 'status', 'vnc', 'vncstatus')
+
+
+class UnknownCommand(Exception):
+    def __init__(self, command):
+        super(UnknownCommand, self).__init__(
+            "Unknown command %s, try one of %s"
+            % (command, ", ".join(COMMANDS)))
+        self.command = command
+
+
+def run_command(client, command):
+    """Run an amtctrl command against a client.
+
+    Returns the text that should be displayed to the user, or None if
+    the command has no output.
+    """
+    if command == "on":
+        client.power_on()
+    elif command == "off":
+        client.power_off()
+    elif command == "reboot":
+        client.power_cycle()
+    elif command == "pxeboot":
+        client.pxe_next_boot()
+        client.power_cycle()
+    elif command == "status":
+        return amt.wsman.friendly_power_state(client.power_status())
+    elif command == "vnc":
+        client.enable_vnc()
+        return "VNC enabled on port 5900 with AMT password"
+    elif command == "vncstatus":
+        return client.vnc_status().pretty()
+    else:
+        raise UnknownCommand(command)
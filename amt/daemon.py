@@ -0,0 +1,300 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A long running amtctrl, driven over a Unix socket.
+
+Every amtctrl run pays for interpreter startup, imports, and a fresh
+connection and digest handshake with each AMT host. ``amtctrl daemon``
+pays those once: it keeps the host db open and a warm Client (and so
+an open connection and a digest nonce) per host, and takes commands
+over a Unix socket in the amtctrl config dir. While it is running
+amtctrl forwards control commands to it.
+
+The protocol is one JSON object per line in each direction, any
+number of requests per connection::
+
+    {"op": "ping"}
+    => {"pid": 1234}
+    {"op": "run", "target": "rack=r12", "command": "status"}
+    => {"fleet": true, "results": [["n1", "on", null], ...]}
+
+Each result is [name, output, error]. A request that can't be run at
+all gets {"error": "..."}. A run with "ignore_health": true is sent to
+hosts even if they are known to be down.
+
+This module is imported by amtctrl on every control command, so the
+HTTP stack is only imported by the daemon itself.
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import signal
+import socket
+import threading
+
+from six.moves import socketserver
+
+import amt.guard
+import amt.health
+import amt.hostdb
+import amt.utils
+
+SOCKET_NAME = 'amtctrl.sock'
+
+# close the client of a host that hasn't been used in this long
+DEFAULT_IDLE_TIMEOUT = 300
+
+
+class NotRunning(Exception):
+    """There is no daemon listening on the socket."""
+
+
+class DaemonError(Exception):
+    pass
+
+
+def socket_path(confdir):
+    return os.path.join(confdir, SOCKET_NAME)
+
+
+def call(path, message, timeout=None):
+    """Send one request to the daemon at path, and return its reply.
+
+    Raises NotRunning if there is no daemon to talk to.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        raise NotRunning(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+        except socket.error:
+            # no socket, or a stale one left by a daemon that died
+            raise NotRunning(path)
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    finally:
+        sock.close()
+    if not line:
+        raise DaemonError("daemon closed the connection")
+    return json.loads(line.decode('utf-8'))
+
+
+def _new_client(server, kwargs):
+    import amt.client
+
+    return amt.client.Client.from_server(server, **kwargs)
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line.decode('utf-8'))
+                reply = self.server.dispatch(message)
+            except (KeyError, TypeError, ValueError) as e:
+                reply = {'error': 'Bad request: %r' % e}
+            except Exception as e:
+                # anything else (the host db failing, say) is reported
+                # rather than dropping the connection
+                reply = {'error': 'Internal error: %s' % e}
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve amtctrl commands on a Unix socket.
+
+    db is the HostDB to look servers up in, it is read on every
+    request so changes made by other amtctrl runs are seen straight
+    away. client_kwargs are passed on to every Client created, by
+    default with a HostGuard and an amt.health.Health (kept in the
+    config dir) shared by all of them.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, db, client_kwargs=None,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self._check_stale(path)
+        # the socket gives access to every server's password, so keep
+        # it private
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, Handler)
+        finally:
+            os.umask(umask)
+        self.path = path
+        self.db = db
+        self.client_kwargs = dict(client_kwargs or {})
+        # every connection shares the clients, so make calls to a host
+        # take turns rather than hit it in parallel
+        self.client_kwargs.setdefault('guard', amt.guard.HostGuard())
+        # hosts that are down fail fast, and are probed in the
+        # background until they come back
+        self.health = None
+        if 'health' not in self.client_kwargs:
+            self.health = amt.health.Health(path=os.path.join(
+                db.confdir, amt.health.HEALTH_NAME)).load().start()
+            self.client_kwargs['health'] = self.health
+        self.idle_timeout = idle_timeout
+        # name => (server, client, last used)
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def _check_stale(path):
+        if not os.path.exists(path):
+            return
+        try:
+            call(path, {'op': 'ping'}, timeout=5)
+        except NotRunning:
+            os.unlink(path)
+        else:
+            raise DaemonError("amtctrl daemon already running on %s" % path)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        args=(0.1,),
+                                        name='amtctrl-daemon')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        with self._lock:
+            clients = self._clients
+            self._clients = {}
+        for server, client, used in clients.values():
+            client.close()
+        if self.health is not None:
+            self.health.stop()
+            self.health.save()
+
+    def client(self, name, server):
+        """A warm Client for server, creating it if needed."""
+        now = amt.utils.now()
+        idle = []
+        with self._lock:
+            entry = self._clients.pop(name, None)
+            if entry is not None and entry[0] != server:
+                # changed in the host db since
+                idle.append(entry[1])
+                entry = None
+            if entry is None:
+                client = _new_client(server, self.client_kwargs)
+            else:
+                client = entry[1]
+            self._clients[name] = (server, client, now)
+            for other, entry in list(self._clients.items()):
+                if now - entry[2] > self.idle_timeout:
+                    idle.append(entry[1])
+                    del self._clients[other]
+        for old in idle:
+            old.close()
+        return client
+
+    def dispatch(self, message):
+        op = message.get('op')
+        if op == 'ping':
+            return {'pid': os.getpid()}
+        elif op == 'run':
+            return self.run(message['target'], message['command'],
+                            message.get('concurrency'),
+                            message.get('ignore_health', False))
+        return {'error': 'Unknown op %s' % op}
+
+    def run(self, target, command, concurrency=None, ignore_health=False):
+        """Run command on target, a server name or selector.
+
+        With ignore_health the hosts are tried even if they are known
+        to be down, by fresh clients that don't share the breakers.
+        """
+        import amt.commands
+        import amt.fleet
+
+        if command not in amt.commands.COMMANDS:
+            return {'error': str(amt.commands.UnknownCommand(command))}
+
+        fleet = amt.hostdb.is_pattern(target)
+        with self._db_lock:
+            if fleet:
+                try:
+                    names = self.db.resolve(target)
+                except ValueError as e:
+                    return {'error': str(e)}
+                if not names:
+                    return {'error': "No servers in hostdb match %s"
+                            % target}
+            else:
+                names = [target]
+            targets = [(name, self.db.get_server(name, quiet=True))
+                       for name in names]
+        if not fleet and not targets[0][1]:
+            return {'error': "Server %s not found in hostdb" % target}
+
+        def run_one(name, server):
+            if not server:
+                raise LookupError("not found in hostdb")
+            if not ignore_health:
+                return amt.commands.run_command(self.client(name, server),
+                                                command)
+            kwargs = dict(self.client_kwargs, health=None)
+            client = _new_client(server, kwargs)
+            try:
+                return amt.commands.run_command(client, command)
+            finally:
+                client.close()
+
+        results = amt.fleet.run(targets, run_one,
+                                concurrency or amt.fleet.DEFAULT_CONCURRENCY)
+        return {'fleet': fleet,
+                'results': [[r.name, r.value,
+                             None if r.ok else str(r.error)]
+                            for r in results]}
+
+
+def serve(db, client_kwargs=None):
+    """Run a daemon for db in the foreground, until interrupted."""
+    path = socket_path(db.confdir)
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+    daemon = Daemon(path, db, client_kwargs)
+    print("amtctrl daemon listening on %s" % path)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
@@ -0,0 +1,655 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A fake AMT endpoint, for testing without vPro hardware.
+
+One FakeAMT server simulates any number of AMT hosts. Each simulated
+host is an IP address; the host a request is for is the local address
+the connection came in on. On Linux all of 127.0.0.0/8 is loopback, so
+binding to 0.0.0.0 (or running one server per address) gives you as
+many hosts as you like on one box::
+
+    python -m amt.fakeamt --hosts 1000 --bind 0.0.0.0
+
+simulates 127.1.0.1 through 127.1.3.232 on port 16992, all with the
+password given by --password.
+
+The server does real digest auth and understands the WS-Man messages
+amt sends: Get, Enumerate / Pull, RequestPowerStateChange,
+ChangeBootOrder, SetBootConfigRole, Put of the KVM settings and
+RequestStateChange of the KVM redirection SAP. Each host keeps its
+own state, and can be made slow (latency), flaky (error_rate, or a
+queue of errors), slow to change power state (power_delay) or
+completely wedged (hang).
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import hashlib
+import itertools
+import os
+import random
+import ssl
+import sys
+import threading
+import time
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+import amt.wsman
+
+DEFAULT_PASSWORD = 'P@ssw0rd'
+REALM = 'Digest:F3EB554784E729164447A89F60B641C5'
+
+_SOAP = 'http://www.w3.org/2003/05/soap-envelope'
+_ADDRESSING = 'http://schemas.xmlsoap.org/ws/2004/08/addressing'
+_WSMAN = 'http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd'
+_ENUMERATION = 'http://schemas.xmlsoap.org/ws/2004/09/enumeration'
+_TRANSFER = 'http://schemas.xmlsoap.org/ws/2004/09/transfer'
+_ANONYMOUS = _ADDRESSING + '/role/anonymous'
+_IPS = 'http://intel.com/wbem/wscim/1/ips-schema/1/'
+_CIM = 'http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/'
+
+_BOOT_CONFIG = 'Intel(r) AMT: Boot Configuration 0'
+
+# how the power state settles after a RequestPowerStateChange
+_SETTLED_STATE = {2: 2, 4: 4, 5: 2, 7: 7, 8: 8}
+
+
+def _q(ns, tag):
+    return '{%s}%s' % (ns, tag)
+
+
+def _md5(*parts):
+    return hashlib.md5(':'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _parse_digest(header):
+    fields = {}
+    for item in header[len('Digest '):].split(','):
+        key, _, value = item.strip().partition('=')
+        fields[key] = value.strip('"')
+    return fields
+
+
+class Fault(Exception):
+    """A WS-Man fault, sent back as a SOAP fault."""
+
+    def __init__(self, subcode, reason, status=400):
+        super(Fault, self).__init__(reason)
+        self.subcode = subcode
+        self.reason = reason
+        self.status = status
+
+
+class FakeHost(object):
+    """The state of one simulated AMT host.
+
+    All the knobs can be changed at any time, while the server is
+    running:
+
+    latency: seconds added to every request
+    error_rate: chance (0-1) of answering a request with a 503
+    errors: list of HTTP status codes, used up one per request, to
+        return instead of a real answer
+    hang: when set, requests are read but never answered
+    power_delay: seconds before a power state change shows up
+    reset_lag: seconds before a reset is seen to start, the host keeps
+        reporting its old power state until then
+    """
+
+    def __init__(self, address, password=DEFAULT_PASSWORD,
+                 username='admin', firmware='11.8.50'):
+        self.address = address
+        self.username = username
+        self.password = password
+        self.firmware = firmware
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.errors = []
+        self.hang = False
+        self.power_delay = 0.0
+        self.reset_lag = 0.0
+        self.power_state = 2
+        self.requested_power_state = 2
+        self.boot_source = None
+        self.boot_role = None
+        self.kvm_settings = {
+            'DefaultScreen': '0',
+            'ElementName': 'Intel(r) KVM Redirection Settings',
+            'EnabledByMEBx': 'true',
+            'InstanceID': 'Intel(r) KVM Redirection Settings',
+            'Is5900PortEnabled': 'false',
+            'OptInPolicy': 'true',
+            'SessionTimeout': '0',
+        }
+        self.rfb_password = None
+        # 2 enabled, 3 disabled, 6 enabled but offline
+        self.kvm_state = 3
+        # number of requests, by action name
+        self.requests = collections.Counter()
+        self.lock = threading.Lock()
+        # (power state, time it shows up) still to come, in order
+        self._pending = []
+
+    def _settle(self):
+        now = time.time()
+        while self._pending and now >= self._pending[0][1]:
+            self.power_state = self._pending.pop(0)[0]
+
+    def set_power_state(self, state):
+        if state not in _SETTLED_STATE:
+            return 1
+        self.requested_power_state = state
+        settled = _SETTLED_STATE[state]
+        if state in (2, 5) and (state == 5 or self.power_state != 2):
+            # booting uses up the one time boot config
+            self.boot_role = None
+        now = time.time()
+        self._pending = []
+        if state == 5 and self.reset_lag:
+            now += self.reset_lag
+            # a reboot is seen as off while it happens
+            self._pending.append((8 if self.power_delay else 2, now))
+        elif state == 5:
+            self.power_state = 8 if self.power_delay else 2
+        if self.power_delay or self._pending:
+            self._pending.append((settled, now + self.power_delay))
+        else:
+            self.power_state = settled
+        return 0
+
+    def instances(self, resource):
+        """The instances of resource, as a list of property dicts."""
+        self._settle()
+        if resource == _CIM + 'CIM_AssociatedPowerManagementService':
+            return [{
+                'AvailableRequestedPowerStates': ['2', '8', '5'],
+                'PowerState': str(self.power_state),
+                'RequestedPowerState': str(self.requested_power_state),
+            }]
+        if resource == _CIM + 'CIM_BootSourceSetting':
+            return [{'ElementName': 'Intel(r) AMT: Boot Source',
+                     'FailThroughSupported': '2',
+                     'InstanceID': device,
+                     'StructuredBootString': None}
+                    for device in sorted(amt.wsman.BOOT_DEVICES.values())]
+        if resource == _CIM + 'CIM_BootConfigSetting':
+            return [{'ElementName': 'Intel(r) AMT: Boot Configuration',
+                     'InstanceID': _BOOT_CONFIG}]
+        if resource == _CIM + 'CIM_OrderedComponent':
+            # the boot sources of the boot config, the one set with
+            # ChangeBootOrder comes first
+            return [{'AssignedSequence': '1' if device == self.boot_source
+                     else '0',
+                     'GroupComponent': _Reference(
+                         _CIM + 'CIM_BootConfigSetting', 'InstanceID',
+                         _BOOT_CONFIG),
+                     'PartComponent': _Reference(
+                         _CIM + 'CIM_BootSourceSetting', 'InstanceID',
+                         device)}
+                    for device in sorted(amt.wsman.BOOT_DEVICES.values())]
+        if resource == _CIM + 'CIM_ElementSettingData':
+            return [{'IsCurrent': '1', 'IsDefault': '2',
+                     'IsNext': '1' if self.boot_role == 1 else '2',
+                     'ManagedElement': _Reference(
+                         _CIM + 'CIM_ComputerSystem', 'Name',
+                         'ManagedSystem'),
+                     'SettingData': _Reference(
+                         _CIM + 'CIM_BootConfigSetting', 'InstanceID',
+                         _BOOT_CONFIG)}]
+        if resource == _IPS + 'IPS_KVMRedirectionSettingData':
+            return [dict(self.kvm_settings)]
+        if resource == _CIM + 'CIM_KVMRedirectionSAP':
+            return [{'CreationClassName': 'CIM_KVMRedirectionSAP',
+                     'ElementName': 'KVM Redirection Service Access Point',
+                     'EnabledState': str(self.kvm_state),
+                     'Name': 'KVM Redirection Service Access Point',
+                     'RequestedState': str(self.kvm_state)}]
+        if resource == _CIM + 'CIM_SoftwareIdentity':
+            return [{'InstanceID': 'AMT', 'IsEntity': 'true',
+                     'VersionString': self.firmware},
+                    {'InstanceID': 'Flash', 'IsEntity': 'true',
+                     'VersionString': self.firmware},
+                    {'InstanceID': 'Build Number', 'IsEntity': 'true',
+                     'VersionString': '3000'}]
+        raise Fault('wsa:DestinationUnreachable',
+                    'No route can be determined to reach the destination '
+                    'role defined by the WS-Addressing To.')
+
+
+class _Reference(object):
+    """An endpoint reference to an instance, as a property value."""
+
+    def __init__(self, resource, selector, value):
+        self.resource = resource
+        self.selector = selector
+        self.value = value
+
+    def xml(self):
+        return ('<b:Address>%s</b:Address><b:ReferenceParameters>'
+                '<c:ResourceURI>%s</c:ResourceURI><c:SelectorSet>'
+                '<c:Selector Name="%s">%s</c:Selector>'
+                '</c:SelectorSet></b:ReferenceParameters>' % (
+                    _ANONYMOUS, self.resource, self.selector,
+                    escape(self.value)))
+
+
+def _instance_xml(resource, properties):
+    name = resource.rpartition('/')[2]
+    out = ['<g:%s xmlns:g="%s">' % (name, resource)]
+    for key in sorted(properties):
+        values = properties[key]
+        if not isinstance(values, list):
+            values = [values]
+        for value in values:
+            if value is None:
+                out.append('<g:%s xsi:nil="true"/>' % key)
+            elif isinstance(value, _Reference):
+                out.append('<g:%s>%s</g:%s>' % (key, value.xml(), key))
+            else:
+                out.append('<g:%s>%s</g:%s>' % (key, escape(value), key))
+    out.append('</g:%s>' % name)
+    return ''.join(out)
+
+
+def _envelope(action, relates_to, body):
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<a:Envelope xmlns:a="%(soap)s" xmlns:b="%(addr)s" '
+            'xmlns:c="%(wsman)s" xmlns:e="%(enum)s" '
+            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+            '<a:Header><b:To>%(anon)s</b:To>'
+            '<b:RelatesTo>%(relates)s</b:RelatesTo>'
+            '<b:Action a:mustUnderstand="true">%(action)s</b:Action>'
+            '<b:MessageID>uuid:%(id)s</b:MessageID>'
+            '</a:Header><a:Body>%(body)s</a:Body></a:Envelope>' % {
+                'soap': _SOAP, 'addr': _ADDRESSING, 'wsman': _WSMAN,
+                'enum': _ENUMERATION, 'anon': _ANONYMOUS,
+                'relates': escape(relates_to or ''), 'action': action,
+                'id': amt.wsman.message_id(), 'body': body,
+            }).encode('utf-8')
+
+
+def _fault(fault):
+    body = ('<a:Fault><a:Code><a:Value>a:Sender</a:Value>'
+            '<a:Subcode><a:Value>%s</a:Value></a:Subcode></a:Code>'
+            '<a:Reason><a:Text xml:lang="en-US">%s</a:Text></a:Reason>'
+            '</a:Fault>' % (fault.subcode, escape(fault.reason)))
+    return _envelope(_ADDRESSING + '/fault', None, body)
+
+
+def _output(resource, method, return_value):
+    return ('<g:%(method)s_OUTPUT xmlns:g="%(resource)s">'
+            '<g:ReturnValue>%(rv)d</g:ReturnValue>'
+            '</g:%(method)s_OUTPUT>' % {
+                'method': method, 'resource': resource, 'rv': return_value})
+
+
+def _selector(element, name):
+    """The value of a wsman selector somewhere under element."""
+    for selector in element.iter(_q(_WSMAN, 'Selector')):
+        if (selector.get('Name') == name or
+                selector.get(_q(_WSMAN, 'Name')) == name):
+            return selector.text
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, don't let them sit
+    # waiting on a delayed ack
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, *args)
+
+    def _reply(self, code, body=b'', headers=()):
+        self.send_response(code)
+        for key, value in headers:
+            self.send_header(key, value)
+        if body:
+            self.send_header('Content-Type',
+                             'application/soap+xml;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self, host):
+        header = self.headers.get('Authorization', '')
+        if not header.startswith('Digest '):
+            return False
+        f = _parse_digest(header)
+        if f.get('nonce') not in self.server.nonces:
+            return False
+        ha1 = _md5(f.get('username', ''), REALM, host.password)
+        ha2 = _md5(self.command, f.get('uri', ''))
+        expected = _md5(ha1, f['nonce'], f.get('nc', ''),
+                        f.get('cnonce', ''), f.get('qop', ''), ha2)
+        return (f.get('username') == host.username and
+                f.get('response') == expected)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        host = self.server.host_for(self.connection.getsockname()[0])
+        if host is None:
+            self._reply(404)
+            return
+        if not self._authorized(host):
+            self.server.challenges += 1
+            challenge = 'Digest realm="%s", nonce="%s", qop="auth"' % (
+                REALM, self.server.new_nonce())
+            self._reply(401, headers=[('WWW-Authenticate', challenge)])
+            return
+
+        if host.hang:
+            # wedged management engine, never answer
+            self.server.stopping.wait()
+            self.close_connection = True
+            return
+        if host.latency:
+            time.sleep(host.latency)
+        with host.lock:
+            error = host.errors.pop(0) if host.errors else None
+        if error is None and host.error_rate:
+            if random.random() < host.error_rate:
+                error = 503
+        if error is not None:
+            self._reply(error)
+            return
+
+        try:
+            code, reply = 200, self.server.handle(host, body)
+        except Fault as fault:
+            code, reply = fault.status, _fault(fault)
+        self._reply(code, reply)
+
+
+class FakeAMT(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A fake AMT server, simulating one or more hosts.
+
+    hosts is a list of FakeHost, or of addresses (which get a FakeHost
+    with the default password). By default it binds to 127.0.0.1 on a
+    free port (see .port), pass port=16992 to look like the real
+    thing. Given a certfile (and keyfile) it speaks https instead.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+    # nonces remembered, the oldest are forgotten after this many and
+    # clients still using them are challenged again
+    max_nonces = 1024
+    # enumerations not pulled to the end, the oldest are dropped after
+    # this many and pulling them is an invalid context fault
+    max_contexts = 1024
+
+    def __init__(self, hosts=('127.0.0.1',), bind='127.0.0.1', port=0,
+                 certfile=None, keyfile=None, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, (bind, port), Handler)
+        self.ssl_context = None
+        if certfile:
+            self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.ssl_context.load_cert_chain(certfile, keyfile)
+        self.verbose = verbose
+        self.hosts = {}
+        for host in hosts:
+            self.add_host(host)
+        # issued nonces, oldest first
+        self.nonces = collections.OrderedDict()
+        self._nonce_lock = threading.Lock()
+        self.challenges = 0
+        self.stopping = threading.Event()
+        # open enumerations, oldest first
+        self._contexts = collections.OrderedDict()
+        self._context_lock = threading.Lock()
+        self._context_ids = itertools.count(1)
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def get_request(self):
+        sock, address = self.socket.accept()
+        if self.ssl_context is not None:
+            # the handshake happens on first read, in the handler thread
+            sock = self.ssl_context.wrap_socket(
+                sock, server_side=True, do_handshake_on_connect=False)
+        return sock, address
+
+    def add_host(self, host):
+        if not isinstance(host, FakeHost):
+            host = FakeHost(host)
+        self.hosts[host.address] = host
+        return host
+
+    def host_for(self, address):
+        host = self.hosts.get(address)
+        if host is None and len(self.hosts) == 1:
+            # a single host answers on whatever address we are bound to
+            host = next(iter(self.hosts.values()))
+        return host
+
+    def new_nonce(self):
+        nonce = hashlib.md5(os.urandom(16)).hexdigest()
+        with self._nonce_lock:
+            self.nonces[nonce] = True
+            while len(self.nonces) > self.max_nonces:
+                self.nonces.popitem(last=False)
+        return nonce
+
+    def start(self):
+        # a short poll interval, so stop() is quick
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        args=(0.1,), name='fakeamt')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def handle(self, host, body):
+        """Act on a WS-Man request for host, returning the response."""
+        try:
+            doc = ElementTree.fromstring(body)
+        except ElementTree.ParseError:
+            raise Fault('wsman:SchemaValidationError',
+                        'The supplied SOAP violates the corresponding XML '
+                        'Schema definition.')
+        header = doc.find(_q(_SOAP, 'Header'))
+        soap_body = doc.find(_q(_SOAP, 'Body'))
+        action = header.findtext(_q(_ADDRESSING, 'Action'), '')
+        resource = header.findtext(_q(_WSMAN, 'ResourceURI'), '')
+        message_id = header.findtext(_q(_ADDRESSING, 'MessageID'))
+        method = action.rpartition('/')[2]
+        with host.lock:
+            host.requests[method] += 1
+            reply = self._dispatch(host, action, method, resource,
+                                   header, soap_body)
+        return _envelope(action + 'Response', message_id, reply)
+
+    def _dispatch(self, host, action, method, resource, header, body):
+        if action == _TRANSFER + '/Get':
+            return _instance_xml(resource, host.instances(resource)[0])
+        if action == _TRANSFER + '/Put':
+            if resource != _IPS + 'IPS_KVMRedirectionSettingData':
+                raise Fault('wsa:ActionNotSupported',
+                            'The action is not supported by the service.')
+            for element in list(body)[0]:
+                key = element.tag.rpartition('}')[2]
+                if key == 'RFBPassword':
+                    host.rfb_password = element.text
+                else:
+                    host.kvm_settings[key] = element.text
+            return _instance_xml(resource, host.kvm_settings)
+        if action == _ENUMERATION + '/Enumerate':
+            return self._enumerate(host, resource, body)
+        if action == _ENUMERATION + '/Pull':
+            return self._pull(body)
+        if action == resource + '/' + method:
+            return self._invoke(host, method, resource, body)
+        raise Fault('wsa:ActionNotSupported',
+                    'The action is not supported by the service.')
+
+    def _enumerate(self, host, resource, body):
+        items = host.instances(resource)
+        with self._context_lock:
+            context = str(next(self._context_ids))
+            self._contexts[context] = (resource, items)
+            while len(self._contexts) > self.max_contexts:
+                self._contexts.popitem(last=False)
+        enumerate_ = body.find(_q(_ENUMERATION, 'Enumerate'))
+        if enumerate_.find(_q(_WSMAN, 'OptimizeEnumeration')) is None:
+            return ('<e:EnumerateResponse><e:EnumerationContext>%s'
+                    '</e:EnumerationContext></e:EnumerateResponse>'
+                    % context)
+        max_elements = int(enumerate_.findtext(_q(_WSMAN, 'MaxElements'),
+                                               '1'))
+        return '<e:EnumerateResponse>%s</e:EnumerateResponse>' % (
+            self._batch(context, max_elements, 'c'))
+
+    def _pull(self, body):
+        pull = body.find(_q(_ENUMERATION, 'Pull'))
+        context = pull.findtext(_q(_ENUMERATION, 'EnumerationContext'))
+        max_elements = int(pull.findtext(_q(_ENUMERATION, 'MaxElements'),
+                                         '1'))
+        return '<e:PullResponse>%s</e:PullResponse>' % (
+            self._batch(context, max_elements, 'e'))
+
+    def _batch(self, context, max_elements, prefix):
+        with self._context_lock:
+            if context not in self._contexts:
+                raise Fault('wsen:InvalidEnumerationContext',
+                            'The supplied enumeration context is invalid.')
+            resource, items = self._contexts[context]
+            batch, rest = items[:max_elements], items[max_elements:]
+            if rest:
+                self._contexts[context] = (resource, rest)
+            else:
+                del self._contexts[context]
+        out = ['<e:EnumerationContext>%s</e:EnumerationContext>' % context,
+               '<%s:Items>' % prefix]
+        out.extend(_instance_xml(resource, item) for item in batch)
+        out.append('</%s:Items>' % prefix)
+        if not rest:
+            out.append('<%s:EndOfSequence/>' % prefix)
+        return ''.join(out)
+
+    def _invoke(self, host, method, resource, body):
+        args = list(body)[0] if len(body) else None
+        call = (resource, method)
+        if call == (_CIM + 'CIM_PowerManagementService',
+                    'RequestPowerStateChange'):
+            state = int(args.findtext(_q(resource, 'PowerState')))
+            rv = host.set_power_state(state)
+        elif call == (_CIM + 'CIM_BootConfigSetting', 'ChangeBootOrder'):
+            source = _selector(args, 'InstanceID')
+            if source not in amt.wsman.BOOT_DEVICES.values():
+                rv = 1
+            else:
+                host.boot_source = source
+                rv = 0
+        elif call == (_CIM + 'CIM_BootService', 'SetBootConfigRole'):
+            host.boot_role = int(args.findtext(_q(resource, 'Role')))
+            rv = 0
+        elif call == (_CIM + 'CIM_KVMRedirectionSAP',
+                      'RequestStateChange'):
+            host.kvm_state = int(args.findtext(_q(resource,
+                                                  'RequestedState')))
+            rv = 0
+        else:
+            raise Fault('wsa:ActionNotSupported',
+                        'The action is not supported by the service.')
+        return _output(resource, method, rv)
+
+
+def fleet_addresses(count, base='127.1.0.0'):
+    """count loopback addresses to simulate hosts on."""
+    a, b, c, d = [int(x) for x in base.split('.')]
+    start = (a << 24) + (b << 16) + (c << 8) + d + 1
+    return ['%d.%d.%d.%d' % ((n >> 24) & 255, (n >> 16) & 255,
+                             (n >> 8) & 255, n & 255)
+            for n in range(start, start + count)]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        'fakeamt', description='Run a fake AMT endpoint for testing.')
+    parser.add_argument('--hosts', type=int, default=1,
+                        help='Number of hosts to simulate, on consecutive '
+                        'loopback addresses after --base')
+    parser.add_argument('--base', default='127.1.0.0',
+                        help='Address before the first simulated host')
+    parser.add_argument('--bind', default=None,
+                        help='Address to listen on (default 127.0.0.1 for '
+                        'a single host, 0.0.0.0 for more)')
+    parser.add_argument('--port', type=int, default=None,
+                        help='Port to listen on (default 16992, or 16993 '
+                        'with --certfile)')
+    parser.add_argument('--password', default=DEFAULT_PASSWORD)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Latency (ms) added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Chance (0-1) of answering with a 503')
+    parser.add_argument('--power-delay', type=float, default=0.0,
+                        help='Seconds for a power change to take effect')
+    parser.add_argument('--certfile', help='Serve https with this cert')
+    parser.add_argument('--keyfile')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.hosts == 1:
+        addresses = ['127.0.0.1']
+    else:
+        addresses = fleet_addresses(args.hosts, args.base)
+    bind = args.bind or ('127.0.0.1' if args.hosts == 1 else '0.0.0.0')
+    port = args.port
+    if port is None:
+        port = 16993 if args.certfile else 16992
+    hosts = []
+    for address in addresses:
+        host = FakeHost(address, password=args.password)
+        host.latency = args.latency / 1000.0
+        host.error_rate = args.error_rate
+        host.power_delay = args.power_delay
+        hosts.append(host)
+    server = FakeAMT(hosts, bind=bind, port=port, certfile=args.certfile,
+                     keyfile=args.keyfile, verbose=args.verbose)
+    print("Simulating %d AMT host(s) (%s - %s) on %s:%d" % (
+        len(hosts), addresses[0], addresses[-1], bind, server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stopping.set()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Run operations across many AMT hosts at once.
+
+Nearly all the time spent talking to AMT is waiting on the network and
+the (slow) management engine, so a pool of threads lets that waiting
+overlap across hosts.
+"""
+
+from concurrent import futures
+
+DEFAULT_CONCURRENCY = 16
+
+
+class HostResult(object):
+    """The outcome of running an operation against one host."""
+
+    __slots__ = ('name', 'value', 'error')
+
+    def __init__(self, name, value=None, error=None):
+        self.name = name
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return "<HostResult %s: %r>" % (self.name, self.value)
+        return "<HostResult %s: error %r>" % (self.name, self.error)
+
+
+def _call(func, name, target):
+    try:
+        return HostResult(name, value=func(name, target))
+    except Exception as e:
+        return HostResult(name, error=e)
+
+
+def run(targets, func, concurrency=DEFAULT_CONCURRENCY):
+    """Run ``func(name, target)`` for every item in targets.
+
+    targets is a dict (or list of pairs) mapping a host name to
+    whatever func needs to act on it. At most ``concurrency`` calls
+    are in flight at once. A failure on one host is captured in its
+    HostResult and does not stop the rest of the batch.
+
+    Returns a list of HostResult in the same order as targets.
+    """
+    if hasattr(targets, 'items'):
+        targets = list(targets.items())
+    if not targets:
+        return []
+    workers = max(1, min(concurrency, len(targets)))
+    with futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = [pool.submit(_call, func, name, target)
+                   for name, target in targets]
+        return [f.result() for f in pending]
@@ -0,0 +1,154 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""One operation at a time per AMT host.
+
+The management engine copes badly with parallel sessions, it answers
+503 or drops connections. Passing a HostGuard as ``Client(...,
+guard=...)`` (one guard can, and should, be shared by every client in
+a process) makes operations on the same host take turns:
+
+- operations run one at a time per host, in the order they were
+  called, and a multi request operation (set_next_boot, enable_vnc)
+  runs as a unit, without others' requests in between
+- a read that is the same as one already queued or running (two
+  threads asking for power_status, say) doesn't make a request of its
+  own, it waits for that one and gets its result (or exception). A
+  read only joins one that was queued before any change that was
+  queued ahead of it, so a read never sees a state from before a
+  change it was called after
+
+Different hosts don't wait on each other.
+"""
+
+import collections
+import contextlib
+import threading
+
+
+class _Flight(object):
+    """A read in progress, and its outcome for those waiting on it."""
+
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class _Host(object):
+
+    __slots__ = ('cond', 'queue', 'owner', 'depth', 'generation',
+                 'flights')
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        # tickets of the operations waiting their turn, in order
+        self.queue = collections.deque()
+        # the thread whose turn it is, and how deeply it has nested
+        self.owner = None
+        self.depth = 0
+        # bumped as each change is queued, reads only join reads of
+        # the same generation
+        self.generation = 0
+        # (key, generation) => _Flight
+        self.flights = {}
+
+
+class HostGuard(object):
+    """Serializes operations per host, see the module docstring.
+
+    Hosts are identified by their WS-Man uri.
+    """
+
+    def __init__(self):
+        self._hosts = {}
+        self._lock = threading.Lock()
+        # reads answered by another read's request
+        self.coalesced = 0
+
+    def _host(self, uri):
+        with self._lock:
+            host = self._hosts.get(uri)
+            if host is None:
+                host = self._hosts[uri] = _Host()
+            return host
+
+    @contextlib.contextmanager
+    def turn(self, uri, change=True):
+        """Wait for this thread's turn at uri, and hold it.
+
+        Turns are given out in the order they are asked for, and may
+        be nested: a thread that has the turn gets it again straight
+        away.
+        """
+        host = self._host(uri)
+        me = threading.current_thread()
+        with host.cond:
+            if host.owner is me:
+                host.depth += 1
+            else:
+                if change:
+                    host.generation += 1
+                ticket = object()
+                host.queue.append(ticket)
+                while host.owner is not None or host.queue[0] is not ticket:
+                    host.cond.wait()
+                host.queue.popleft()
+                host.owner = me
+                host.depth = 1
+        try:
+            yield
+        finally:
+            with host.cond:
+                host.depth -= 1
+                if host.depth == 0:
+                    host.owner = None
+                    host.cond.notify_all()
+
+    def read(self, uri, key, func):
+        """Return func(), run in its turn at uri, unless an identical
+        read (same key) is already waiting or running, in which case
+        that one's result is returned instead.
+        """
+        host = self._host(uri)
+        with host.cond:
+            if host.owner is threading.current_thread():
+                # part of an operation that already has the turn
+                flight = None
+            else:
+                slot = (key, host.generation)
+                flight = host.flights.get(slot)
+                leader = flight is None
+                if leader:
+                    flight = host.flights[slot] = _Flight()
+                else:
+                    self.coalesced += 1
+        if flight is None:
+            return func()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            with self.turn(uri, change=False):
+                flight.value = func()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with host.cond:
+                del host.flights[slot]
+            flight.done.set()
+        return flight.value
@@ -0,0 +1,228 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Track which AMT hosts are reachable, and stop waiting on those that
+aren't.
+
+A host that is powered down at the wall, unplugged or gone makes every
+request to it wait out the connect timeout, which in a fleet run takes
+longer than everything else put together. Passing a Health as
+``Client(..., health=...)`` (one Health can, and should, be shared by
+every client) puts a circuit breaker in front of each host:
+
+closed
+    requests go through as normal
+open
+    the host failed to connect (or timed out) recently, so requests
+    fail straight away with amt.client.HostUnavailable, for a cooldown
+    that doubles each time the host fails again, up to max_cooldown
+half-open
+    the cooldown is over, a single request is let through as a trial,
+    and closes the breaker if it gets any answer at all, or opens it
+    again if it doesn't
+
+Only connection failures and timeouts count against a host, any HTTP
+response means it is there.
+
+With probing started (see start) open hosts are checked in the
+background by just opening a TCP connection, and moved to half-open
+as soon as that works, without waiting for the cooldown.
+
+The state can be saved to a file (amtctrl keeps health.json in its
+config dir), so the next run skips hosts known to be down too.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+
+from six.moves.urllib import parse
+
+HEALTH_NAME = 'health.json'
+
+# consecutive failed requests that open the breaker
+DEFAULT_THRESHOLD = 1
+# seconds
+DEFAULT_COOLDOWN = 60.0
+DEFAULT_MAX_COOLDOWN = 900.0
+
+
+class _HostState(object):
+
+    __slots__ = ('failures', 'opened', 'cooldown', 'trial')
+
+    def __init__(self, failures=0, opened=None, cooldown=0.0):
+        self.failures = failures
+        # when the breaker was last opened, or None while it's closed
+        self.opened = opened
+        self.cooldown = cooldown
+        # a half-open trial request is in flight
+        self.trial = False
+
+
+class Health(object):
+    """Circuit breakers for many hosts, see the module docstring.
+
+    Hosts are identified by their WS-Man uri. path, if given, is where
+    load and save keep the state.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD,
+                 cooldown=DEFAULT_COOLDOWN,
+                 max_cooldown=DEFAULT_MAX_COOLDOWN, path=None):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.path = path
+        # uri => _HostState, only for hosts that have failed
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def state(self, uri):
+        """'closed', 'open' or 'half-open'."""
+        with self._lock:
+            host = self._hosts.get(uri)
+            if host is None or host.opened is None:
+                return 'closed'
+            if time.time() < host.opened + host.cooldown:
+                return 'open'
+            return 'half-open'
+
+    def retry_in(self, uri):
+        """Seconds until an open host gets a trial request."""
+        with self._lock:
+            host = self._hosts.get(uri)
+            if host is None or host.opened is None:
+                return 0.0
+            return max(host.opened + host.cooldown - time.time(), 0.0)
+
+    def unavailable(self):
+        """The uris of the hosts whose breaker is open or half-open."""
+        with self._lock:
+            return sorted(uri for uri, host in self._hosts.items()
+                          if host.opened is not None)
+
+    def allow(self, uri):
+        """Whether a request to uri should be made now.
+
+        While half-open only the first caller is allowed, as the
+        trial, and must report how it went with succeeded, failed or
+        abandon.
+        """
+        with self._lock:
+            host = self._hosts.get(uri)
+            if host is None or host.opened is None:
+                return True
+            if host.trial or time.time() < host.opened + host.cooldown:
+                return False
+            host.trial = True
+            return True
+
+    def succeeded(self, uri):
+        """A request to uri got an answer."""
+        with self._lock:
+            self._hosts.pop(uri, None)
+
+    def failed(self, uri):
+        """A request to uri couldn't connect, or timed out."""
+        with self._lock:
+            host = self._hosts.setdefault(uri, _HostState())
+            host.failures += 1
+            host.trial = False
+            if host.opened is not None:
+                # the trial failed, back off further
+                host.cooldown = min(host.cooldown * 2, self.max_cooldown)
+                host.opened = time.time()
+            elif host.failures >= self.threshold:
+                host.cooldown = self.cooldown
+                host.opened = time.time()
+
+    def abandon(self, uri):
+        """A request to uri ended without saying anything about the
+        host (it was interrupted, say)."""
+        with self._lock:
+            host = self._hosts.get(uri)
+            if host is not None:
+                host.trial = False
+
+    def check(self, uri, timeout=2.0):
+        """Try a TCP connection to uri's host, and make an open
+        breaker half-open if that works. Returns whether it did.
+        """
+        url = parse.urlparse(uri)
+        port = url.port or (443 if url.scheme == 'https' else 80)
+        try:
+            socket.create_connection((url.hostname, port), timeout).close()
+        except (socket.error, socket.timeout):
+            return False
+        with self._lock:
+            host = self._hosts.get(uri)
+            if host is not None and host.opened is not None:
+                # due for its trial now
+                host.opened = time.time() - host.cooldown
+        return True
+
+    def start(self, interval=5.0, timeout=2.0):
+        """Check the open hosts every interval seconds, in a
+        background thread, until stop is called."""
+        def probe():
+            while not self._stop.wait(interval):
+                for uri in self.unavailable():
+                    if self.state(uri) == 'open':
+                        self.check(uri, timeout)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=probe,
+                                        name='amt-health-probe')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def load(self):
+        """Read the state saved at path, if there is any."""
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            hosts = dict((uri, _HostState(int(s['failures']),
+                                          float(s['opened']),
+                                          float(s['cooldown'])))
+                         for uri, s in saved.items())
+        except (IOError, OSError, ValueError, KeyError, TypeError,
+                AttributeError):
+            # missing or damaged, start afresh
+            return self
+        with self._lock:
+            self._hosts.update(hosts)
+        return self
+
+    def save(self):
+        """Write the state of the hosts that are down to path."""
+        with self._lock:
+            saved = dict((uri, {'failures': host.failures,
+                                'opened': host.opened,
+                                'cooldown': host.cooldown})
+                         for uri, host in self._hosts.items()
+                         if host.opened is not None)
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(saved, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.path)
@@ -10,60 +10,724 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-from six.moves import configparser
+"""The database of known AMT servers.
+
+Servers are stored in a SQLite database (``hosts.db`` in the amtctrl
+config dir), which keeps lookups cheap and updates atomic however
+many servers are registered, and lets several amtctrl processes
+change it at once. The original ``hosts.cfg`` INI format is still
+supported as a backend, and as an import / export format. An existing
+hosts.cfg is imported automatically the first time hosts.db is
+created.
+
+Servers can carry any number of ``key=value`` tags (rack, role,
+firmware generation...), a key may have several values, which is how
+a server belongs to several groups. Tags can be used to select
+servers, see HostDB.resolve.
+"""
+
+import contextlib
+import fnmatch
 import os
+import sqlite3
 
 import appdirs
+import six
 
 appauthor = "sdague"
 appname = "amtctrl"
 
+# The optional settings of a server. Unset ones are None.
+OPTIONS = ('vncpasswd', 'protocol', 'cafile', 'fingerprint')
+
+# The fields of a server record, as imported and exported.
+FIELDS = ('name', 'host', 'passwd') + OPTIONS + ('tags',)
+
+# Schema changes, in order. The database's user_version is the number
+# that have been applied.
+MIGRATIONS = (
+    """
+    CREATE TABLE IF NOT EXISTS hosts (
+        name TEXT PRIMARY KEY,
+        host TEXT NOT NULL,
+        passwd TEXT NOT NULL,
+        vncpasswd TEXT
+    );
+    CREATE INDEX IF NOT EXISTS hosts_host ON hosts (host);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tags (
+        name TEXT NOT NULL REFERENCES hosts (name) ON DELETE CASCADE,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (name, key, value)
+    );
+    CREATE INDEX IF NOT EXISTS tags_key_value ON tags (key, value);
+    """,
+    """
+    ALTER TABLE hosts ADD COLUMN protocol TEXT;
+    ALTER TABLE hosts ADD COLUMN cafile TEXT;
+    ALTER TABLE hosts ADD COLUMN fingerprint TEXT;
+    """,
+)
+
+
+def is_pattern(spec):
+    """Does spec select more than a single literal server name."""
+    return any(c in spec for c in ',*?[=')
+
+
+def parse_tag(text, value_required=True):
+    """Parse ``key=value`` into a (key, value) tuple.
+
+    If value_required is False a bare ``key`` is accepted, and
+    returned as (key, None).
+    """
+    key, sep, value = text.partition('=')
+    key = key.strip()
+    value = value.strip()
+    if (not key or ',' in text or '=' in value or
+            (sep and not value) or (value_required and not sep)):
+        raise ValueError("Invalid tag '%s', expected key=value" % text)
+    return key, value or None
+
+
+def parse_selector(spec):
+    """Split a selector into its name terms and (key, value) tag terms."""
+    names = []
+    tags = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' in item:
+            tags.append(parse_tag(item))
+        else:
+            names.append(item)
+    return names, tags
+
+
+def parse_fingerprint(text):
+    """Normalize a certificate fingerprint to lower case hex.
+
+    Accepts the md5, sha1 or sha256 digest of the certificate, with or
+    without colons (as printed by ``openssl x509 -fingerprint``).
+    """
+    digest = text.replace(':', '').strip().lower()
+    if (len(digest) not in (32, 40, 64) or
+            digest.strip('0123456789abcdef')):
+        raise ValueError("Invalid fingerprint '%s', expected the hex "
+                         "md5, sha1 or sha256 of the certificate" % text)
+    return digest
+
+
+def format_tags(tags):
+    return ",".join("%s=%s" % tag for tag in tags)
+
+
+def _text(record, field):
+    value = record.get(field)
+    if value is None:
+        # present but null clears it, like ''
+        return '' if field in record else None
+    if not isinstance(value, six.string_types):
+        raise ValueError("%s must be a string" % field)
+    return value if field == 'passwd' else value.strip()
+
+
+def _record_tags(value):
+    if isinstance(value, six.string_types):
+        value = value.split(',')
+    elif not isinstance(value, list):
+        raise ValueError("tags must be a string or a list")
+    tags = []
+    for item in value:
+        if not isinstance(item, six.string_types):
+            raise ValueError("tags must be key=value strings")
+        if item.strip():
+            tags.append(parse_tag(item))
+    return tags
+
+
+def parse_record(record):
+    """Validate a server record, a dict of FIELDS as read from an
+    import file, and return it as a (name, data) pair.
+
+    name, host and passwd are required. An option, or tags, that is
+    left out is kept as it is on an existing server, and one that is
+    empty (or null) is cleared. tags are ``key=value`` strings, either
+    a list of them or comma separated.
+    """
+    if None in record:
+        # the csv module's key for cells beyond the header
+        raise ValueError("More fields than the header has")
+    unknown = sorted(set(record) - set(FIELDS))
+    if unknown:
+        raise ValueError("Unknown field(s) %s" % ', '.join(unknown))
+    name = _text(record, 'name')
+    if not name or is_pattern(name):
+        raise ValueError("Invalid name '%s'" % (name or ''))
+    data = {}
+    for field in ('host', 'passwd'):
+        data[field] = _text(record, field)
+        if not data[field]:
+            raise ValueError("%s is required" % field)
+    for option in OPTIONS:
+        data[option] = _text(record, option)
+    if data['protocol'] not in (None, '', 'http', 'https'):
+        raise ValueError("Invalid protocol '%s', expected http or https"
+                         % data['protocol'])
+    if data['fingerprint']:
+        data['fingerprint'] = parse_fingerprint(data['fingerprint'])
+    data['tags'] = None
+    if record.get('tags') is not None:
+        data['tags'] = sorted(set(_record_tags(record['tags'])))
+    elif 'tags' in record:
+        data['tags'] = []
+    return name, data
+
+
+def _unchanged(backend, name, current, data):
+    for field, value in data.items():
+        if value is None:
+            continue
+        if field == 'tags':
+            if value != backend.tags(name):
+                return False
+        elif (value or None) != current[field]:
+            return False
+    return True
+
+
+def _ensure_dir(path):
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname, 0o770)
+
+
+class IniBackend(object):
+    """Servers stored in an INI file, one section per server.
+
+    Every change rewrites the whole file, so this is only suitable for
+    small numbers of servers.
+    """
+
+    def __init__(self, path, load=True):
+        self.path = path
+        self._load = load
+        self._read()
+
+    def _read(self):
+        # only needed for the INI format, which amtctrl usually doesn't
+        # touch, so leave it out of the startup path
+        from six.moves import configparser
 
-class HostDB(object):
-    def __init__(self):
-        self.confdir = appdirs.user_config_dir(appname, appauthor)
-        self.confname = os.path.join(self.confdir, 'hosts.cfg')
         self.config = configparser.ConfigParser()
-        self.config.read(self.confname)
+        if self._load:
+            self.config.read(self.path)
+
+    def close(self):
+        pass
 
-    def list_servers(self):
-        print("Available servers (%d):" % len(self.config.sections()))
-        for item in self.config.sections():
-            print("    %s" % item)
+    def names(self):
+        return sorted(self.config.sections())
 
-    def set_server(self, name, host, passwd, vncpasswd=None):
-        # This is add/update
+    def match(self, pattern):
+        return fnmatch.filter(self.names(), pattern)
+
+    def find_host(self, host):
+        return [name for name in self.names()
+                if self.config.get(name, 'host') == host]
+
+    def _tags(self, name):
+        if not self.config.has_option(name, 'tags'):
+            return []
+        _, tags = parse_selector(self.config.get(name, 'tags'))
+        return sorted(set(tags))
+
+    def _set_tags(self, name, tags):
+        self.config.set(name, 'tags', format_tags(sorted(set(tags))))
+
+    def tags(self, name):
         if not self.config.has_section(name):
-            self.config.add_section(name)
+            raise KeyError(name)
+        return self._tags(name)
+
+    def tag_map(self):
+        return dict((name, self._tags(name)) for name in self.names()
+                    if self._tags(name))
+
+    def select(self, tags):
+        found = []
+        for name in self.names():
+            have = self._tags(name)
+            if all(any(k == key and fnmatch.fnmatchcase(v, value)
+                       for k, v in have)
+                   for key, value in tags):
+                found.append(name)
+        return found
 
+    def add_tags(self, name, tags):
+        self._set_tags(name, self.tags(name) + list(tags))
+        self._write()
+
+    def remove_tags(self, name, tags):
+        self._set_tags(name, [(k, v) for k, v in self.tags(name)
+                              if not any(k == key and value in (None, v)
+                                         for key, value in tags)])
+        self._write()
+
+    def get(self, name):
+        if not self.config.has_section(name):
+            return None
+        data = {
+            'host': self.config.get(name, 'host'),
+            'passwd': self.config.get(name, 'passwd'),
+        }
+        for option in OPTIONS:
+            if self.config.has_option(name, option):
+                data[option] = self.config.get(name, option)
+            else:
+                data[option] = None
+        return data
+
+    def items(self):
+        for name in self.names():
+            data = self.get(name)
+            data['tags'] = self._tags(name)
+            yield name, data
+
+    def _set(self, name, host, passwd, tags=None, **options):
+        if not self.config.has_section(name):
+            self.config.add_section(name)
         self.config.set(name, 'host', host)
         self.config.set(name, 'passwd', passwd)
-        if vncpasswd is not None:
-            self.config.set(name, 'vncpasswd', vncpasswd)
-        # ensure the directory exists
-        if not os.path.exists(self.confdir):
-            os.makedirs(self.confdir, 0o770)
+        for option in OPTIONS:
+            value = options.get(option)
+            if value:
+                self.config.set(name, option, value)
+            elif value is not None:
+                self.config.remove_option(name, option)
+        if tags is not None:
+            self._set_tags(name, tags)
 
-        with open(self.confname, 'w') as f:
-            self.config.write(f)
+    def set(self, name, host, passwd, tags=None, **options):
+        self._set(name, host, passwd, tags, **options)
+        self._write()
 
-    def rm_server(self, name):
+    def update(self, servers):
+        """Add or update many servers, from (name, data) pairs.
+
+        If servers raises part way nothing is changed.
+        """
+        count = 0
+        try:
+            for name, data in servers:
+                self._set(name, **data)
+                count += 1
+        except BaseException:
+            # drop what was applied
+            self._read()
+            raise
+        self._write()
+        return count
+
+    def remove(self, name):
         self.config.remove_section(name)
+        self._write()
 
-        with open(self.confname, 'w') as f:
+    def _write(self):
+        _ensure_dir(self.path)
+        # write a new file and rename it over the old one, so readers
+        # never see a half written file
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
             self.config.write(f)
+        os.rename(tmp, self.path)
 
-    def get_server(self, name):
-        if self.config.has_section(name):
-            data = {
-                'host': self.config.get(name, 'host'),
-                'passwd': self.config.get(name, 'passwd'),
-            }
-            if self.config.has_option(name, 'vncpasswd'):
-                data['vncpasswd'] = self.config.get(name, 'vncpasswd')
-            else:
-                data['vncpasswd'] = None
-            return data
+
+class SQLiteBackend(object):
+    """Servers stored in a SQLite database.
+
+    Lookups go through indexes, every change is its own transaction,
+    and the database runs in WAL mode so readers are never blocked by
+    a writer in another process.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        _ensure_dir(path)
+        if not os.path.exists(path):
+            # it holds passwords, so create it private
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+        # transactions are handled explicitly by _transaction. The
+        # connection may be shared between threads (amt.daemon does),
+        # as long as the caller serializes its use.
+        self.conn = sqlite3.connect(path, timeout=timeout,
+                                    isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self._migrate()
+
+    def close(self):
+        self.conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # take the write lock up front so concurrent writers queue up
+        # (for up to timeout seconds) instead of failing part way
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def _version(self):
+        return self.conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def _migrate(self):
+        if self._version() >= len(MIGRATIONS):
+            return
+        with self._transaction() as conn:
+            # another process may have got here first
+            for script in MIGRATIONS[self._version():]:
+                for statement in script.split(';'):
+                    if statement.strip():
+                        conn.execute(statement)
+            conn.execute('PRAGMA user_version=%d' % len(MIGRATIONS))
+
+    def names(self):
+        return [row[0] for row in
+                self.conn.execute('SELECT name FROM hosts ORDER BY name')]
+
+    def match(self, pattern):
+        # GLOB has the same syntax as fnmatch, and can use the name
+        # index for a literal prefix
+        return [row[0] for row in self.conn.execute(
+            'SELECT name FROM hosts WHERE name GLOB ? ORDER BY name',
+            (pattern,))]
+
+    def find_host(self, host):
+        return [row[0] for row in self.conn.execute(
+            'SELECT name FROM hosts WHERE host = ? ORDER BY name', (host,))]
+
+    def tags(self, name):
+        if self.get(name) is None:
+            raise KeyError(name)
+        return list(self.conn.execute(
+            'SELECT key, value FROM tags WHERE name = ? '
+            'ORDER BY key, value', (name,)))
+
+    def tag_map(self):
+        found = {}
+        for name, key, value in self.conn.execute(
+                'SELECT name, key, value FROM tags '
+                'ORDER BY name, key, value'):
+            found.setdefault(name, []).append((key, value))
+        return found
+
+    def select(self, tags):
+        """The names of the servers that have all of tags.
+
+        tags is a list of (key, value) pairs, value may be a glob
+        pattern. Each term is a lookup on the (key, value) index.
+        """
+        query = []
+        params = []
+        for key, value in tags:
+            op = 'GLOB' if is_pattern(value) else '='
+            query.append('SELECT name FROM tags WHERE key = ? '
+                         'AND value %s ?' % op)
+            params.extend((key, value))
+        return [row[0] for row in self.conn.execute(
+            ' INTERSECT '.join(query) + ' ORDER BY name', params)]
+
+    def add_tags(self, name, tags):
+        with self._transaction() as conn:
+            self._add_tags(conn, name, tags)
+
+    def remove_tags(self, name, tags):
+        with self._transaction() as conn:
+            if self.get(name) is None:
+                raise KeyError(name)
+            for key, value in tags:
+                if value is None:
+                    conn.execute('DELETE FROM tags WHERE name = ? '
+                                 'AND key = ?', (name, key))
+                else:
+                    conn.execute('DELETE FROM tags WHERE name = ? '
+                                 'AND key = ? AND value = ?',
+                                 (name, key, value))
+
+    def _add_tags(self, conn, name, tags):
+        try:
+            conn.executemany(
+                'INSERT OR IGNORE INTO tags (name, key, value) '
+                'VALUES (?, ?, ?)',
+                [(name, key, value) for key, value in tags])
+        except sqlite3.IntegrityError:
+            # the server doesn't exist
+            raise KeyError(name)
+
+    _COLUMNS = ('host', 'passwd') + OPTIONS
+
+    @classmethod
+    def _row(cls, row):
+        return dict(zip(cls._COLUMNS, row))
+
+    def get(self, name):
+        row = self.conn.execute(
+            'SELECT %s FROM hosts WHERE name = ?' % ', '.join(self._COLUMNS),
+            (name,)).fetchone()
+        if row is None:
+            return None
+        return self._row(row)
+
+    def items(self):
+        tags = self.tag_map()
+        rows = self.conn.execute(
+            'SELECT name, %s FROM hosts ORDER BY name'
+            % ', '.join(self._COLUMNS))
+        for row in rows.fetchall():
+            data = self._row(row[1:])
+            data['tags'] = tags.get(row[0], [])
+            yield row[0], data
+
+    # Like the INI backend, an option that isn't given (None) is left
+    # alone, and one given as '' is cleared.
+    _UPDATE = 'UPDATE hosts SET host = ?, passwd = ?, %s WHERE name = ?' % (
+        ', '.join('%s = NULLIF(COALESCE(?, %s), \'\')' % (option, option)
+                  for option in OPTIONS))
+    _INSERT = 'INSERT INTO hosts (name, %s) VALUES (?, ?, ?, %s)' % (
+        ', '.join(_COLUMNS), ', '.join(["NULLIF(?, '')"] * len(OPTIONS)))
+
+    def _set(self, conn, name, host, passwd, tags=None, **options):
+        values = [options.get(option) for option in OPTIONS]
+        cursor = conn.execute(self._UPDATE,
+                              [host, passwd] + values + [name])
+        if cursor.rowcount == 0:
+            conn.execute(self._INSERT, [name, host, passwd] + values)
+        if tags is not None:
+            conn.execute('DELETE FROM tags WHERE name = ?', (name,))
+            self._add_tags(conn, name, tags)
+
+    def set(self, name, host, passwd, tags=None, **options):
+        with self._transaction() as conn:
+            self._set(conn, name, host, passwd, tags, **options)
+
+    def update(self, servers):
+        """Add or update many servers, from (name, data) pairs.
+
+        All or nothing: either every server is stored or none are.
+        """
+        count = 0
+        with self._transaction() as conn:
+            for name, data in servers:
+                self._set(conn, name, **data)
+                count += 1
+        return count
+
+    def remove(self, name):
+        with self._transaction() as conn:
+            # tags go with it, ON DELETE CASCADE
+            conn.execute('DELETE FROM hosts WHERE name = ?', (name,))
+
+
+class HostDB(object):
+    def __init__(self, backend=None):
+        self.confdir = appdirs.user_config_dir(appname, appauthor)
+        self.confname = os.path.join(self.confdir, 'hosts.cfg')
+        self.dbname = os.path.join(self.confdir, 'hosts.db')
+        if backend is None:
+            backend = self._default_backend()
+        self.backend = backend
+
+    def _default_backend(self):
+        if (not os.path.exists(self.dbname) and
+                os.path.exists(self.confname)):
+            # first run since hosts.db was introduced, carry the
+            # servers over. Build it on the side and rename it into
+            # place so a failed or concurrent import can't leave a
+            # partial database behind.
+            tmp = '%s.%d.tmp' % (self.dbname, os.getpid())
+            backend = SQLiteBackend(tmp)
+            try:
+                backend.update(IniBackend(self.confname).items())
+            finally:
+                backend.close()
+            os.rename(tmp, self.dbname)
+        return SQLiteBackend(self.dbname)
+
+    def close(self):
+        self.backend.close()
+
+    def list_servers(self, selector=None):
+        if selector:
+            names = [name for name in self.resolve(selector)
+                     if self.get_server(name, quiet=True)]
         else:
-            print("No config found for server (%s), "
-                  "perhaps you need to add one via ``amtctrl set``" % name)
+            names = self.names()
+        tags = self.backend.tag_map()
+        print("Available servers (%d):" % len(names))
+        for item in names:
+            if tags.get(item):
+                print("    %-20s %s" % (item, format_tags(tags[item])))
+            else:
+                print("    %s" % item)
+
+    def names(self):
+        return self.backend.names()
+
+    def resolve(self, spec):
+        """Resolve a target spec to a list of server names.
+
+        spec is a comma separated list of server names or glob patterns
+        (``host1,host2,rack-*``), and/or ``key=value`` tag terms
+        (``rack=r12,role=worker``, the value can be a glob).
+
+        Servers are selected if they match any of the names and all of
+        the tags. With no names every server is a candidate, with no
+        tags literal names are returned even if they aren't in the
+        database, so the caller can report them as missing. Each name
+        is returned once, in the order first matched.
+        """
+        names, tags = parse_selector(spec)
+        tagged = None
+        if tags:
+            tagged = self.backend.select(tags)
+            if not names:
+                return tagged
+            tagged = set(tagged)
+        found = []
+        seen = set()
+        for item in names:
+            if is_pattern(item):
+                matches = self.backend.match(item)
+            else:
+                matches = [item]
+            for name in matches:
+                if name in seen or (tagged is not None and
+                                    name not in tagged):
+                    continue
+                seen.add(name)
+                found.append(name)
+        return found
+
+    def find_host(self, host):
+        """The names of the servers registered with address host."""
+        return self.backend.find_host(host)
+
+    def set_server(self, name, host, passwd, vncpasswd=None, tags=None,
+                   protocol=None, cafile=None, fingerprint=None):
+        """Add or update a server.
+
+        Optional settings that aren't given are left as they are, pass
+        '' to clear one. If tags are given they replace the server's
+        existing ones.
+
+        protocol is 'http' (the default) or 'https'. For https servers
+        the certificate is checked against the CA bundle in cafile (the
+        system CAs by default), or if fingerprint is set, pinned to
+        that certificate.
+        """
+        self.backend.set(name, host, passwd, tags, vncpasswd=vncpasswd,
+                         protocol=protocol, cafile=cafile,
+                         fingerprint=fingerprint)
+
+    def rm_server(self, name):
+        self.backend.remove(name)
+
+    def get_server(self, name, quiet=False):
+        data = self.backend.get(name)
+        if data is None and not quiet:
+            self._missing(name)
+        return data
+
+    def _missing(self, name):
+        print("No config found for server (%s), "
+              "perhaps you need to add one via ``amtctrl set``" % name)
+
+    def get_tags(self, name):
+        """A server's tags, as a sorted list of (key, value) pairs."""
+        try:
+            return self.backend.tags(name)
+        except KeyError:
+            self._missing(name)
+
+    def tag_server(self, name, tags):
+        """Add (key, value) tags to a server."""
+        try:
+            self.backend.add_tags(name, tags)
+        except KeyError:
+            self._missing(name)
+
+    def untag_server(self, name, tags):
+        """Remove (key, value) tags from a server, a value of None
+        removes every value of that key.
+        """
+        try:
+            self.backend.remove_tags(name, tags)
+        except KeyError:
+            self._missing(name)
+
+    def servers(self):
+        """Every server, as (name, data) pairs ordered by name. data
+        has the server's settings and a list of its tags.
+        """
+        return self.backend.items()
+
+    def load(self, records):
+        """Add or update servers from a stream of records.
+
+        records are (where, record) pairs, where is a position in the
+        source (``line 12``) for error messages and record a dict as
+        taken by parse_record. Every record is validated, and only
+        servers that are new or differ from what is stored are
+        written. The whole load is one transaction, so if a record is
+        invalid (or a name is repeated) ValueError is raised and
+        nothing is changed.
+
+        Returns a dict of the number of servers added, updated and
+        unchanged.
+        """
+        counts = {'added': 0, 'updated': 0, 'unchanged': 0}
+
+        def changes():
+            seen = set()
+            for where, record in records:
+                try:
+                    name, data = parse_record(record)
+                    if name in seen:
+                        raise ValueError("%s is repeated" % name)
+                except ValueError as e:
+                    raise ValueError("%s: %s" % (where, e))
+                seen.add(name)
+                # read in the same transaction as the writes, so what
+                # is compared against is what is replaced
+                current = self.backend.get(name)
+                if current is None:
+                    counts['added'] += 1
+                elif _unchanged(self.backend, name, current, data):
+                    counts['unchanged'] += 1
+                    continue
+                else:
+                    counts['updated'] += 1
+                yield name, data
+
+        self.backend.update(changes())
+        return counts
+
+    def import_ini(self, path):
+        """Add or update the servers in an INI file (hosts.cfg format).
+
+        Returns the number of servers imported.
+        """
+        return self.backend.update(IniBackend(path).items())
+
+    def export_ini(self, path):
+        """Write every server to an INI file (hosts.cfg format)."""
+        return IniBackend(path, load=False).update(self.backend.items())
@@ -0,0 +1,155 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Server inventories, for bulk import into and export from the host db.
+
+Three formats are supported:
+
+csv
+    a header row naming the columns (any of amt.hostdb.FIELDS, in any
+    order), then a server per row. Tags are a comma separated list of
+    ``key=value`` in one cell.
+jsonl
+    a JSON object per line, with FIELDS as keys. Tags are a list of
+    ``key=value`` strings.
+ini
+    the hosts.cfg format, a section per server.
+
+Records are read and written one at a time, so an inventory of any
+size is streamed rather than held in memory. See HostDB.load for how
+records are applied::
+
+    with open('fleet.csv') as f:
+        counts = db.load(amt.inventory.read(f, 'csv'))
+"""
+
+import collections
+import csv
+import json
+import os
+
+import amt.hostdb
+
+FORMATS = ('csv', 'jsonl', 'ini')
+
+_EXTENSIONS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.json': 'jsonl',
+    '.cfg': 'ini',
+    '.ini': 'ini',
+}
+
+
+def guess_format(path):
+    """The format of path going by its extension, or None."""
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def _read_csv(f):
+    reader = csv.DictReader(f)
+    if reader.fieldnames is None:
+        return
+    unknown = [name for name in reader.fieldnames
+               if name not in amt.hostdb.FIELDS]
+    if unknown or 'name' not in reader.fieldnames:
+        raise ValueError("line 1: expected a header of columns from %s, "
+                         "including name" % ', '.join(amt.hostdb.FIELDS))
+    for record in reader:
+        yield 'line %d' % reader.line_num, record
+
+
+def _read_jsonl(f):
+    for line, text in enumerate(f, 1):
+        if not text.strip():
+            continue
+        where = 'line %d' % line
+        try:
+            record = json.loads(text)
+        except ValueError as e:
+            raise ValueError("%s: %s" % (where, e))
+        if not isinstance(record, dict):
+            raise ValueError("%s: expected a JSON object" % where)
+        yield where, record
+
+
+def _read_ini(f):
+    from six.moves import configparser
+
+    config = configparser.ConfigParser()
+    if hasattr(config, 'read_file'):
+        config.read_file(f)
+    else:
+        # python 2
+        config.readfp(f)
+    for name in config.sections():
+        record = dict(config.items(name))
+        record['name'] = name
+        yield '[%s]' % name, record
+
+
+def _write_csv(f, servers):
+    writer = csv.writer(f)
+    writer.writerow(amt.hostdb.FIELDS)
+    for name, data in servers:
+        writer.writerow(
+            [name] + [data[field] or '' for field in amt.hostdb.FIELDS[1:-1]] +
+            [amt.hostdb.format_tags(data['tags'])])
+        yield name
+
+
+def _write_jsonl(f, servers):
+    for name, data in servers:
+        record = collections.OrderedDict([('name', name)])
+        for field in amt.hostdb.FIELDS[1:-1]:
+            record[field] = data[field]
+        record['tags'] = ['%s=%s' % tag for tag in data['tags']]
+        f.write(json.dumps(record) + '\n')
+        yield name
+
+
+def _write_ini(f, servers):
+    # IniBackend knows how a server is laid out, it is only ever
+    # written to f
+    ini = amt.hostdb.IniBackend(None, load=False)
+    for name, data in servers:
+        ini._set(name, **data)
+        yield name
+    ini.config.write(f)
+
+
+_READERS = {'csv': _read_csv, 'jsonl': _read_jsonl, 'ini': _read_ini}
+_WRITERS = {'csv': _write_csv, 'jsonl': _write_jsonl, 'ini': _write_ini}
+
+
+def _check(fmt):
+    if fmt not in FORMATS:
+        raise ValueError("Unknown format %s, expected one of %s"
+                         % (fmt, ', '.join(FORMATS)))
+
+
+def read(f, fmt):
+    """Read the server records in an inventory, from file object f.
+
+    Yields (where, record) pairs, as HostDB.load takes them.
+    """
+    _check(fmt)
+    return _READERS[fmt](f)
+
+
+def write(f, servers, fmt):
+    """Write servers, (name, data) pairs as from HostDB.servers, to
+    file object f. Returns the number written.
+    """
+    _check(fmt)
+    return sum(1 for name in _WRITERS[fmt](f, servers))
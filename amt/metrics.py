@@ -0,0 +1,270 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Request metrics for amt.client.
+
+Pass a Metrics as ``Client(..., metrics=...)`` (one Metrics can be
+shared by any number of clients) and every WS-Man request is timed,
+broken down into phases:
+
+retry
+    failed attempts and the backoff between them
+connect
+    TCP connect and TLS handshake
+challenge
+    the digest auth 401 round trip
+server
+    from sending the request to the response headers, which is mostly
+    the management engine thinking about it
+transfer
+    sending the request and reading the response body, plus any
+    client side overhead
+parse
+    turning the response into python values
+
+Hooks are called before and after each request with a RequestEvent,
+which makes them a place to plug in any other sink (logs, statsd,
+...). Counts and latency histograms per action are kept as well, and
+can be exported in the Prometheus text format with prometheus().
+
+Clients without metrics don't pay anything for this.
+"""
+
+import threading
+
+import amt.utils
+
+PHASES = ('retry', 'connect', 'challenge', 'server', 'transfer', 'parse')
+
+# seconds, AMT answers in tens of milliseconds when it's happy and
+# takes many seconds when it isn't
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, 30.0, 60.0)
+
+
+class RequestEvent(object):
+    """One request made by a Client.
+
+    host is the WS-Man endpoint and action what the request did (see
+    amt.wsman.action_name). Once the request is over, elapsed is its
+    total time, phases a dict of seconds per phase, status the HTTP
+    status of the response (None if there wasn't one) and error the
+    exception it failed with, if it did.
+    """
+
+    __slots__ = ('host', 'action', 'start', 'elapsed', 'phases',
+                 'attempts', 'attempt_start', 'status', 'error')
+
+    def __init__(self, host, action):
+        self.host = host
+        self.action = action
+        self.start = amt.utils.now()
+        self.elapsed = None
+        self.phases = {}
+        self.attempts = 0
+        self.attempt_start = self.start
+        self.status = None
+        self.error = None
+
+    def attempt(self):
+        """Note the start of an(other) attempt at the request."""
+        self.attempts += 1
+        self.attempt_start = amt.utils.now()
+
+    @property
+    def outcome(self):
+        """The status code, or the name of the error, as a string."""
+        if self.error is not None:
+            return type(self.error).__name__
+        return str(self.status)
+
+    def as_dict(self):
+        return {'host': self.host, 'action': self.action,
+                'elapsed': self.elapsed, 'phases': dict(self.phases),
+                'attempts': self.attempts, 'status': self.status,
+                'outcome': self.outcome}
+
+    def __repr__(self):
+        return "<RequestEvent %s %s %s %r>" % (self.host, self.action,
+                                               self.outcome, self.elapsed)
+
+
+class Histogram(object):
+    """Counts of observations at or below each bucket bound."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        """(bound, count) pairs, as Prometheus wants them."""
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _labels(names, values, extra=''):
+    pairs = ['%s="%s"' % (name, _escape(value))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs)
+
+
+def _bound(value):
+    return '%r' % float(value)
+
+
+class Metrics(object):
+    """Collects timings and counts of the requests made by Clients.
+
+    Latency histograms are labelled by action, add per_host=True to
+    label them by host as well (that's a lot of series for a big
+    fleet). Request counts are always per host.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, per_host=False):
+        self.buckets = tuple(buckets)
+        self.per_host = per_host
+        self._before = []
+        self._after = []
+        # (host, action, outcome) => count
+        self._requests = {}
+        # host => count
+        self._challenges = {}
+        self._retries = {}
+        # (action,) or (host, action) => Histogram
+        self._latency = {}
+        # (action, phase) or (host, action, phase) => Histogram
+        self._phases = {}
+        self._lock = threading.Lock()
+
+    def add_hook(self, before=None, after=None):
+        """Call before(event) as each request starts, and after(event)
+        once it is over (and its event complete).
+
+        Hooks run in the thread making the request, and an exception
+        from one is raised to the caller, so keep them quick and safe.
+        """
+        if before is not None:
+            self._before.append(before)
+        if after is not None:
+            self._after.append(after)
+
+    def start(self, host, action):
+        """A new RequestEvent, for a request that is about to start."""
+        event = RequestEvent(host, action)
+        for hook in self._before:
+            hook(event)
+        return event
+
+    def finish(self, event):
+        """Record a finished request."""
+        if event.elapsed is None:
+            event.elapsed = amt.utils.now() - event.start
+        self._observe(event)
+        for hook in self._after:
+            hook(event)
+
+    def _observe(self, event):
+        key = (event.host, event.action) if self.per_host else (
+            event.action,)
+        with self._lock:
+            counter = (event.host, event.action, event.outcome)
+            self._requests[counter] = self._requests.get(counter, 0) + 1
+            if event.phases.get('challenge'):
+                self._challenges[event.host] = (
+                    self._challenges.get(event.host, 0) + 1)
+            if event.attempts > 1:
+                self._retries[event.host] = (
+                    self._retries.get(event.host, 0) + event.attempts - 1)
+            self._histogram(self._latency, key).observe(event.elapsed)
+            for phase, seconds in event.phases.items():
+                self._histogram(self._phases, key + (phase,)).observe(
+                    seconds)
+
+    def _histogram(self, histograms, key):
+        try:
+            return histograms[key]
+        except KeyError:
+            histogram = histograms[key] = Histogram(self.buckets)
+            return histogram
+
+    def requests(self, host=None, action=None):
+        """How many requests have been recorded, optionally only those
+        to host and/or for action."""
+        with self._lock:
+            return sum(count for (h, a, o), count in self._requests.items()
+                       if host in (None, h) and action in (None, a))
+
+    def prometheus(self):
+        """All the metrics, in the Prometheus text exposition format."""
+        names = ('host', 'action') if self.per_host else ('action',)
+        out = []
+        with self._lock:
+            out.append('# HELP amt_requests_total WS-Man requests made, '
+                       'by outcome (HTTP status or error).')
+            out.append('# TYPE amt_requests_total counter')
+            for key, count in sorted(self._requests.items()):
+                out.append('amt_requests_total%s %d' % (
+                    _labels(('host', 'action', 'outcome'), key), count))
+            for name, counts, text in (
+                    ('amt_digest_challenges_total', self._challenges,
+                     'Requests that needed a digest auth challenge.'),
+                    ('amt_request_retries_total', self._retries,
+                     'Extra attempts made after failures.')):
+                out.append('# HELP %s %s' % (name, text))
+                out.append('# TYPE %s counter' % name)
+                for host, count in sorted(counts.items()):
+                    out.append('%s%s %d' % (name, _labels(('host',), (host,)),
+                                            count))
+            self._export(out, 'amt_request_duration_seconds',
+                         'Time taken by WS-Man requests.',
+                         names, self._latency)
+            self._export(out, 'amt_request_phase_seconds',
+                         'Time taken by each phase of WS-Man requests.',
+                         names + ('phase',), self._phases)
+        return '\n'.join(out) + '\n'
+
+    @staticmethod
+    def _export(out, name, text, names, histograms):
+        out.append('# HELP %s %s' % (name, text))
+        out.append('# TYPE %s histogram' % name)
+        for key, histogram in sorted(histograms.items()):
+            for bound, count in histogram.cumulative():
+                out.append('%s_bucket%s %d' % (
+                    name, _labels(names, key, 'le="%s"' % _bound(bound)),
+                    count))
+            out.append('%s_bucket%s %d' % (
+                name, _labels(names, key, 'le="+Inf"'), histogram.count))
+            out.append('%s_sum%s %r' % (name, _labels(names, key),
+                                        histogram.sum))
+            out.append('%s_count%s %d' % (name, _labels(names, key),
+                                          histogram.count))
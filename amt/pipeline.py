@@ -0,0 +1,219 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Reprovision many AMT hosts over PXE.
+
+Reimaging a rack is three stages:
+
+boot
+    point every host at PXE for its next boot, all in parallel, as
+    that is only a couple of quick requests per host
+power
+    power cycle the hosts (or power on those that are off), in waves
+    of a few hosts at a time, so the rack doesn't take the inrush
+    current of every machine at once and the DHCP / TFTP servers
+    aren't hit by every host in the same second
+verify
+    wait for each host to be seen powered on, for a host that was
+    reset once it has been seen to go down, as it still reports on
+    for a moment after the reset is sent
+
+A host that fails a stage is left out of the later ones, and the
+Report says which stage it failed in and why.
+"""
+
+import time
+
+import amt.client
+import amt.fleet
+import amt.utils
+import amt.wsman
+
+STAGES = ('boot', 'power', 'verify')
+
+DEFAULT_WAVE_SIZE = 8
+# seconds from the start of one wave of power actions to the next
+DEFAULT_WAVE_INTERVAL = 10.0
+DEFAULT_VERIFY_TIMEOUT = 300
+# seconds to wait for a reset host to be seen going down, after that
+# the reset is taken to have been too quick to see
+DEFAULT_RESET_SETTLE = 30
+
+
+class StageReport(object):
+    """The outcome of one stage, a HostResult per host it ran on."""
+
+    __slots__ = ('name', 'results', 'elapsed')
+
+    def __init__(self, name, results, elapsed):
+        self.name = name
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        """The names of the hosts that passed this stage."""
+        return [r.name for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        """(name, error) for each host that failed this stage."""
+        return [(r.name, r.error) for r in self.results if not r.ok]
+
+    def __repr__(self):
+        return "<StageReport %s: %d of %d ok>" % (
+            self.name, len(self.ok), len(self.results))
+
+
+class Report(object):
+    """The outcome of a reprovisioning run, stage by stage."""
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.stages = []
+
+    def stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    @property
+    def failed(self):
+        """name => (stage, error) for every host that failed."""
+        failed = {}
+        for stage in self.stages:
+            for name, error in stage.failed:
+                failed[name] = (stage.name, error)
+        return failed
+
+    @property
+    def succeeded(self):
+        """The names of the hosts that made it through every stage."""
+        if len(self.stages) < len(STAGES):
+            return []
+        return self.stages[-1].ok
+
+    @property
+    def ok(self):
+        return len(self.succeeded) == len(self.names)
+
+
+def _power(client):
+    # a reset only makes sense for a running machine
+    state = amt.wsman.friendly_power_state(
+        client.power_status(use_cache=False))
+    if state == 'on':
+        client.power_cycle()
+        return 'reboot'
+    client.power_on()
+    return 'on'
+
+
+def _waves(targets, size):
+    for i in range(0, len(targets), size):
+        yield targets[i:i + size]
+
+
+class Pipeline(object):
+    """Reprovision a set of hosts, see the module docstring.
+
+    clients is a dict (or list of pairs) of host name to Client.
+    Power actions are sent to at most wave_size hosts at once, with
+    waves started wave_interval seconds apart. Hosts that were reset
+    are given up to reset_settle seconds to be seen going down before
+    they are checked for coming back up. concurrency limits the
+    hosts talked to at once in the other stages. progress, if given,
+    is called with each StageReport as its stage finishes.
+    """
+
+    def __init__(self, clients, boot_device='pxe',
+                 wave_size=DEFAULT_WAVE_SIZE,
+                 wave_interval=DEFAULT_WAVE_INTERVAL,
+                 verify_timeout=DEFAULT_VERIFY_TIMEOUT,
+                 reset_settle=DEFAULT_RESET_SETTLE,
+                 concurrency=amt.fleet.DEFAULT_CONCURRENCY,
+                 progress=None):
+        if hasattr(clients, 'items'):
+            clients = list(clients.items())
+        if boot_device not in amt.wsman.BOOT_DEVICES:
+            raise ValueError("Unknown boot device %s" % boot_device)
+        if wave_size < 1:
+            raise ValueError("wave_size must be at least 1")
+        self.clients = clients
+        self.boot_device = boot_device
+        self.wave_size = wave_size
+        self.wave_interval = wave_interval
+        self.verify_timeout = verify_timeout
+        self.reset_settle = reset_settle
+        self.concurrency = concurrency
+        self.progress = progress
+
+    def _stage(self, report, name, targets, func):
+        start = amt.utils.now()
+        results = func(targets)
+        stage = StageReport(name, results, amt.utils.now() - start)
+        report.stages.append(stage)
+        if self.progress is not None:
+            self.progress(stage)
+        ok = set(stage.ok)
+        return [(n, client) for n, client in targets if n in ok]
+
+    def _boot(self, targets):
+        def boot(name, client):
+            client.set_next_boot(self.boot_device)
+
+        return amt.fleet.run(targets, boot, self.concurrency)
+
+    def _power(self, targets):
+        results = []
+        started = None
+        for wave in _waves(targets, self.wave_size):
+            if started is not None:
+                time.sleep(max(self.wave_interval -
+                               (amt.utils.now() - started), 0))
+            started = amt.utils.now()
+            results.extend(amt.fleet.run(
+                wave, lambda name, client: _power(client),
+                self.wave_size))
+        return results
+
+    def _verify(self, targets):
+        reset = set(r.name for r in self._report.stage('power').results
+                    if r.ok and r.value == 'reboot')
+
+        def verify(name, client):
+            if name in reset:
+                client.wait_for_power_change('on', self.reset_settle)
+            if not client.wait_for_power_state('on', self.verify_timeout):
+                raise amt.client.AMTError(
+                    "not powered on after %ss" % self.verify_timeout)
+
+        return amt.fleet.run(targets, verify, self.concurrency)
+
+    def run(self):
+        """Run every stage, returning a Report."""
+        report = self._report = Report(
+            name for name, client in self.clients)
+        targets = self.clients
+        for name in STAGES:
+            targets = self._stage(report, name, targets,
+                                  getattr(self, '_' + name))
+        return report
+
+
+def reprovision(clients, **kwargs):
+    """Reprovision clients over PXE, returning a Report.
+
+    See Pipeline for the arguments.
+    """
+    return Pipeline(clients, **kwargs).run()
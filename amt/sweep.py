@@ -0,0 +1,208 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Snapshots of the state of every host in the host db.
+
+A sweep asks each host, in parallel, for its power state, boot config,
+KVM state and firmware version, and writes what it finds to a snapshot
+file: a JSON object per host per line, ordered by name, e.g.::
+
+    {"name": "n1", "uri": "http://10.42.0.1:16992/wsman",
+     "swept": 1700000000.0, "elapsed": 0.21, "power": "on",
+     "boot_source": "pxe", "boot_next": false, "kvm": "disabled",
+     "firmware": "11.8.50", "error": null}
+
+power is a name from amt.wsman.POWER_STATES, boot_source as returned
+by Client.boot_source, boot_next whether the boot config will be used
+on the next boot, and kvm one of KVM_STATES. swept is when the host
+was asked (seconds since the epoch). A host that couldn't be asked
+has error set and null for its state.
+
+The snapshot is replaced atomically, so readers (dashboards, scripts)
+can read it at any time instead of each asking the hosts themselves.
+
+Sweeps are incremental: a host is only asked again if its record is
+older than max_age, its address has changed in the host db, or the
+last sweep of it failed. Otherwise its record is carried over from the
+previous snapshot.
+"""
+
+import collections
+import json
+import os
+import time
+
+import amt.client
+import amt.fleet
+import amt.utils
+import amt.wsman
+
+SNAPSHOT_NAME = 'sweep.jsonl'
+
+# seconds a host's record is reused for by default
+DEFAULT_MAX_AGE = 300
+
+FIELDS = ('power', 'boot_source', 'boot_next', 'kvm', 'firmware')
+
+# every key of a record, in the order written
+_KEYS = ('name', 'uri', 'swept', 'elapsed') + FIELDS + ('error',)
+
+# EnabledState of the KVM redirection SAP
+KVM_STATES = {
+    '2': 'enabled',
+    '3': 'disabled',
+    '6': 'enabled but offline',
+}
+
+
+def probe(client):
+    """Ask client's host for the FIELDS of its snapshot record."""
+    kvm = client.get_properties(amt.client.CIM_KVMRedirectionSAP,
+                                ['EnabledState'])['EnabledState']
+    firmware = None
+    for identity in client.enumerate(amt.client.CIM_SoftwareIdentity):
+        if identity.get('InstanceID') == 'AMT':
+            firmware = identity.get('VersionString')
+    return {
+        'power': amt.wsman.friendly_power_state(
+            client.power_status(use_cache=False)),
+        'boot_source': client.boot_source(use_cache=False),
+        'boot_next': client.boot_config_role(use_cache=False),
+        'kvm': KVM_STATES.get(kvm, 'unknown'),
+        'firmware': firmware,
+    }
+
+
+def read_snapshot(path):
+    """The records in the snapshot at path, as a dict by name.
+
+    A missing or unreadable snapshot is treated as empty, it only
+    means every host is asked again.
+    """
+    records = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                records[record['name']] = record
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return {}
+    return records
+
+
+def write_snapshot(path, records):
+    """Replace the snapshot at path with records, ordered by name."""
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname, 0o770)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        for record in sorted(records, key=lambda r: r['name']):
+            f.write(json.dumps(collections.OrderedDict(
+                (key, record.get(key)) for key in _KEYS)) + '\n')
+    os.rename(tmp, path)
+
+
+def _uri(server):
+    return amt.client.wsman_uri(server['host'],
+                                server.get('protocol') or 'http')
+
+
+def _fresh(record, uri, now, max_age):
+    return (record is not None and record.get('error') is None and
+            record.get('uri') == uri and
+            now - record.get('swept', 0) < max_age)
+
+
+class Sweep(object):
+    """Sweep the servers in db, see the module docstring.
+
+    path is the snapshot to update, by default sweep.jsonl in the
+    amtctrl config dir. selector (see HostDB.resolve) limits the
+    sweep to some of the servers, the records of the others are kept
+    as they are. client_kwargs are passed on to every Client created.
+    """
+
+    def __init__(self, db, path=None, selector=None,
+                 max_age=DEFAULT_MAX_AGE,
+                 concurrency=amt.fleet.DEFAULT_CONCURRENCY,
+                 client_kwargs=None):
+        self.db = db
+        self.path = path or os.path.join(db.confdir, SNAPSHOT_NAME)
+        self.selector = selector
+        self.max_age = max_age
+        self.concurrency = concurrency
+        self.client_kwargs = client_kwargs or {}
+
+    def _sweep_one(self, name, server):
+        client = amt.client.Client.from_server(server, **self.client_kwargs)
+        start = amt.utils.now()
+        try:
+            state = probe(client)
+        finally:
+            client.close()
+        state['elapsed'] = round(amt.utils.now() - start, 3)
+        return state
+
+    def run(self):
+        """Sweep, and write the snapshot.
+
+        Returns a dict of the number of hosts queried, reused (from
+        the previous snapshot) and failed.
+        """
+        previous = read_snapshot(self.path)
+        servers = dict(self.db.servers())
+        if self.selector:
+            names = [name for name in self.db.resolve(self.selector)
+                     if name in servers]
+        else:
+            names = sorted(servers)
+        targets = set(names)
+        now = round(time.time(), 3)
+        # the hosts that aren't swept this time keep their records,
+        # unless they have gone from the host db
+        records = [record for name, record in previous.items()
+                   if name in servers and name not in targets]
+        stale = []
+        for name in names:
+            uri = _uri(servers[name])
+            if _fresh(previous.get(name), uri, now, self.max_age):
+                records.append(previous[name])
+            else:
+                stale.append((name, servers[name]))
+        counts = {'queried': len(stale), 'reused': len(names) - len(stale),
+                  'failed': 0}
+
+        for result in amt.fleet.run(stale, self._sweep_one,
+                                    self.concurrency):
+            record = {'name': result.name,
+                      'uri': _uri(servers[result.name]),
+                      'swept': now, 'error': None}
+            if result.ok:
+                record.update(result.value)
+            else:
+                counts['failed'] += 1
+                record['error'] = str(result.error) or type(
+                    result.error).__name__
+                record['elapsed'] = None
+                record.update((field, None) for field in FIELDS)
+            records.append(record)
+        write_snapshot(self.path, records)
+        return counts
+
+
+def sweep(db, **kwargs):
+    """Sweep the servers in db, returning the counts from Sweep.run.
+
+    See Sweep for the arguments.
+    """
+    return Sweep(db, **kwargs).run()
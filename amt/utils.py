@@ -0,0 +1,30 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import random
+import time
+
+# python 2 has no monotonic clock
+now = getattr(time, 'monotonic', time.time)
+
+
+def backoff(initial, maximum, factor=2.0, jitter=0.2):
+    """Generate exponentially growing delays, capped at maximum.
+
+    Each delay is randomly spread by +/- jitter (a fraction of the
+    delay) so that many pollers started together don't stay in lock
+    step.
+    """
+    delay = initial
+    while True:
+        yield delay * random.uniform(1 - jitter, 1 + jitter)
+        delay = min(delay * factor, maximum)
@@ -0,0 +1,158 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Watch the power state of many AMT hosts.
+
+A PowerWatcher runs a single polling loop per host, no matter how
+many callers are interested in that host, so the management engines
+see one stream of requests rather than one per consumer. Polling
+backs off while a host's state is stable and snaps back to the fast
+interval when it changes, or when someone starts waiting on it.
+"""
+
+import threading
+
+import amt.utils
+import amt.wsman
+
+
+class _HostPoller(object):
+
+    def __init__(self, watcher, name, client):
+        self.watcher = watcher
+        self.name = name
+        self.client = client
+        self.state = None
+        self.error = None
+        self.cond = threading.Condition()
+        self.wake = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run,
+                                       name='amt-watch-%s' % name)
+        self.thread.daemon = True
+
+    def _delays(self):
+        return amt.utils.backoff(self.watcher.interval,
+                                 self.watcher.max_interval)
+
+    def poll(self):
+        try:
+            state = amt.wsman.friendly_power_state(
+                self.client.power_status())
+            error = None
+        except Exception as e:
+            state = self.state
+            error = e
+        with self.cond:
+            old = self.state
+            self.state = state
+            self.error = error
+            self.cond.notify_all()
+        return old, state
+
+    def run(self):
+        delays = self._delays()
+        while not self.stopped:
+            old, new = self.poll()
+            if new != old:
+                self.watcher._changed(self.name, old, new)
+                delays = self._delays()
+            self.wake.wait(next(delays))
+            if self.wake.is_set():
+                # somebody new is interested, go back to polling fast
+                self.wake.clear()
+                delays = self._delays()
+
+    def stop(self):
+        self.stopped = True
+        self.wake.set()
+        with self.cond:
+            self.cond.notify_all()
+
+
+class PowerWatcher(object):
+    """Poll the power state of a set of hosts.
+
+    callback, if given, is called as ``callback(name, old, new)`` from
+    the polling thread whenever a host's (friendly) power state
+    changes, including the first time it is seen (old is None).
+    """
+
+    def __init__(self, interval=1.0, max_interval=30.0, callback=None):
+        self.interval = interval
+        self.max_interval = max_interval
+        self._callbacks = []
+        if callback is not None:
+            self._callbacks.append(callback)
+        self._pollers = {}
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def _changed(self, name, old, new):
+        for callback in list(self._callbacks):
+            callback(name, old, new)
+
+    def watch(self, name, client):
+        """Start watching a host, if it isn't already being watched."""
+        with self._lock:
+            if name in self._pollers:
+                return
+            poller = self._pollers[name] = _HostPoller(self, name, client)
+        poller.thread.start()
+
+    def unwatch(self, name):
+        with self._lock:
+            poller = self._pollers.pop(name, None)
+        if poller is not None:
+            poller.stop()
+
+    def stop(self):
+        """Stop watching all hosts."""
+        with self._lock:
+            pollers = list(self._pollers.values())
+            self._pollers.clear()
+        for poller in pollers:
+            poller.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def state(self, name):
+        """The last seen power state of a host, None if not known yet."""
+        return self._pollers[name].state
+
+    def wait_for(self, name, state, timeout=120):
+        """Wait for a watched host to reach a power state.
+
+        state is a name from amt.wsman.POWER_STATES or its CIM value,
+        as for Client.wait_for_power_state. Any number of threads can
+        wait on the same host, they all share its one polling loop.
+        Returns True once the state is seen, or False if it isn't
+        within timeout seconds (or the host stops being watched).
+        """
+        state = amt.wsman.friendly_power_state(
+            amt.wsman.power_state_value(state))
+        poller = self._pollers[name]
+        deadline = amt.utils.now() + timeout
+        poller.wake.set()
+        with poller.cond:
+            while poller.state != state:
+                remaining = deadline - amt.utils.now()
+                if remaining <= 0 or poller.stopped:
+                    return False
+                poller.cond.wait(remaining)
+            return True
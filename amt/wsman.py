@@ -21,7 +21,13 @@
 # not straight forward to build, so the code is hard to test, and
 # quite non portable.
 
+import collections
+import itertools
+import os
+import re
+import threading
 import uuid
+from xml.sax.saxutils import escape
 
 POWER_STATES = {
     'on': 2,
@@ -45,105 +51,433 @@ def friendly_power_state(state):
     return FRIENDLY_POWER_STATE.get(int(state), 'unknown')
 
 
-def get_request(uri, resource):
-    stub = """<?xml version="1.0" encoding="UTF-8"?>
-<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:wsa="http://schemas.xmlsoap.org/ws/2004/08/addressing" xmlns:wsman="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd">
-   <s:Header>
-       <wsa:Action s:mustUnderstand="true">http://schemas.xmlsoap.org/ws/2004/09/transfer/Get</wsa:Action>
-       <wsa:To s:mustUnderstand="true">%(uri)s</wsa:To>
-       <wsman:ResourceURI s:mustUnderstand="true">%(resource)s</wsman:ResourceURI>
-       <wsa:MessageID s:mustUnderstand="true">uuid:%(uuid)s</wsa:MessageID>
-       <wsa:ReplyTo>
-           <wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address>
-       </wsa:ReplyTo>
-   </s:Header>
-   <s:Body/>
-</s:Envelope>
-"""  # noqa
-    return stub % {'uri': uri, 'resource': resource, 'uuid': uuid.uuid4()}
+def power_state_value(state):
+    """The CIM value of a power state given by name or value.
+
+    state is a name from POWER_STATES ('on', 'off', ...) or one of
+    their values, as an int or a string. Raises ValueError for
+    anything else.
+    """
+    if state in POWER_STATES:
+        return POWER_STATES[state]
+    try:
+        value = int(state)
+    except (TypeError, ValueError):
+        value = None
+    if value not in FRIENDLY_POWER_STATE:
+        raise ValueError("Unknown power state %s" % (state,))
+    return value
+
+
+_id_lock = threading.Lock()
+_id_pid = None
+_id_prefix = None
+_id_counter = None
+
+
+def _seed_message_ids():
+    global _id_pid, _id_prefix, _id_counter
+    with _id_lock:
+        if _id_pid != os.getpid():
+            # the first 3 groups of a random uuid4, which keeps the
+            # version and variant bits intact, the last group is a
+            # counter.
+            _id_prefix = str(uuid.uuid4())[:24]
+            _id_counter = itertools.count()
+            _id_pid = os.getpid()
+
+
+def message_id():
+    """A unique id for a WS-Man message.
+
+    Reading 16 bytes from os.urandom for every message is a lot of
+    overhead for an id that only needs to be unique, so a random uuid4
+    is picked once per process and the last 48 bits are replaced with a
+    counter. The result is still a well formed uuid.
+    """
+    if _id_pid != os.getpid():
+        _seed_message_ids()
+    return '%s%012x' % (_id_prefix, next(_id_counter) & 0xffffffffffff)
+
+
+_FIELD = re.compile(r'%\((\w+)\)s')
+
+
+def _encode(value):
+    return escape(str(value)).encode('utf-8')
+
+
+class _Template(object):
+    """A WS-Man envelope with fields to fill in.
+
+    The envelope text is split into static byte strings once, when it
+    is defined, so rendering is only a join of those with the (xml
+    escaped, utf-8 encoded) field values.
+    """
+    def __init__(self, text):
+        parts = _FIELD.split(text)
+        self._static = [part.encode('utf-8') for part in parts[0::2]]
+        self.fields = parts[1::2]
+        # see _bound_template
+        self._bound = {}
+
+    def bind(self, **values):
+        """Fill in some of the fields, returning a new template."""
+        static = [self._static[0]]
+        fields = []
+        for name, part in zip(self.fields, self._static[1:]):
+            if name in values:
+                static[-1] += _encode(values[name]) + part
+            else:
+                fields.append(name)
+                static.append(part)
+        bound = _Template.__new__(_Template)
+        bound._static = static
+        bound.fields = fields
+        bound._bound = {}
+        return bound
+
+    def render(self, **values):
+        out = [self._static[0]]
+        for name, part in zip(self.fields, self._static[1:]):
+            out.append(_encode(values[name]))
+            out.append(part)
+        return b''.join(out)
+
+
+# Templates with the endpoint and resource already filled in, so the
+# per message work is only adding the message id and any arguments.
+# They are kept on the template they were bound from, so they go when
+# it does.
+_BOUND_CACHE_SIZE = 4096
+
+
+def _bound_template(template, **values):
+    key = tuple(sorted(values.items()))
+    cache = template._bound
+    try:
+        return cache[key]
+    except KeyError:
+        if len(cache) >= _BOUND_CACHE_SIZE:
+            cache.clear()
+        bound = cache[key] = template.bind(**values)
+        return bound
+
+
+# Resource uris are built from the schema of the class. Classes can be
+# given by name ('CIM_BootService', 'AMT_GeneralSettings') anywhere a
+# resource is expected.
+CIM_SCHEMA = 'http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/'
+AMT_SCHEMA = 'http://intel.com/wbem/wscim/1/amt-schema/1/'
+IPS_SCHEMA = 'http://intel.com/wbem/wscim/1/ips-schema/1/'
+
+_SCHEMAS = (('CIM_', CIM_SCHEMA), ('AMT_', AMT_SCHEMA), ('IPS_', IPS_SCHEMA))
+
+
+def resource_uri(resource):
+    """The uri of a resource given by class name, full uris are
+    returned as they are."""
+    if '/' in resource:
+        return resource
+    for prefix, schema in _SCHEMAS:
+        if resource.startswith(prefix):
+            return schema + resource
+    raise ValueError("Unknown resource %s, expected a uri or a CIM_, AMT_ "
+                     "or IPS_ class name" % resource)
+
+
+class Reference(collections.namedtuple('Reference', 'resource selectors')):
+    """An endpoint reference to the instance of resource picked out by
+    selectors (a dict), as a parameter value for invoke_request."""
+
+    __slots__ = ()
+
+    def __new__(cls, resource, selectors=None):
+        return super(Reference, cls).__new__(cls, resource, selectors or {})
+
+
+_ADDRESSING = 'http://schemas.xmlsoap.org/ws/2004/08/addressing'
+_ANONYMOUS = _ADDRESSING + '/role/anonymous'
+_TRANSFER = 'http://schemas.xmlsoap.org/ws/2004/09/transfer'
+
+
+def _attr(text):
+    return escape(text, {'"': '&quot;'})
+
+
+def _pairs(values):
+    # a dict, or (name, value) pairs when the order matters
+    if values is None:
+        return ()
+    if isinstance(values, dict):
+        return tuple(values.items())
+    return tuple(values)
+
+
+def _shape(value):
+    """What a parameter value looks like, as far as its XML goes."""
+    if isinstance(value, Reference):
+        return ('ref', resource_uri(value.resource),
+                tuple(sorted(value.selectors)))
+    if isinstance(value, (list, tuple)):
+        return ('list',) + tuple(_shape(item) for item in value)
+    return None
+
+
+def _flatten(value, out):
+    """Append the field values of a parameter value, in the order
+    _Envelope gives out their fields."""
+    if isinstance(value, Reference):
+        out.extend(value.selectors[name] for name in sorted(value.selectors))
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _flatten(item, out)
+    elif isinstance(value, bool):
+        out.append('true' if value else 'false')
+    else:
+        out.append(value)
+
+
+class _Envelope(object):
+    """Writes out the text of a _Template, handing out its fields."""
+
+    def __init__(self, action, resource, ns=None, names=None):
+        # field names, f0, f1... unless given
+        self.names = names or ('f%d' % i for i in itertools.count())
+        xmlns = ''
+        if ns:
+            xmlns = ' xmlns:n1="%s"' % _attr(resource)
+        self.lines = [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" '
+            'xmlns:wsa="%s" xmlns:wsman="http://schemas.dmtf.org/wbem/'
+            'wsman/1/wsman.xsd"%s>' % (_ADDRESSING, xmlns),
+            '<s:Header>',
+            '<wsa:Action s:mustUnderstand="true">%s</wsa:Action>'
+            % escape(action),
+            '<wsa:To s:mustUnderstand="true">%(uri)s</wsa:To>',
+            '<wsman:ResourceURI s:mustUnderstand="true">%s'
+            '</wsman:ResourceURI>' % escape(resource),
+            '<wsa:MessageID s:mustUnderstand="true">uuid:%(message_id)s'
+            '</wsa:MessageID>',
+            '<wsa:ReplyTo>',
+            '<wsa:Address>%s</wsa:Address>' % _ANONYMOUS,
+            '</wsa:ReplyTo>',
+        ]
+
+    def field(self):
+        return '%(' + next(self.names) + ')s'
+
+    def selectors(self, names, out=None, attr='Name'):
+        if not names:
+            return
+        out = self.lines if out is None else out
+        out.append('<wsman:SelectorSet>')
+        for name in names:
+            out.append('<wsman:Selector %s="%s">%s</wsman:Selector>'
+                       % (attr, _attr(name), self.field()))
+        out.append('</wsman:SelectorSet>')
+
+    def element(self, out, prefix, name, shape):
+        tag = '%s:%s' % (prefix, name)
+        if shape is None:
+            out.append('<%s>%s</%s>' % (tag, self.field(), tag))
+        elif shape[0] == 'list':
+            for item in shape[1:]:
+                self.element(out, prefix, name, item)
+        else:
+            kind, resource, selectors = shape
+            out.extend(['<%s>' % tag,
+                        '<wsa:Address>%s</wsa:Address>' % _ANONYMOUS,
+                        '<wsa:ReferenceParameters>',
+                        '<wsman:ResourceURI>%s</wsman:ResourceURI>'
+                        % escape(resource)])
+            self.selectors(selectors, out, attr='wsman:Name')
+            out.extend(['</wsa:ReferenceParameters>', '</%s>' % tag])
+
+    def template(self, opening=None, elements=(), closing=None,
+                 prefix=None):
+        """The finished template, with a body of the elements (name,
+        shape pairs) between opening and closing tags, or an empty
+        body if there's no opening."""
+        self.lines.append('</s:Header>')
+        if opening is None:
+            self.lines.extend(['<s:Body/>', '</s:Envelope>'])
+        else:
+            self.lines.extend(['<s:Body>', opening])
+            for name, shape in elements:
+                self.element(self.lines, prefix, name, shape)
+            self.lines.extend([closing, '</s:Body></s:Envelope>'])
+        return _Template('\n'.join(self.lines))
+
+
+def _compile_get(resource, selectors, names=None):
+    envelope = _Envelope(_TRANSFER + '/Get', resource, names=names)
+    envelope.selectors(selectors)
+    return envelope.template()
+
+
+def _compile_put(resource, selectors, properties, names=None):
+    envelope = _Envelope(_TRANSFER + '/Put', resource, names=names)
+    envelope.selectors(selectors)
+    name = resource.rpartition('/')[2]
+    return envelope.template('<g:%s xmlns:g="%s">' % (name, _attr(resource)),
+                             properties, '</g:%s>' % name, 'g')
+
+
+def _compile_invoke(resource, selectors, method, params, names=None):
+    envelope = _Envelope(resource + '/' + method, resource, ns=True,
+                         names=names)
+    envelope.selectors(selectors)
+    return envelope.template('<n1:%s_INPUT>' % method, params,
+                             '</n1:%s_INPUT>' % method, 'n1')
+
+
+# Compiled envelopes, by the kind of request, resource, method and the
+# shape of its selectors and arguments. Everything but the values is
+# fixed by those, so a serializer is built once and every later
+# request like it is only a render.
+_SERIALIZER_CACHE_SIZE = 1024
+_serializers = {}
+
+_COMPILERS = {
+    'get': _compile_get,
+    'put': _compile_put,
+    'invoke': _compile_invoke,
+}
+
+
+def _serializer(key):
+    try:
+        return _serializers[key]
+    except KeyError:
+        if len(_serializers) >= _SERIALIZER_CACHE_SIZE:
+            _serializers.clear()
+        template = _serializers[key] = _COMPILERS[key[0]](*key[1:])
+        return template
+
+
+def _selector_values(selectors):
+    names = tuple(sorted(selectors or ()))
+    return names, [selectors[name] for name in names]
+
+
+def _get_key(resource, selectors):
+    names, values = _selector_values(selectors)
+    return ('get', resource_uri(resource), names), values
+
+
+def _put_key(resource, properties, selectors):
+    names, values = _selector_values(selectors)
+    pairs = sorted(_pairs(properties))
+    for name, value in pairs:
+        _flatten(value, values)
+    return ('put', resource_uri(resource), names,
+            tuple((name, _shape(value)) for name, value in pairs)), values
+
+
+def _invoke_key(resource, method, selectors, params):
+    names, values = _selector_values(selectors)
+    pairs = _pairs(params)
+    for name, value in pairs:
+        _flatten(value, values)
+    return ('invoke', resource_uri(resource), names, method,
+            tuple((name, _shape(value)) for name, value in pairs)), values
+
+
+def _request(uri, key, values):
+    fields = dict(('f%d' % i, value) for i, value in enumerate(values))
+    return _bound_template(_serializer(key), uri=uri).render(
+        message_id=message_id(), **fields)
+
+
+def get_request(uri, resource, selectors=None):
+    """Get the instance of resource, the one picked out by selectors
+    if there are several."""
+    return _request(uri, *_get_key(resource, selectors))
+
+
+def put_request(uri, resource, properties, selectors=None):
+    """Replace the properties of an instance of resource.
+
+    properties is a dict, and is sent ordered by name, as CIM classes
+    define them. Values may be strings, numbers, bools or lists of
+    them (for array properties).
+    """
+    return _request(uri, *_put_key(resource, properties, selectors))
+
+
+def invoke_request(uri, resource, method, selectors=None, params=None):
+    """Invoke method of the instance of resource picked out by
+    selectors (a dict).
+
+    params are the method's arguments, as a dict or, as method inputs
+    are ordered, (name, value) pairs. Values may be strings, numbers,
+    bools, References, or lists of those.
+    """
+    return _request(uri, *_invoke_key(resource, method, selectors, params))
+
+
+class _Arg(object):
+    """A value _prepare leaves as a field, called name."""
+
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+def _prepare(key, values):
+    """A template for the requests built into this module, with all
+    their fixed values filled in, so only the message id, uri and
+    _Args are left to render per request."""
+    names = [value.name if isinstance(value, _Arg) else 'f%d' % i
+             for i, value in enumerate(values)]
+    template = _COMPILERS[key[0]](*key[1:], names=iter(names))
+    return template.bind(**dict(
+        (name, value) for name, value in zip(names, values)
+        if not isinstance(value, _Arg)))
+
+
+_KVM_SETTINGS_PUT = _prepare(*_put_key('IPS_KVMRedirectionSettingData', {
+    'DefaultScreen': 0,
+    'ElementName': 'Intel(r) KVM Redirection Settings',
+    'EnabledByMEBx': True,
+    'InstanceID': 'Intel(r) KVM Redirection Settings',
+    'Is5900PortEnabled': True,
+    'OptInPolicy': False,
+    'RFBPassword': _Arg('passwd'),
+    'SessionTimeout': 0,
+}, None))
 
 
 def enable_remote_kvm(uri, passwd):
-    stub = """<?xml version="1.0" encoding="UTF-8"?>
-<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:wsa="http://schemas.xmlsoap.org/ws/2004/08/addressing" xmlns:wsman="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd">
-<s:Header>
-<wsa:Action s:mustUnderstand="true">http://schemas.xmlsoap.org/ws/2004/09/transfer/Put</wsa:Action>
-<wsa:To s:mustUnderstand="true">%(uri)s</wsa:To>
-<wsman:ResourceURI s:mustUnderstand="true">http://intel.com/wbem/wscim/1/ips-schema/1/IPS_KVMRedirectionSettingData</wsman:ResourceURI>
-<wsa:MessageID s:mustUnderstand="true">uuid:%(uuid)s</wsa:MessageID>
-<wsa:ReplyTo>
-    <wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address>
-</wsa:ReplyTo>
-</s:Header>
-<s:Body>
-<g:IPS_KVMRedirectionSettingData xmlns:g="http://intel.com/wbem/wscim/1/ips-schema/1/IPS_KVMRedirectionSettingData">
-<g:DefaultScreen>0</g:DefaultScreen>
-<g:ElementName>Intel(r) KVM Redirection Settings</g:ElementName>
-<g:EnabledByMEBx>true</g:EnabledByMEBx>
-<g:InstanceID>Intel(r) KVM Redirection Settings</g:InstanceID>
-<g:Is5900PortEnabled>true</g:Is5900PortEnabled>
-<g:OptInPolicy>false</g:OptInPolicy>
-<g:RFBPassword>%(passwd)s</g:RFBPassword>
-<g:SessionTimeout>0</g:SessionTimeout>
-</g:IPS_KVMRedirectionSettingData>
-</s:Body>
-</s:Envelope>"""  # noqa
-    return stub % {'uri': uri, 'passwd': passwd, 'uuid': uuid.uuid4()}
+    return _bound_template(_KVM_SETTINGS_PUT, uri=uri).render(
+        message_id=message_id(), passwd=passwd)
+
+
+_KVM_REQUEST_STATE_CHANGE = _prepare(*_invoke_key(
+    'CIM_KVMRedirectionSAP', 'RequestStateChange', None,
+    [('RequestedState', 2)]))
 
 
 def kvm_redirect(uri):
-    stub = """<?xml version="1.0" encoding="UTF-8"?>
-<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:wsa="http://schemas.xmlsoap.org/ws/2004/08/addressing" xmlns:wsman="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:n1="http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_KVMRedirectionSAP">
-<s:Header>
-<wsa:Action s:mustUnderstand="true">http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_KVMRedirectionSAP/RequestStateChange</wsa:Action>
-<wsa:To s:mustUnderstand="true">%(uri)s</wsa:To>
-<wsman:ResourceURI s:mustUnderstand="true">http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_KVMRedirectionSAP</wsman:ResourceURI>
-<wsa:MessageID s:mustUnderstand="true">uuid:%(uuid)s</wsa:MessageID>
-<wsa:ReplyTo>
-<wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address>
-</wsa:ReplyTo>
-</s:Header>
-<s:Body>
-<n1:RequestStateChange_INPUT>
-<n1:RequestedState>2</n1:RequestedState>
-</n1:RequestStateChange_INPUT>
-</s:Body></s:Envelope>"""  # noqa
-    return stub % {'uri': uri, 'uuid': uuid.uuid4()}
+    return _bound_template(_KVM_REQUEST_STATE_CHANGE, uri=uri).render(
+        message_id=message_id())
+
+
+_REQUEST_POWER_STATE_CHANGE = _prepare(*_invoke_key(
+    'CIM_PowerManagementService', 'RequestPowerStateChange',
+    {'Name': 'Intel(r) AMT Power Management Service'},
+    [('PowerState', _Arg('power_state')),
+     ('ManagedElement',
+      Reference('CIM_ComputerSystem', {'Name': 'ManagedSystem'}))]))
 
 
 def power_state_request(uri, power_state):
-    stub = """<?xml version="1.0" encoding="UTF-8"?>
-    <s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:wsa="http://schemas.xmlsoap.org/ws/2004/08/addressing" xmlns:wsman="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:n1="http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_PowerManagementService">
-    <s:Header>
-    <wsa:Action s:mustUnderstand="true">http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_PowerManagementService/RequestPowerStateChange</wsa:Action>
-    <wsa:To s:mustUnderstand="true">%(uri)s</wsa:To>
-    <wsman:ResourceURI s:mustUnderstand="true">http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_PowerManagementService</wsman:ResourceURI>
-    <wsa:MessageID s:mustUnderstand="true">uuid:%(uuid)s</wsa:MessageID>
-    <wsa:ReplyTo>
-        <wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address>
-    </wsa:ReplyTo>
-    <wsman:SelectorSet>
-       <wsman:Selector Name="Name">Intel(r) AMT Power Management Service</wsman:Selector>
-    </wsman:SelectorSet>
-    </s:Header>
-    <s:Body>
-      <n1:RequestPowerStateChange_INPUT>
-        <n1:PowerState>%(power_state)d</n1:PowerState>
-        <n1:ManagedElement>
-          <wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address>
-          <wsa:ReferenceParameters>
-             <wsman:ResourceURI>http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_ComputerSystem</wsman:ResourceURI>
-             <wsman:SelectorSet>
-                <wsman:Selector wsman:Name="Name">ManagedSystem</wsman:Selector>
-             </wsman:SelectorSet>
-           </wsa:ReferenceParameters>
-         </n1:ManagedElement>
-       </n1:RequestPowerStateChange_INPUT>
-      </s:Body></s:Envelope>
-"""  # noqa
-    return stub % {'uri': uri,
-                   'power_state': POWER_STATES[power_state],
-                   'uuid': uuid.uuid4()}
+    return _bound_template(_REQUEST_POWER_STATE_CHANGE, uri=uri).render(
+        message_id=message_id(),
+        power_state=POWER_STATES[power_state])
 
 
 def change_boot_to_pxe_request(uri):
@@ -151,67 +485,132 @@ def change_boot_to_pxe_request(uri):
         uri, boot_device='pxe')
 
 
+_BOOT_CONFIG = {'InstanceID': 'Intel(r) AMT: Boot Configuration 0'}
+
+_CHANGE_BOOT_ORDER = _prepare(*_invoke_key(
+    'CIM_BootConfigSetting', 'ChangeBootOrder', _BOOT_CONFIG,
+    [('Source', Reference('CIM_BootSourceSetting',
+                          {'InstanceID': _Arg('boot_device')}))]))
+
+
 def change_boot_order_request(uri, boot_device):
     assert boot_device in BOOT_DEVICES
-    stub = """<?xml version="1.0" encoding="UTF-8"?>
-<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:wsa="http://schemas.xmlsoap.org/ws/2004/08/addressing" xmlns:wsman="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:n1="http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_BootConfigSetting">
+    return _bound_template(_CHANGE_BOOT_ORDER, uri=uri).render(
+        message_id=message_id(),
+        boot_device=BOOT_DEVICES[boot_device])
+
+
+_SET_BOOT_CONFIG_ROLE = _prepare(*_invoke_key(
+    'CIM_BootService', 'SetBootConfigRole',
+    {'Name': 'Intel(r) AMT Boot Service'},
+    [('BootConfigSetting', Reference('CIM_BootConfigSetting', _BOOT_CONFIG)),
+     ('Role', 1)]))
+
+
+def enable_boot_config_request(uri):
+    return _bound_template(_SET_BOOT_CONFIG_ROLE, uri=uri).render(
+        message_id=message_id())
+
+
+# Max number of instances to ask for in a single Enumerate / Pull
+# response.
+DEFAULT_MAX_ELEMENTS = 32
+
+_ENUMERATE = _Template("""<?xml version="1.0" encoding="UTF-8"?>
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:wsa="http://schemas.xmlsoap.org/ws/2004/08/addressing" xmlns:wsman="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:wsen="http://schemas.xmlsoap.org/ws/2004/09/enumeration">
 <s:Header>
-<wsa:Action s:mustUnderstand="true">http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_BootConfigSetting/ChangeBootOrder</wsa:Action>
+<wsa:Action s:mustUnderstand="true">http://schemas.xmlsoap.org/ws/2004/09/enumeration/Enumerate</wsa:Action>
 <wsa:To s:mustUnderstand="true">%(uri)s</wsa:To>
-<wsman:ResourceURI s:mustUnderstand="true">http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_BootConfigSetting</wsman:ResourceURI>
-<wsa:MessageID s:mustUnderstand="true">uuid:%(uuid)s</wsa:MessageID>
+<wsman:ResourceURI s:mustUnderstand="true">%(resource)s</wsman:ResourceURI>
+<wsa:MessageID s:mustUnderstand="true">uuid:%(message_id)s</wsa:MessageID>
 <wsa:ReplyTo>
     <wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address>
 </wsa:ReplyTo>
-<wsman:SelectorSet>
-   <wsman:Selector Name="InstanceID">Intel(r) AMT: Boot Configuration 0</wsman:Selector>
-</wsman:SelectorSet>
 </s:Header>
 <s:Body>
-  <n1:ChangeBootOrder_INPUT>
-     <n1:Source>
-        <wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address>
-        <wsa:ReferenceParameters>
-            <wsman:ResourceURI>http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_BootSourceSetting</wsman:ResourceURI>
-            <wsman:SelectorSet>
-                <wsman:Selector wsman:Name="InstanceID">%(boot_device)s</wsman:Selector>
-            </wsman:SelectorSet>
-         </wsa:ReferenceParameters>
-     </n1:Source>
-   </n1:ChangeBootOrder_INPUT>
-</s:Body></s:Envelope>"""  # noqa
-    return stub % {'uri': uri, 'uuid': uuid.uuid4(),
-                   'boot_device': BOOT_DEVICES[boot_device]}
+<wsen:Enumerate/>
+</s:Body></s:Envelope>""")  # noqa
 
+_ENUMERATE_OPTIMIZED = _Template("""<?xml version="1.0" encoding="UTF-8"?>
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:wsa="http://schemas.xmlsoap.org/ws/2004/08/addressing" xmlns:wsman="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:wsen="http://schemas.xmlsoap.org/ws/2004/09/enumeration">
+<s:Header>
+<wsa:Action s:mustUnderstand="true">http://schemas.xmlsoap.org/ws/2004/09/enumeration/Enumerate</wsa:Action>
+<wsa:To s:mustUnderstand="true">%(uri)s</wsa:To>
+<wsman:ResourceURI s:mustUnderstand="true">%(resource)s</wsman:ResourceURI>
+<wsa:MessageID s:mustUnderstand="true">uuid:%(message_id)s</wsa:MessageID>
+<wsa:ReplyTo>
+    <wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address>
+</wsa:ReplyTo>
+</s:Header>
+<s:Body>
+<wsen:Enumerate>
+    <wsman:OptimizeEnumeration/>
+    <wsman:MaxElements>%(max_elements)s</wsman:MaxElements>
+</wsen:Enumerate>
+</s:Body></s:Envelope>""")  # noqa
 
-def enable_boot_config_request(uri):
-    stub = """<?xml version="1.0" encoding="UTF-8"?>
-<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:wsa="http://schemas.xmlsoap.org/ws/2004/08/addressing" xmlns:wsman="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:n1="http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_BootService">
+_PULL = _Template("""<?xml version="1.0" encoding="UTF-8"?>
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:wsa="http://schemas.xmlsoap.org/ws/2004/08/addressing" xmlns:wsman="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:wsen="http://schemas.xmlsoap.org/ws/2004/09/enumeration">
 <s:Header>
-<wsa:Action s:mustUnderstand="true">http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_BootService/SetBootConfigRole</wsa:Action>
+<wsa:Action s:mustUnderstand="true">http://schemas.xmlsoap.org/ws/2004/09/enumeration/Pull</wsa:Action>
 <wsa:To s:mustUnderstand="true">%(uri)s</wsa:To>
-<wsman:ResourceURI s:mustUnderstand="true">http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_BootService</wsman:ResourceURI>
-<wsa:MessageID s:mustUnderstand="true">uuid:%(uuid)s</wsa:MessageID>
-<wsa:ReplyTo><wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address></wsa:ReplyTo>
-<wsman:SelectorSet>
-    <wsman:Selector Name="Name">Intel(r) AMT Boot Service</wsman:Selector>
-</wsman:SelectorSet>
+<wsman:ResourceURI s:mustUnderstand="true">%(resource)s</wsman:ResourceURI>
+<wsa:MessageID s:mustUnderstand="true">uuid:%(message_id)s</wsa:MessageID>
+<wsa:ReplyTo>
+    <wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address>
+</wsa:ReplyTo>
 </s:Header>
 <s:Body>
-<n1:SetBootConfigRole_INPUT>
-    <n1:BootConfigSetting>
-        <wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address>
-        <wsa:ReferenceParameters>
-             <wsman:ResourceURI>http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_BootConfigSetting</wsman:ResourceURI>
-             <wsman:SelectorSet>
-                  <wsman:Selector wsman:Name="InstanceID">Intel(r) AMT: Boot Configuration 0</wsman:Selector>
-             </wsman:SelectorSet>
-        </wsa:ReferenceParameters>
-    </n1:BootConfigSetting>
-    <n1:Role>1</n1:Role>
-</n1:SetBootConfigRole_INPUT>
-</s:Body></s:Envelope>"""  # noqa
-    return stub % {'uri': uri, 'uuid': uuid.uuid4()}
+<wsen:Pull>
+    <wsen:EnumerationContext>%(context)s</wsen:EnumerationContext>
+    <wsen:MaxElements>%(max_elements)s</wsen:MaxElements>
+</wsen:Pull>
+</s:Body></s:Envelope>""")  # noqa
+
+
+def enumerate_request(uri, resource, optimized=True,
+                      max_elements=DEFAULT_MAX_ELEMENTS):
+    """Start enumerating all the instances of resource.
+
+    With optimized set, the response carries up to max_elements
+    instances itself, so small collections come back in a single
+    exchange with no Pull needed.
+    """
+    resource = resource_uri(resource)
+    if not optimized:
+        return _bound_template(_ENUMERATE, uri=uri, resource=resource).render(
+            message_id=message_id())
+    return _bound_template(
+        _ENUMERATE_OPTIMIZED, uri=uri, resource=resource).render(
+            message_id=message_id(), max_elements=int(max_elements))
+
+
+def pull_request(uri, resource, context, max_elements=DEFAULT_MAX_ELEMENTS):
+    """Fetch the next batch of instances of an enumeration."""
+    resource = resource_uri(resource)
+    return _bound_template(_PULL, uri=uri, resource=resource).render(
+        message_id=message_id(), context=context,
+        max_elements=int(max_elements))
+
+
+_ACTION = re.compile(br'<wsa:Action[^>]*>([^<]*)</wsa:Action>')
+_RESOURCE_URI = re.compile(
+    br'<wsman:ResourceURI[^>]*>([^<]*)</wsman:ResourceURI>')
+
+
+def action_name(payload):
+    """A short name for what a request does, for metrics and logs.
+
+    This is the last part of the resource and of the action, such as
+    ``CIM_PowerManagementService/RequestPowerStateChange`` or
+    ``CIM_AssociatedPowerManagementService/Get``.
+    """
+    names = []
+    for pattern in (_RESOURCE_URI, _ACTION):
+        match = pattern.search(payload)
+        if match:
+            names.append(match.group(1).decode('utf-8').rpartition('/')[2])
+    return '/'.join(names) or 'unknown'
 
 
 # Local Variables:
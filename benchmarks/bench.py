@@ -0,0 +1,204 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Micro benchmarks for the hot paths in amt.
+
+Run with ``python -m benchmarks.bench`` (or ``make bench``). Each
+benchmark reports operations per second (best of several runs) and the
+peak memory allocated by a single operation.
+
+To judge a change, save a baseline first and compare against it::
+
+    python -m benchmarks.bench --save /tmp/before.json
+    # ... make the change ...
+    python -m benchmarks.bench --compare /tmp/before.json
+
+With --compare the exit code is non zero if any benchmark got slower
+by more than --threshold percent.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+import time
+import timeit
+import tracemalloc
+
+from amt import client
+from amt import fakeamt
+from amt import metrics
+from amt import wsman
+
+URI = 'http://10.42.0.50:16992/wsman'
+
+GET_RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<a:Envelope xmlns:a="http://www.w3.org/2003/05/soap-envelope" xmlns:b="http://schemas.xmlsoap.org/ws/2004/08/addressing" xmlns:c="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:g="http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_AssociatedPowerManagementService"><a:Header><b:To>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</b:To><b:Action a:mustUnderstand="true">http://schemas.xmlsoap.org/ws/2004/09/transfer/GetResponse</b:Action></a:Header><a:Body><g:CIM_AssociatedPowerManagementService><g:AvailableRequestedPowerStates>8</g:AvailableRequestedPowerStates><g:PowerState>2</g:PowerState><g:RequestedPowerState>2</g:RequestedPowerState></g:CIM_AssociatedPowerManagementService></a:Body></a:Envelope>"""  # noqa
+
+ACTION_RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<a:Envelope xmlns:a="http://www.w3.org/2003/05/soap-envelope" xmlns:g="http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_PowerManagementService"><a:Header/><a:Body><g:RequestPowerStateChange_OUTPUT><g:ReturnValue>0</g:ReturnValue></g:RequestPowerStateChange_OUTPUT></a:Body></a:Envelope>"""  # noqa
+
+ENUMERATE_RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<a:Envelope xmlns:a="http://www.w3.org/2003/05/soap-envelope" xmlns:g="http://schemas.xmlsoap.org/ws/2004/09/enumeration" xmlns:h="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:c="http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_BootSourceSetting"><a:Header/><a:Body><g:EnumerateResponse><g:EnumerationContext>8a000000-0000-0000-0000-000000000000</g:EnumerationContext><h:Items>%s</h:Items><h:EndOfSequence/></g:EnumerateResponse></a:Body></a:Envelope>""" % (  # noqa
+    b"<c:CIM_BootSourceSetting><c:ElementName>Intel(r) AMT: Boot Source</c:ElementName><c:FailThroughSupported>2</c:FailThroughSupported><c:InstanceID>Intel(r) AMT: Force PXE Boot</c:InstanceID></c:CIM_BootSourceSetting>" * 8)  # noqa
+
+
+def builders():
+    res = client.CIM_AssociatedPowerManagementService
+    return [
+        ('build.get_request', lambda: wsman.get_request(URI, res)),
+        ('build.power_state_request',
+         lambda: wsman.power_state_request(URI, 'reboot')),
+        ('build.change_boot_order_request',
+         lambda: wsman.change_boot_order_request(URI, 'pxe')),
+        ('build.enable_boot_config_request',
+         lambda: wsman.enable_boot_config_request(URI)),
+        ('build.enable_remote_kvm',
+         lambda: wsman.enable_remote_kvm(URI, 'P@ssw0rd')),
+        ('build.kvm_redirect', lambda: wsman.kvm_redirect(URI)),
+        ('build.enumerate_request',
+         lambda: wsman.enumerate_request(URI, res)),
+    ]
+
+
+def parsers():
+    get = GET_RESPONSE
+    action = ACTION_RESPONSE
+    return [
+        ('parse.find_value',
+         lambda: client._find_value(
+             get, client.CIM_AssociatedPowerManagementService,
+             'PowerState')),
+        ('parse.return_value',
+         lambda: client._return_value(
+             action, client.CIM_PowerManagementService)),
+        ('parse.body_get', lambda: client._parse_body(get)),
+        ('parse.body_enumerate',
+         lambda: client._parse_body(ENUMERATE_RESPONSE)),
+    ]
+
+
+def requests_path(server):
+    amt_client = client.Client('127.0.0.1', fakeamt.DEFAULT_PASSWORD,
+                               port=server.port)
+    # the same, with instrumentation on
+    measured = client.Client('127.0.0.1', fakeamt.DEFAULT_PASSWORD,
+                             port=server.port, metrics=metrics.Metrics())
+    return [
+        ('request.power_status', amt_client.power_status),
+        ('request.power_on', amt_client.power_on),
+        ('request.set_next_boot',
+         lambda: amt_client.set_next_boot('pxe')),
+        ('request.power_status.metrics', measured.power_status),
+    ], [amt_client, measured]
+
+
+def measure(func, repeat, min_time):
+    timer = timeit.Timer(func)
+    number = 1
+    # find a loop count that takes at least min_time
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(
+            2, int(min_time / elapsed * 1.2))
+    best = min([elapsed] + timer.repeat(repeat - 1, number))
+    ops = number / best
+
+    tracemalloc.start()
+    try:
+        func()
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return {'ops': ops, 'peak_bytes': max(peak, 0)}
+
+
+def compare(results, baseline, threshold):
+    slower = []
+    print("%-36s %14s %14s %8s" % ("benchmark", "baseline ops/s",
+                                   "ops/s", "change"))
+    for name, result in results.items():
+        if name not in baseline:
+            print("%-36s %14s %14.0f %8s" % (name, '-', result['ops'], 'new'))
+            continue
+        before = baseline[name]['ops']
+        change = (result['ops'] - before) / before * 100
+        print("%-36s %14.0f %14.0f %+7.1f%%" % (
+            name, before, result['ops'], change))
+        if change < -threshold:
+            slower.append(name)
+    return slower
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser('amt-bench')
+    parser.add_argument('-k', '--filter', default='',
+                        help='Only run benchmarks containing this string')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Latency (ms) of the fake server')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per benchmark, the best is reported')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='Minimum seconds per run')
+    parser.add_argument('--save', metavar='FILE',
+                        help='Save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare the results against a baseline')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Percent slow down that counts as a '
+                        'regression with --compare')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {}
+    host = fakeamt.FakeHost('127.0.0.1')
+    host.latency = args.latency / 1000.0
+    with fakeamt.FakeAMT([host]) as server:
+        request_cases, clients = requests_path(server)
+        cases = builders() + parsers() + request_cases
+        print("%-36s %14s %12s" % ("benchmark", "ops/s", "peak KiB/op"))
+        for name, func in cases:
+            if args.filter not in name:
+                continue
+            result = measure(func, args.repeat, args.min_time)
+            results[name] = result
+            print("%-36s %14.0f %12.1f" % (name, result['ops'],
+                                           result['peak_bytes'] / 1024.0))
+        for amt_client in clients:
+            amt_client.close()
+        print("digest challenges issued: %d" % server.challenges)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'time': time.time(), 'results': results}, f,
+                      indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print()
+        slower = compare(results, baseline, args.threshold)
+        if slower:
+            print("slower than baseline: %s" % ", ".join(slower))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
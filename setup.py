@@ -16,6 +16,7 @@ with open('HISTORY.rst') as history_file:
 
 requirements = [
     'appdirs',
+    'futures; python_version < "3.0"',
     'requests',
     'six',
 ]
@@ -41,6 +42,9 @@ setup(
     scripts=['bin/amtctrl'],
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        'async': ['httpx; python_version >= "3.6"'],
+    },
     license="Apache",
     zip_safe=False,
     keywords='amt',
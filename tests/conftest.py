@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 6):
+    # async/await syntax, and httpx is only installed from 3.6 on
+    collect_ignore.append('test_aio.py')
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_aio
+----------------------------------
+
+Tests for `amt` module's aio.py file
+"""
+
+import asyncio
+
+import testtools
+
+from amt import aio
+
+
+POWER_STATE = """<?xml version="1.0" encoding="UTF-8"?>
+<a:Envelope xmlns:a="http://www.w3.org/2003/05/soap-envelope" xmlns:g="http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_AssociatedPowerManagementService">
+<a:Header/>
+<a:Body>
+<g:CIM_AssociatedPowerManagementService><g:PowerState>2</g:PowerState></g:CIM_AssociatedPowerManagementService>
+</a:Body>
+</a:Envelope>"""  # noqa
+
+CHALLENGE = ('Digest realm="Digest:A3829B3827DE4D33D4449B366831FD01", '
+             'nonce="3B9AHDzpwC4ZDGhbZNhh3IL7iGt", qop="auth"')
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@testtools.skipIf(aio.httpx is None, "httpx not installed")
+class TestAsyncClient(testtools.TestCase):
+
+    def setUp(self):
+        super(TestAsyncClient, self).setUp()
+        self.requests = []
+
+        def handler(request):
+            # the digest auth flow resends the same request object, so
+            # take a copy of what was actually sent
+            self.requests.append((request.url.host, dict(request.headers)))
+            if 'authorization' not in request.headers:
+                return aio.httpx.Response(
+                    401, headers={'www-authenticate': CHALLENGE})
+            return aio.httpx.Response(200, content=POWER_STATE)
+
+        self.transport = aio.httpx.MockTransport(handler)
+
+    def test_power_status(self):
+        async def go():
+            pool = aio.httpx.AsyncClient(transport=self.transport)
+            async with pool:
+                client = aio.AsyncClient('10.42.0.50', 'secret', pool=pool)
+                return [await client.power_status(),
+                        await client.power_status()]
+
+        self.assertEqual(run(go()), ['2', '2'])
+        # only the very first request is challenged, after that the
+        # nonce is reused
+        self.assertEqual(len(self.requests), 3)
+        self.assertNotIn('authorization', self.requests[0][1])
+        self.assertIn('nc=00000002', self.requests[2][1]['authorization'])
+
+    def test_shared_pool(self):
+        async def go():
+            pool = aio.httpx.AsyncClient(transport=self.transport)
+            async with pool:
+                clients = [aio.AsyncClient('10.42.0.%d' % i, 'secret',
+                                           pool=pool)
+                           for i in range(1, 4)]
+                results = await asyncio.gather(
+                    *[c.power_status() for c in clients])
+                for c in clients:
+                    # closing a client doesn't close a shared pool
+                    await c.aclose()
+                self.assertFalse(pool.is_closed)
+                return results
+
+        self.assertEqual(run(go()), ['2', '2', '2'])
+        hosts = set(host for host, headers in self.requests)
+        self.assertEqual(hosts, set(['10.42.0.1', '10.42.0.2', '10.42.0.3']))
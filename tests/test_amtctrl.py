@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_amtctrl
+----------------------------------
+
+Tests for the amtctrl script's startup cost
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import fixtures
+import testtools
+
+AMTCTRL = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'bin', 'amtctrl')
+
+# Run amtctrl in a fresh interpreter, and report what it imported and
+# its exit status.
+SCRIPT = """
+import json, runpy, sys
+before = set(sys.modules)
+sys.argv = ['amtctrl'] + %(argv)r
+status = None
+try:
+    runpy.run_path(%(amtctrl)r, run_name='__main__')
+except SystemExit as e:
+    status = e.code
+loaded = sorted(set(sys.modules) - before)
+sys.stderr.write(json.dumps({'loaded': loaded, 'status': status}))
+"""
+
+# Modules that have no business being loaded by the host db commands
+HEAVY = ('requests', 'urllib3', 'amt.client', 'amt.wsman', 'amt.fleet',
+         'concurrent.futures', 'xml.dom.minidom', 'xml.etree.ElementTree',
+         'configparser', 'ConfigParser')
+
+
+class AmtctrlTestCase(testtools.TestCase):
+    """Runs amtctrl against a host db with os1 in it."""
+
+    def setUp(self):
+        super(AmtctrlTestCase, self).setUp()
+        self.confdir = self.useFixture(fixtures.TempDir()).path
+        self.run_amtctrl('set', 'os1', '10.42.0.50', 'foo')
+
+    def run_amtctrl(self, *argv):
+        env = dict(os.environ, XDG_CONFIG_HOME=self.confdir,
+                   PYTHONPATH=os.pathsep.join(sys.path))
+        proc = subprocess.Popen(
+            [sys.executable, '-c', SCRIPT % {'argv': list(argv),
+                                             'amtctrl': AMTCTRL}],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        out, err = proc.communicate()
+        self.assertEqual(proc.returncode, 0, err)
+        return out.decode('utf-8'), json.loads(err.decode('utf-8'))
+
+
+class TestStartup(AmtctrlTestCase):
+
+    def test_db_commands_are_light(self):
+        for argv in (['list'], ['list', 'os*'], ['get', 'os1'],
+                     ['tag', 'os1', 'rack=r12']):
+            out, result = self.run_amtctrl(*argv)
+            heavy = [name for name in result['loaded'] if name in HEAVY]
+            self.assertEqual(heavy, [], argv)
+
+    def test_budget(self):
+        out, result = self.run_amtctrl('list')
+        self.assertIn('os1', out)
+        # everything amtctrl list does, including its imports and the
+        # db query, should cost less than importing the HTTP stack, so
+        # it mustn't import it
+        self.assertNotIn('requests', result['loaded'])
+        self.assertNotIn('urllib3', result['loaded'])
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_amtctrl_daemon
+----------------------------------
+
+Tests for the amtctrl script handing commands to the daemon
+"""
+
+import socket
+import threading
+
+import fixtures
+
+from amt import daemon
+from amt import fakeamt
+from amt import hostdb
+from tests import test_amtctrl
+
+
+class TestForward(test_amtctrl.AmtctrlTestCase):
+
+    def setUp(self):
+        super(TestForward, self).setUp()
+        self.useFixture(fixtures.EnvironmentVariable(
+            'XDG_CONFIG_HOME', self.confdir))
+        self.db = hostdb.HostDB()
+        self.addCleanup(self.db.close)
+
+    def test_forward_to_daemon(self):
+        fake = fakeamt.FakeAMT().start()
+        self.addCleanup(fake.stop)
+        self.db.set_server('os1', '127.0.0.1', fakeamt.DEFAULT_PASSWORD)
+        server = daemon.Daemon(daemon.socket_path(self.db.confdir), self.db,
+                               {'port': fake.port}).start()
+        self.addCleanup(server.stop)
+
+        out, result = self.run_amtctrl('os1', 'status')
+        self.assertEqual(out, 'on\n')
+        heavy = [name for name in result['loaded']
+                 if name in test_amtctrl.HEAVY]
+        self.assertEqual(heavy, [])
+
+        out, result = self.run_amtctrl('os*', 'off')
+        self.assertEqual(out, 'os1: ok\n')
+        self.assertEqual(fake.hosts['127.0.0.1'].power_state, 8)
+
+    def test_forward_daemon_error(self):
+        # a daemon that hangs up without answering
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(daemon.socket_path(self.db.confdir))
+        listener.listen(1)
+
+        def hang_up():
+            conn, addr = listener.accept()
+            conn.recv(4096)
+            conn.close()
+
+        thread = threading.Thread(target=hang_up)
+        thread.start()
+        out, result = self.run_amtctrl('os1', 'status')
+        thread.join()
+        self.assertEqual(out, 'Error: daemon closed the connection\n')
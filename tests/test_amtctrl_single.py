@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_amtctrl_single
+----------------------------------
+
+Tests for the amtctrl script running commands itself, without the daemon
+"""
+
+import os
+
+import fixtures
+
+from amt import health
+from amt import hostdb
+from tests import test_amtctrl
+
+
+class TestSingle(test_amtctrl.AmtctrlTestCase):
+
+    def setUp(self):
+        super(TestSingle, self).setUp()
+        self.useFixture(fixtures.EnvironmentVariable(
+            'XDG_CONFIG_HOME', self.confdir))
+        self.db = hostdb.HostDB()
+        self.addCleanup(self.db.close)
+
+    def test_single_uses_health(self):
+        # known to be down, so not even tried
+        state = health.Health(path=os.path.join(self.db.confdir,
+                                                health.HEALTH_NAME))
+        state.failed('http://10.42.0.50:16992/wsman')
+        state.save()
+
+        out, result = self.run_amtctrl('--no-daemon', 'os1', 'status')
+        self.assertIn('failed to connect recently', out)
+        self.assertEqual(result['status'], 1)
+
+    def test_single_unreachable(self):
+        # nothing listens on the AMT port here
+        self.db.set_server('os1', '127.0.0.1', 'foo')
+        out, result = self.run_amtctrl('--no-daemon', 'os1', 'status')
+        self.assertTrue(out.startswith('Error: '), out)
+        self.assertEqual(result['status'], 1)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_cache
+----------------------------------
+
+Tests for `amt` module's cache.py file
+"""
+
+import fixtures
+import testtools
+
+from amt import cache
+
+
+class TestTTLCache(testtools.TestCase):
+
+    def setUp(self):
+        super(TestTTLCache, self).setUp()
+        self.now = 1000.0
+        self.useFixture(fixtures.MonkeyPatch('amt.utils.now',
+                                             lambda: self.now))
+        self.cache = cache.TTLCache(ttl=5, maxsize=3)
+
+    def test_get_set(self):
+        self.assertIs(self.cache.get(('h', 'r', 'p')), cache.MISSING)
+        self.cache.set(('h', 'r', 'p'), '2')
+        self.assertEqual(self.cache.get(('h', 'r', 'p')), '2')
+
+    def test_expiry(self):
+        self.cache.set(('h', 'r', 'p'), '2')
+        self.now += 4.9
+        self.assertEqual(self.cache.get(('h', 'r', 'p')), '2')
+        self.now += 0.1
+        self.assertIs(self.cache.get(('h', 'r', 'p')), cache.MISSING)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        for i in range(3):
+            self.cache.set(('h', 'r', i), i)
+        # touch the oldest, so 1 is now the least recently used
+        self.cache.get(('h', 'r', 0))
+        self.cache.set(('h', 'r', 3), 3)
+        self.assertEqual(len(self.cache), 3)
+        self.assertIs(self.cache.get(('h', 'r', 1)), cache.MISSING)
+        self.assertEqual(self.cache.get(('h', 'r', 0)), 0)
+
+    def test_invalidate(self):
+        self.cache.set(('h1', 'power', 'a'), 1)
+        self.cache.set(('h1', 'power', 'b'), 2)
+        self.cache.set(('h1', 'boot', 'a'), 3)
+        self.cache.invalidate('h1', 'power')
+        self.assertIs(self.cache.get(('h1', 'power', 'a')), cache.MISSING)
+        self.assertIs(self.cache.get(('h1', 'power', 'b')), cache.MISSING)
+        self.assertEqual(self.cache.get(('h1', 'boot', 'a')), 3)
+        # nothing cached is fine too
+        self.cache.invalidate('h2', 'power')
+
+    def test_set_after_invalidate(self):
+        generation = self.cache.generation(('h1', 'power', 'a'))
+        self.cache.invalidate('h1', 'power')
+        self.cache.set(('h1', 'power', 'a'), 1, generation)
+        self.assertIs(self.cache.get(('h1', 'power', 'a')), cache.MISSING)
+        # a fetch started after the invalidation is stored
+        self.cache.set(('h1', 'power', 'a'), 3,
+                       self.cache.generation(('h1', 'power', 'a')))
+        self.assertEqual(self.cache.get(('h1', 'power', 'a')), 3)
+
+    def test_set_after_clear(self):
+        generation = self.cache.generation(('h1', 'power', 'a'))
+        self.cache.clear()
+        self.cache.set(('h1', 'power', 'a'), 1, generation)
+        self.assertEqual(len(self.cache), 0)
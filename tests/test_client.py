@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_client
+----------------------------------
+
+Tests for `amt` module's client.py file
+"""
+
+import fixtures
+import mock
+import requests
+from requests.auth import HTTPDigestAuth
+import testtools
+
+from amt import cache
+from amt import client
+
+
+SUCCESS = """<?xml version="1.0" encoding="UTF-8"?>
+<a:Envelope xmlns:a="http://www.w3.org/2003/05/soap-envelope" xmlns:g="http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_PowerManagementService">
+<a:Header/>
+<a:Body>
+<g:RequestPowerStateChange_OUTPUT><g:ReturnValue>0</g:ReturnValue></g:RequestPowerStateChange_OUTPUT>
+</a:Body>
+</a:Envelope>"""  # noqa
+
+
+def output(resource, method, return_value=0):
+    return ('<a:Envelope xmlns:a="http://www.w3.org/2003/05/soap-envelope" '
+            'xmlns:g="%(resource)s"><a:Header/><a:Body>'
+            '<g:%(method)s_OUTPUT><g:ReturnValue>%(rv)d</g:ReturnValue>'
+            '</g:%(method)s_OUTPUT></a:Body></a:Envelope>' % {
+                'resource': resource, 'method': method, 'rv': return_value})
+
+
+BOOT_ORDER_SUCCESS = output(client.CIM_BootConfigSetting, 'ChangeBootOrder')
+BOOT_ROLE_SUCCESS = output(client.CIM_BootService, 'SetBootConfigRole')
+
+
+class TestClientSession(testtools.TestCase):
+
+    def setUp(self):
+        super(TestClientSession, self).setUp()
+        self.client = client.Client('10.42.0.50', 'secret')
+
+    def test_uri(self):
+        self.assertEqual(self.client.uri, 'http://10.42.0.50:16992/wsman')
+
+    def test_session_is_reused(self):
+        session = self.client.session
+        self.assertIs(session, self.client.session)
+        self.assertIsInstance(session.auth, HTTPDigestAuth)
+        self.assertEqual(session.auth.username, 'admin')
+        self.assertEqual(session.auth.password, 'secret')
+
+    def test_close(self):
+        session = self.client.session
+        with mock.patch.object(session, 'close') as close:
+            self.client.close()
+            close.assert_called_once_with()
+        self.assertIsNot(session, self.client.session)
+
+    def test_requests_share_session(self):
+        with mock.patch('requests.Session.post') as post:
+            post.return_value.content = SUCCESS
+            self.assertEqual(self.client.power_on().return_value, 0)
+            self.assertEqual(self.client.power_off().return_value, 0)
+        self.assertEqual(post.call_count, 2)
+        for call in post.call_args_list:
+            self.assertEqual(call[0], (self.client.uri,))
+
+
+POWER_STATE = """<?xml version="1.0" encoding="UTF-8"?>
+<a:Envelope xmlns:a="http://www.w3.org/2003/05/soap-envelope" xmlns:g="http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_AssociatedPowerManagementService">
+<a:Header/>
+<a:Body>
+<g:CIM_AssociatedPowerManagementService>
+<g:AvailableRequestedPowerStates>2</g:AvailableRequestedPowerStates>
+<g:PowerState>8</g:PowerState>
+<g:RequestedPowerState>2</g:RequestedPowerState>
+</g:CIM_AssociatedPowerManagementService>
+</a:Body>
+</a:Envelope>"""  # noqa
+
+
+class TestFindValue(testtools.TestCase):
+
+    def test_find_value(self):
+        self.assertEqual(
+            client._find_value(POWER_STATE,
+                               client.CIM_AssociatedPowerManagementService,
+                               'PowerState'), '8')
+        self.assertEqual(
+            client._find_value(POWER_STATE.encode('utf-8'),
+                               client.CIM_AssociatedPowerManagementService,
+                               'RequestedPowerState'), '2')
+
+    def test_find_value_missing(self):
+        self.assertIsNone(
+            client._find_value(POWER_STATE,
+                               client.CIM_AssociatedPowerManagementService,
+                               'ReturnValue'))
+        # right key, wrong namespace
+        self.assertIsNone(
+            client._find_value(POWER_STATE, client.CIM_BootService,
+                               'PowerState'))
+
+    def test_find_value_stops_early(self):
+        # nothing after the element we want is parsed
+        content = POWER_STATE[:POWER_STATE.index('<g:Requested')] + '<<<'
+        self.assertEqual(
+            client._find_value(content,
+                               client.CIM_AssociatedPowerManagementService,
+                               'PowerState'), '8')
+
+    def test_return_value(self):
+        self.assertEqual(
+            client._return_value(SUCCESS, client.CIM_PowerManagementService),
+            0)
+
+    def test_extractor_cached(self):
+        ns = client.CIM_PowerManagementService
+        self.assertIs(client._extractor(ns, 'ReturnValue'),
+                      client._extractor(ns, 'ReturnValue'))
+
+
+class TestResult(testtools.TestCase):
+
+    def setUp(self):
+        super(TestResult, self).setUp()
+        self.client = client.Client('10.42.0.50', 'secret')
+        self.post = self.useFixture(
+            fixtures.MockPatch('requests.Session.post')).mock
+
+    def respond(self, *contents):
+        self.post.side_effect = [mock.Mock(content=c) for c in contents]
+
+    def test_result(self):
+        self.respond(SUCCESS)
+        result = self.client.power_on()
+        self.assertIsInstance(result, client.Result)
+        self.assertEqual(result.return_value, 0)
+        self.assertTrue(result.ok)
+        self.assertEqual(result.raw, SUCCESS)
+        self.assertGreaterEqual(result.elapsed, 0)
+        self.assertEqual(result.fields, {'ReturnValue': '0'})
+        self.assertIn('  <a:Body>', result.pretty())
+        self.assertFalse(hasattr(result, '__dict__'))
+
+    def test_return_value_error(self):
+        self.respond(output(client.CIM_PowerManagementService,
+                            'RequestPowerStateChange', 2))
+        e = self.assertRaises(client.ReturnValueError, self.client.power_off)
+        self.assertEqual(e.return_value, 2)
+        self.assertEqual(e.method, 'RequestPowerStateChange')
+        self.assertEqual(str(e),
+                         'RequestPowerStateChange failed with ReturnValue 2')
+        self.assertFalse(e.result.ok)
+
+    def test_missing_return_value(self):
+        self.respond(POWER_STATE)
+        self.assertRaises(client.AMTError, self.client.power_off)
+
+    def test_boot_return_values_checked(self):
+        self.respond(output(client.CIM_BootConfigSetting,
+                            'ChangeBootOrder', 1))
+        self.assertRaises(client.ReturnValueError,
+                          self.client.set_next_boot, 'pxe')
+        self.assertEqual(self.post.call_count, 1)
+
+    def test_vnc_password_missing(self):
+        self.assertRaises(client.AMTError, self.client.enable_vnc)
+        self.assertEqual(self.post.call_count, 0)
+
+
+ENUMERATE_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<a:Envelope xmlns:a="http://www.w3.org/2003/05/soap-envelope" xmlns:g="http://schemas.xmlsoap.org/ws/2004/09/enumeration" xmlns:h="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:c="http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_BootSourceSetting" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<a:Header/>
+<a:Body>
+<g:EnumerateResponse>
+<g:EnumerationContext>8a000000-0000-0000-0000-000000000000</g:EnumerationContext>
+<h:Items>
+<c:CIM_BootSourceSetting><c:ElementName>Intel(r) AMT: Boot Source</c:ElementName><c:InstanceID>Intel(r) AMT: Force Hard-drive Boot</c:InstanceID><c:StructuredBootString xsi:nil="true"/></c:CIM_BootSourceSetting>
+<c:CIM_BootSourceSetting><c:ElementName>Intel(r) AMT: Boot Source</c:ElementName><c:InstanceID>Intel(r) AMT: Force PXE Boot</c:InstanceID><c:StructuredBootString xsi:nil="true"/></c:CIM_BootSourceSetting>
+</h:Items>
+</g:EnumerateResponse>
+</a:Body>
+</a:Envelope>"""  # noqa
+
+PULL_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<a:Envelope xmlns:a="http://www.w3.org/2003/05/soap-envelope" xmlns:g="http://schemas.xmlsoap.org/ws/2004/09/enumeration" xmlns:c="http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_BootSourceSetting">
+<a:Header/>
+<a:Body>
+<g:PullResponse>
+<g:Items>
+<c:CIM_BootSourceSetting><c:ElementName>Intel(r) AMT: Boot Source</c:ElementName><c:InstanceID>Intel(r) AMT: Force CD/DVD Boot</c:InstanceID></c:CIM_BootSourceSetting>
+</g:Items>
+<g:EndOfSequence/>
+</g:PullResponse>
+</a:Body>
+</a:Envelope>"""  # noqa
+
+
+class TestProperties(testtools.TestCase):
+
+    def setUp(self):
+        super(TestProperties, self).setUp()
+        self.client = client.Client('10.42.0.50', 'secret')
+        self.post = self.useFixture(
+            fixtures.MockPatch('requests.Session.post')).mock
+
+    def respond(self, *contents):
+        self.post.side_effect = [mock.Mock(content=c) for c in contents]
+
+    def test_get_properties(self):
+        self.respond(POWER_STATE)
+        props = self.client.get_properties(
+            client.CIM_AssociatedPowerManagementService)
+        self.assertEqual(props, {'AvailableRequestedPowerStates': '2',
+                                 'PowerState': '8',
+                                 'RequestedPowerState': '2'})
+
+    def test_get_properties_keys(self):
+        self.respond(POWER_STATE)
+        props = self.client.get_properties(
+            client.CIM_AssociatedPowerManagementService,
+            ['PowerState', 'Missing'])
+        self.assertEqual(props, {'PowerState': '8', 'Missing': None})
+        self.assertEqual(self.post.call_count, 1)
+
+    def test_enumerate(self):
+        self.respond(ENUMERATE_RESPONSE, PULL_RESPONSE)
+        items = self.client.enumerate(client.CIM_BootSourceSetting)
+        self.assertEqual(
+            [i['InstanceID'] for i in items],
+            ['Intel(r) AMT: Force Hard-drive Boot',
+             'Intel(r) AMT: Force PXE Boot',
+             'Intel(r) AMT: Force CD/DVD Boot'])
+        self.assertIsNone(items[0]['StructuredBootString'])
+        self.assertEqual(self.post.call_count, 2)
+        pull = self.post.call_args_list[1][1]['data']
+        self.assertIn(b'<wsen:EnumerationContext>'
+                      b'8a000000-0000-0000-0000-000000000000'
+                      b'</wsen:EnumerationContext>', pull)
+
+    def test_enumerate_single_exchange(self):
+        self.respond(ENUMERATE_RESPONSE.replace(
+            '</h:Items>', '</h:Items><h:EndOfSequence/>'))
+        items = self.client.enumerate(client.CIM_BootSourceSetting)
+        self.assertEqual(len(items), 2)
+        self.assertEqual(self.post.call_count, 1)
+
+
+class TestCaching(testtools.TestCase):
+
+    def setUp(self):
+        super(TestCaching, self).setUp()
+        self.cache = cache.TTLCache(ttl=60)
+        self.client = client.Client('10.42.0.50', 'secret', cache=self.cache)
+        self.post = self.useFixture(
+            fixtures.MockPatch('requests.Session.post')).mock
+
+    def respond(self, *contents):
+        self.post.side_effect = [mock.Mock(content=c) for c in contents]
+
+    def test_power_status_cached(self):
+        self.respond(POWER_STATE)
+        self.assertEqual(self.client.power_status(), '8')
+        self.assertEqual(self.client.power_status(), '8')
+        self.assertEqual(self.post.call_count, 1)
+
+    def test_power_change_invalidates(self):
+        self.respond(POWER_STATE, SUCCESS, POWER_STATE)
+        self.client.power_status()
+        self.client.power_on()
+        self.client.power_status()
+        self.assertEqual(self.post.call_count, 3)
+
+    def test_unrelated_change_keeps_cache(self):
+        self.respond(POWER_STATE, BOOT_ORDER_SUCCESS, BOOT_ROLE_SUCCESS)
+        self.client.power_status()
+        self.client.set_next_boot('pxe')
+        self.client.power_status()
+        self.assertEqual(self.post.call_count, 3)
+
+    def test_get_properties_cached(self):
+        self.respond(POWER_STATE)
+        resource = client.CIM_AssociatedPowerManagementService
+        self.client.get_properties(resource)
+        self.assertEqual(
+            self.client.get_properties(resource, ['PowerState']),
+            {'PowerState': '8'})
+        self.assertEqual(self.post.call_count, 1)
+
+    def test_invoke_invalidates_affected(self):
+        self.respond(POWER_STATE, SUCCESS, POWER_STATE, POWER_STATE)
+        self.client.get(client.CIM_AssociatedPowerManagementService)
+        self.client.invoke('CIM_PowerManagementService',
+                           'RequestPowerStateChange',
+                           params={'PowerState': 2},
+                           affects=['CIM_AssociatedPowerManagementService'])
+        self.client.get('CIM_AssociatedPowerManagementService')
+        self.client.get('CIM_AssociatedPowerManagementService',
+                        {'Name': 'x'})
+        self.assertEqual(self.post.call_count, 4)
+
+    def test_change_during_fetch(self):
+        def post(*args, **kwargs):
+            if self.post.call_count == 1:
+                # a change made by another thread while this one waits
+                self.cache.invalidate(
+                    self.client.uri,
+                    client.CIM_AssociatedPowerManagementService)
+            return mock.Mock(content=POWER_STATE)
+
+        self.post.side_effect = post
+        self.client.power_status()
+        # the answer may predate the change, so it wasn't kept
+        self.client.power_status()
+        self.assertEqual(self.post.call_count, 2)
+        self.client.power_status()
+        self.assertEqual(self.post.call_count, 2)
+
+    def test_shared_cache_per_host(self):
+        other = client.Client('10.42.0.51', 'secret', cache=self.cache)
+        self.respond(POWER_STATE, POWER_STATE)
+        self.client.power_status()
+        other.power_status()
+        self.assertEqual(self.post.call_count, 2)
+
+    def test_no_cache(self):
+        uncached = client.Client('10.42.0.50', 'secret')
+        self.respond(POWER_STATE, POWER_STATE)
+        uncached.power_status()
+        uncached.power_status()
+        self.assertEqual(self.post.call_count, 2)
+
+
+class TestRetries(testtools.TestCase):
+
+    def setUp(self):
+        super(TestRetries, self).setUp()
+        self.client = client.Client('10.42.0.50', 'secret',
+                                    timeout=(1, 2), retries=2)
+        self.post = self.useFixture(
+            fixtures.MockPatch('requests.Session.post')).mock
+        self.sleep = self.useFixture(fixtures.MockPatch('time.sleep')).mock
+
+    def test_timeout_passed(self):
+        self.post.return_value = mock.Mock(content=POWER_STATE)
+        self.client.power_status()
+        self.assertEqual(self.post.call_args[1]['timeout'], (1, 2))
+
+    def test_read_retried(self):
+        self.post.side_effect = [
+            requests.exceptions.ConnectionError(),
+            requests.exceptions.ReadTimeout(),
+            mock.Mock(content=POWER_STATE)]
+        self.assertEqual(self.client.power_status(), '8')
+        self.assertEqual(self.post.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+
+    def test_read_retries_exhausted(self):
+        self.post.side_effect = requests.exceptions.ConnectionError()
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          self.client.power_status)
+        self.assertEqual(self.post.call_count, 3)
+
+    def test_read_retried_on_503(self):
+        busy = requests.Response()
+        busy.status_code = 503
+        self.post.side_effect = [busy, mock.Mock(content=POWER_STATE)]
+        self.assertEqual(self.client.power_status(), '8')
+
+    def test_change_not_retried(self):
+        self.post.side_effect = requests.exceptions.ReadTimeout()
+        self.assertRaises(requests.exceptions.ReadTimeout,
+                          self.client.power_cycle)
+        self.assertEqual(self.post.call_count, 1)
+
+    def test_change_retried_when_not_sent(self):
+        self.post.side_effect = [requests.exceptions.ConnectTimeout(),
+                                 mock.Mock(content=SUCCESS)]
+        self.assertEqual(self.client.power_cycle().return_value, 0)
+        self.assertEqual(self.post.call_count, 2)
+
+    def test_connection_limit(self):
+        adapter = self.client.session.get_adapter(self.client.uri)
+        self.assertEqual(adapter._pool_maxsize, 2)
+        self.assertTrue(adapter._pool_block)
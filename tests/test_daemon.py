@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_daemon
+----------------------------------
+
+Tests for `amt` module's daemon.py file
+"""
+
+import os
+import socket
+import stat
+
+import fixtures
+import mock
+import testtools
+
+from amt import client
+from amt import daemon
+from amt import fakeamt
+from amt import hostdb
+
+
+class TestDaemon(testtools.TestCase):
+
+    def setUp(self):
+        super(TestDaemon, self).setUp()
+        self.dirname = self.useFixture(fixtures.TempDir()).path
+        with mock.patch('appdirs.user_config_dir',
+                        return_value=self.dirname):
+            self.db = hostdb.HostDB()
+        self.addCleanup(self.db.close)
+        self.fake = fakeamt.FakeAMT().start()
+        self.addCleanup(self.fake.stop)
+        self.db.set_server("os1", "127.0.0.1", fakeamt.DEFAULT_PASSWORD)
+        self.db.set_server("os2", "127.0.0.1", fakeamt.DEFAULT_PASSWORD)
+        self.path = daemon.socket_path(self.dirname)
+        self.daemon = daemon.Daemon(self.path, self.db,
+                                    {'port': self.fake.port}).start()
+        self.addCleanup(self.daemon.stop)
+
+    def call(self, **message):
+        return daemon.call(self.path, message, timeout=10)
+
+    def test_ping(self):
+        self.assertEqual(self.call(op='ping'), {'pid': os.getpid()})
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+    def test_run(self):
+        self.assertEqual(
+            self.call(op='run', target='os1', command='status'),
+            {'fleet': False, 'results': [['os1', 'on', None]]})
+        self.assertEqual(
+            self.call(op='run', target='os1', command='off'),
+            {'fleet': False, 'results': [['os1', None, None]]})
+        self.assertEqual(self.fake.hosts['127.0.0.1'].power_state, 8)
+
+    def test_run_fleet(self):
+        reply = self.call(op='run', target='os*,missing', command='status')
+        self.assertEqual(reply, {'fleet': True, 'results': [
+            ['os1', 'on', None], ['os2', 'on', None],
+            ['missing', None, 'not found in hostdb']]})
+
+    def test_warm(self):
+        for i in range(3):
+            self.call(op='run', target='os1', command='status')
+        self.assertEqual(self.fake.challenges, 1)
+
+        # changes to the host db are picked up
+        self.db.set_server("os1", "127.0.0.1", "wrong")
+        reply = self.call(op='run', target='os1', command='status')
+        self.assertIn('401', reply['results'][0][2])
+
+    def test_idle(self):
+        self.call(op='run', target='os1', command='status')
+        self.daemon.idle_timeout = 0
+        self.call(op='run', target='os2', command='status')
+        self.assertEqual(list(self.daemon._clients), ['os2'])
+
+    def test_errors(self):
+        self.assertEqual(
+            self.call(op='run', target='os1', command='bogus'),
+            {'error': 'Unknown command bogus, try one of on, off, reboot, '
+                      'pxeboot, status, vnc, vncstatus'})
+        self.assertEqual(
+            self.call(op='run', target='nope', command='status'),
+            {'error': 'Server nope not found in hostdb'})
+        self.assertEqual(
+            self.call(op='run', target='rack=r1', command='status'),
+            {'error': 'No servers in hostdb match rack=r1'})
+        self.assertEqual(self.call(op='nope'), {'error': 'Unknown op nope'})
+        self.assertIn('Bad request', self.call(op='run')['error'])
+
+    def test_ignore_health(self):
+        uri = client.wsman_uri('127.0.0.1', port=self.fake.port)
+        self.daemon.health.failed(uri)
+        reply = self.call(op='run', target='os1', command='status')
+        self.assertIn('recently', reply['results'][0][2])
+        self.assertEqual(
+            self.call(op='run', target='os1', command='status',
+                      ignore_health=True),
+            {'fleet': False, 'results': [['os1', 'on', None]]})
+
+    def test_unexpected_error(self):
+        self.useFixture(fixtures.MockPatchObject(
+            self.db, 'resolve', side_effect=RuntimeError('db is gone')))
+        self.assertEqual(
+            self.call(op='run', target='os*', command='status'),
+            {'error': 'Internal error: db is gone'})
+
+    def test_many_requests(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.connect(self.path)
+        sock.sendall(b'{"op": "ping"}\nnot json\n{"op": "ping"}\n')
+        f = sock.makefile('rb')
+        self.addCleanup(f.close)
+        self.assertIn(b'pid', f.readline())
+        self.assertIn(b'Bad request', f.readline())
+        self.assertIn(b'pid', f.readline())
+
+    def test_not_running(self):
+        self.daemon.stop()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertRaises(daemon.NotRunning, self.call, op='ping')
+
+    def test_already_running(self):
+        self.assertRaises(daemon.DaemonError, daemon.Daemon,
+                          self.path, self.db)
+
+    def test_stale_socket(self):
+        self.daemon.shutdown()
+        # the socket file is left behind, as if the daemon was killed
+        socketserver_close = daemon.socketserver.UnixStreamServer
+        socketserver_close.server_close(self.daemon)
+        self.assertTrue(os.path.exists(self.path))
+        self.daemon = daemon.Daemon(self.path, self.db,
+                                    {'port': self.fake.port}).start()
+        self.assertEqual(self.call(op='ping'), {'pid': os.getpid()})
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_fakeamt
+----------------------------------
+
+Tests for `amt` module's fakeamt.py file, driven through the real
+client.
+"""
+
+import os
+import threading
+
+import fixtures
+import requests
+import testtools
+
+from amt import cache
+from amt import client
+from amt import fakeamt
+from amt import hostdb
+from amt import wsman
+
+# a self signed certificate for 127.0.0.1
+CERTFILE = os.path.join(os.path.dirname(__file__), 'fakeamt.pem')
+FINGERPRINT = ('B3:03:0E:7D:D1:C3:50:37:27:34:7D:9A:04:5F:F1:32:'
+               'EC:4D:1C:E7:1D:8F:AC:9E:A6:EC:1E:D9:44:28:DB:85')
+
+
+class TestFakeAMT(testtools.TestCase):
+
+    def setUp(self):
+        super(TestFakeAMT, self).setUp()
+        self.server = fakeamt.FakeAMT().start()
+        self.addCleanup(self.server.stop)
+        self.host = self.server.hosts['127.0.0.1']
+        self.client = self.make_client()
+
+    def make_client(self, password=fakeamt.DEFAULT_PASSWORD, **kwargs):
+        amt_client = client.Client('127.0.0.1', password,
+                                   port=self.server.port,
+                                   vncpasswd='Vnc1234!', **kwargs)
+        self.addCleanup(amt_client.close)
+        return amt_client
+
+    def test_power(self):
+        self.assertEqual(self.client.power_status(), '2')
+        self.assertEqual(self.client.power_off().return_value, 0)
+        self.assertEqual(self.client.power_status(), '8')
+        self.assertEqual(self.client.power_on().return_value, 0)
+        self.assertEqual(self.host.power_state, 2)
+
+    def test_power_delay(self):
+        self.host.power_delay = 0.2
+        self.client.power_off()
+        self.assertEqual(self.client.power_status(), '2')
+        self.assertTrue(self.client.wait_for_power_state(
+            'off', timeout=5, interval=0.05))
+
+    def test_next_boot(self):
+        self.client.set_next_boot('pxe')
+        self.assertEqual(self.host.boot_source,
+                         'Intel(r) AMT: Force PXE Boot')
+        self.assertEqual(self.host.boot_role, 1)
+        # used up by the reboot
+        self.client.power_cycle()
+        self.assertIsNone(self.host.boot_role)
+        self.assertEqual(self.host.boot_source,
+                         'Intel(r) AMT: Force PXE Boot')
+
+    def test_next_boot_always_written(self):
+        self.client.set_next_boot('pxe')
+        self.assertEqual(self.host.requests['Enumerate'], 0)
+        # the role may have been used up by a boot the client didn't
+        # see, so it is written again
+        self.host.boot_role = None
+        self.client.set_next_boot('pxe')
+        self.assertEqual(self.host.requests['ChangeBootOrder'], 2)
+        self.assertEqual(self.host.requests['SetBootConfigRole'], 2)
+        self.assertEqual(self.host.boot_role, 1)
+
+    def test_boot_source(self):
+        # cached reads are dropped by the changes that affect them
+        cached = self.make_client(cache=cache.TTLCache(ttl=60))
+        self.host.boot_source = 'Intel(r) AMT: Force CD/DVD Boot'
+        self.assertEqual(cached.boot_source(), 'cd')
+        self.assertFalse(cached.boot_config_role())
+        cached.set_next_boot('hd')
+        self.assertEqual(cached.boot_source(), 'hd')
+        self.assertTrue(cached.boot_config_role())
+        cached.power_cycle()
+        self.assertFalse(cached.boot_config_role())
+
+    def test_vnc(self):
+        self.client.enable_vnc()
+        self.assertEqual(self.host.rfb_password, 'Vnc1234!')
+        self.assertEqual(self.host.kvm_settings['Is5900PortEnabled'],
+                         'true')
+        self.assertEqual(self.host.kvm_state, 2)
+        status = self.client.vnc_status()
+        self.assertEqual(status.fields['Is5900PortEnabled'], 'true')
+        self.assertIn('Is5900PortEnabled>true<', status.pretty())
+
+    def test_enumerate(self):
+        items = self.client.enumerate(client.CIM_BootSourceSetting,
+                                      max_elements=1)
+        self.assertEqual(len(items), 3)
+        self.assertEqual(self.host.requests['Pull'], 2)
+
+    def test_generic(self):
+        self.assertEqual(self.client.get('CIM_KVMRedirectionSAP')[
+            'EnabledState'], '3')
+        result = self.client.invoke(
+            'CIM_PowerManagementService', 'RequestPowerStateChange',
+            {'Name': 'Intel(r) AMT Power Management Service'},
+            [('PowerState', 8),
+             ('ManagedElement', wsman.Reference(
+                 'CIM_ComputerSystem', {'Name': 'ManagedSystem'}))])
+        self.assertEqual(result.return_value, 0)
+        self.assertEqual(self.host.power_state, 8)
+        self.assertRaises(client.ReturnValueError, self.client.invoke,
+                          'CIM_PowerManagementService',
+                          'RequestPowerStateChange',
+                          params={'PowerState': 42})
+        self.client.put('IPS_KVMRedirectionSettingData',
+                        {'OptInPolicy': False, 'SessionTimeout': 5})
+        self.assertEqual(self.host.kvm_settings['OptInPolicy'], 'false')
+        self.assertEqual(self.host.kvm_settings['SessionTimeout'], '5')
+
+    def test_unknown_resource(self):
+        self.assertRaises(requests.exceptions.HTTPError,
+                          self.client.get_properties,
+                          client.SCHEMA_BASE + 'CIM_Unknown')
+        # only the full resource uri names a class
+        payload = wsman.get_request(self.client.uri,
+                                    'CIM_SoftwareIdentity').replace(
+            client.CIM_SoftwareIdentity.encode(), b'CIM_SoftwareIdentity')
+        self.assertRaises(requests.exceptions.HTTPError, self.client.post,
+                          payload)
+
+    def test_enumerate_class_name(self):
+        items = self.client.enumerate('CIM_SoftwareIdentity')
+        self.assertEqual(items[0]['VersionString'], self.host.firmware)
+
+    def test_digest_auth(self):
+        self.client.power_status()
+        self.client.power_status()
+        self.assertEqual(self.server.challenges, 1)
+
+        bad = self.make_client(password='wrong')
+        e = self.assertRaises(requests.exceptions.HTTPError,
+                              bad.power_status)
+        self.assertEqual(e.response.status_code, 401)
+
+    def test_nonces_bounded(self):
+        self.server.max_nonces = 2
+        first = self.make_client()
+        first.power_status()
+        for i in range(3):
+            self.make_client().power_status()
+        self.assertEqual(len(self.server.nonces), 2)
+        # the first client's nonce was forgotten, it is challenged again
+        challenges = self.server.challenges
+        first.power_status(use_cache=False)
+        self.assertEqual(self.server.challenges, challenges + 1)
+
+    def test_contexts_bounded(self):
+        self.server.max_contexts = 2
+        for i in range(3):
+            # left open, only the first instance is pulled
+            self.client.post(wsman.enumerate_request(
+                self.client.uri, client.CIM_BootSourceSetting,
+                max_elements=1))
+        self.assertEqual(list(self.server._contexts), ['2', '3'])
+        self.assertRaises(requests.exceptions.HTTPError, self.client.post,
+                          wsman.pull_request(self.client.uri,
+                                             client.CIM_BootSourceSetting,
+                                             '1'))
+        # the open ones can still be finished
+        self.client.post(wsman.pull_request(
+            self.client.uri, client.CIM_BootSourceSetting, '3'))
+        self.assertEqual(list(self.server._contexts), ['2'])
+
+    def test_digest_auth_threads(self):
+        threads = [threading.Thread(target=self.client.power_status)
+                   for i in range(4)]
+        self.client.power_status()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.server.challenges, 1)
+        self.assertEqual(self.host.requests['Get'], 5)
+
+    def test_injected_errors(self):
+        self.host.errors = [503, 503]
+        self.assertEqual(self.client.power_status(), '2')
+        self.assertEqual(self.host.errors, [])
+
+        self.host.errors = [500]
+        self.assertRaises(requests.exceptions.HTTPError,
+                          self.client.power_off)
+        self.assertEqual(self.host.power_state, 2)
+
+    def test_hang(self):
+        self.host.hang = True
+        hung = self.make_client(timeout=(1, 0.2), retries=0)
+        self.assertRaises(requests.exceptions.ReadTimeout,
+                          hung.power_status)
+
+    def test_fleet_addresses(self):
+        self.assertEqual(fakeamt.fleet_addresses(3, '127.1.0.254'),
+                         ['127.1.0.255', '127.1.1.0', '127.1.1.1'])
+
+
+class TestFakeAMTHTTPS(testtools.TestCase):
+
+    def setUp(self):
+        super(TestFakeAMTHTTPS, self).setUp()
+        self.server = fakeamt.FakeAMT(certfile=CERTFILE).start()
+        self.addCleanup(self.server.stop)
+        self.sleep = self.useFixture(
+            fixtures.MockPatch('amt.client.time.sleep')).mock
+
+    def make_client(self, **kwargs):
+        amt_client = client.Client('127.0.0.1', fakeamt.DEFAULT_PASSWORD,
+                                   protocol='https', port=self.server.port,
+                                   **kwargs)
+        self.addCleanup(amt_client.close)
+        return amt_client
+
+    def test_fingerprint(self):
+        amt_client = self.make_client(
+            fingerprint=hostdb.parse_fingerprint(FINGERPRINT))
+        self.assertEqual(amt_client.power_status(), '2')
+        self.assertTrue(amt_client.uri.startswith('https://'))
+
+    def test_wrong_fingerprint(self):
+        amt_client = self.make_client(fingerprint='0' * 64)
+        self.assertRaises(requests.exceptions.SSLError,
+                          amt_client.power_status)
+        # not worth retrying
+        self.assertFalse(self.sleep.called)
+
+    def test_cafile(self):
+        self.assertEqual(self.make_client(verify=CERTFILE).power_status(),
+                         '2')
+        self.assertRaises(requests.exceptions.SSLError,
+                          self.make_client().power_status)
+
+    def test_session_resumption(self):
+        amt_client = self.make_client(verify=CERTFILE)
+        for i in range(3):
+            amt_client.power_status()
+            # drop the connection, the TLS session outlives it
+            amt_client.close()
+        self.assertEqual(amt_client.tls_context.handshakes, 3)
+        self.assertEqual(amt_client.tls_context.resumed, 2)
+
+    def test_from_server(self):
+        amt_client = client.Client.from_server(
+            {'host': '127.0.0.1', 'passwd': fakeamt.DEFAULT_PASSWORD,
+             'protocol': 'https', 'cafile': CERTFILE},
+            port=self.server.port)
+        self.addCleanup(amt_client.close)
+        self.assertEqual(amt_client.power_status(), '2')
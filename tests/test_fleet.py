@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_fleet
+----------------------------------
+
+Tests for `amt` module's fleet.py file
+"""
+
+import threading
+import time
+
+import testtools
+
+from amt import fleet
+
+
+class TestFleetRun(testtools.TestCase):
+
+    def test_results_in_order(self):
+        targets = [("a", 3), ("b", 1), ("c", 2)]
+
+        def func(name, value):
+            time.sleep(value / 100.0)
+            return name * value
+
+        results = fleet.run(targets, func)
+        self.assertEqual([r.name for r in results], ["a", "b", "c"])
+        self.assertEqual([r.value for r in results], ["aaa", "b", "cc"])
+        self.assertTrue(all(r.ok for r in results))
+
+    def test_partial_failure(self):
+        def func(name, value):
+            if name == "bad":
+                raise ValueError("boom")
+            return value
+
+        results = fleet.run({"good": 1, "bad": 2}, func)
+        by_name = dict((r.name, r) for r in results)
+        self.assertTrue(by_name["good"].ok)
+        self.assertEqual(by_name["good"].value, 1)
+        self.assertFalse(by_name["bad"].ok)
+        self.assertIsInstance(by_name["bad"].error, ValueError)
+
+    def test_concurrency_limit(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def func(name, value):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+
+        fleet.run([(str(i), i) for i in range(20)], func, concurrency=3)
+        self.assertEqual(state['peak'], 3)
+
+    def test_empty(self):
+        self.assertEqual(fleet.run([], lambda n, v: v), [])
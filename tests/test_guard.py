@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_guard
+----------------------------------
+
+Tests for `amt` module's guard.py file
+"""
+
+import threading
+import time
+
+import testtools
+
+from amt import client
+from amt import fakeamt
+from amt import guard
+
+URI = 'http://10.42.0.1:16992/wsman'
+
+
+def start(func, *args):
+    thread = threading.Thread(target=func, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def wait_for(check, timeout=5):
+    deadline = time.time() + timeout
+    while not check():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.001)
+
+
+class TestHostGuard(testtools.TestCase):
+
+    def setUp(self):
+        super(TestHostGuard, self).setUp()
+        self.guard = guard.HostGuard()
+        self.release = threading.Event()
+        self.order = []
+
+    def queued(self, count):
+        wait_for(lambda: len(self.guard._host(URI).queue) == count)
+
+    def hold(self):
+        with self.guard.turn(URI):
+            self.order.append('first')
+            self.release.wait()
+
+    def change(self, name):
+        with self.guard.turn(URI):
+            self.order.append(name)
+
+    def test_turns_in_order(self):
+        threads = [start(self.hold)]
+        wait_for(lambda: self.order)
+        for i, name in enumerate(('a', 'b', 'c')):
+            threads.append(start(self.change, name))
+            self.queued(i + 1)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(self.order, ['first', 'a', 'b', 'c'])
+
+    def test_nested(self):
+        with self.guard.turn(URI):
+            with self.guard.turn(URI):
+                self.assertEqual(self.guard.read(URI, 'k', lambda: 1), 1)
+        # and other hosts don't wait
+        thread = start(self.hold)
+        wait_for(lambda: self.order)
+        with self.guard.turn('http://10.42.0.2:16992/wsman'):
+            pass
+        self.release.set()
+        thread.join(5)
+
+    def test_coalesce(self):
+        calls = []
+        results = []
+
+        def fetch():
+            calls.append(1)
+            return 'on'
+
+        def read():
+            results.append(self.guard.read(URI, 'power', fetch))
+
+        holder = start(self.hold)
+        wait_for(lambda: self.order)
+        readers = [start(read)]
+        self.queued(1)
+        readers.extend(start(read) for i in range(4))
+        wait_for(lambda: self.guard.coalesced == 4)
+        self.release.set()
+        for thread in [holder] + readers:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['on'] * 5)
+
+    def test_coalesce_error(self):
+        errors = []
+
+        def fail():
+            raise ValueError('boom')
+
+        def read():
+            try:
+                self.guard.read(URI, 'power', fail)
+            except ValueError as e:
+                errors.append(e)
+
+        holder = start(self.hold)
+        wait_for(lambda: self.order)
+        readers = [start(read)]
+        self.queued(1)
+        readers.append(start(read))
+        wait_for(lambda: self.guard.coalesced == 1)
+        self.release.set()
+        for thread in [holder] + readers:
+            thread.join(5)
+        self.assertEqual(len(errors), 2)
+        self.assertIs(errors[0], errors[1])
+        # nothing left in flight
+        self.assertEqual(self.guard._host(URI).flights, {})
+
+    def test_no_coalesce_across_change(self):
+        state = {'power': 'off'}
+        results = {}
+
+        def read(name):
+            results[name] = self.guard.read(URI, 'power',
+                                            lambda: state['power'])
+
+        def power_on():
+            with self.guard.turn(URI):
+                state['power'] = 'on'
+
+        threads = [start(self.hold)]
+        wait_for(lambda: self.order)
+        threads.append(start(read, 'before'))
+        self.queued(1)
+        threads.append(start(power_on))
+        self.queued(2)
+        threads.append(start(read, 'after'))
+        self.queued(3)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, {'before': 'off', 'after': 'on'})
+        self.assertEqual(self.guard.coalesced, 0)
+
+
+class TestGuardedClient(testtools.TestCase):
+
+    def setUp(self):
+        super(TestGuardedClient, self).setUp()
+        self.server = fakeamt.FakeAMT().start()
+        self.addCleanup(self.server.stop)
+        self.host = self.server.hosts['127.0.0.1']
+        self.guard = guard.HostGuard()
+
+    def make_client(self):
+        amt_client = client.Client('127.0.0.1', fakeamt.DEFAULT_PASSWORD,
+                                   port=self.server.port, guard=self.guard)
+        self.addCleanup(amt_client.close)
+        return amt_client
+
+    def test_shared_reads(self):
+        self.host.latency = 0.2
+        clients = [self.make_client() for i in range(2)]
+        results = []
+        threads = [start(lambda c: results.append(c.power_status()),
+                         clients[i % 2]) for i in range(6)]
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ['2'] * 6)
+        self.assertLess(self.host.requests['Get'], 6)
+        self.assertEqual(self.host.requests['Get'] + self.guard.coalesced, 6)
+
+    def test_changes_in_order(self):
+        amt_client = self.make_client()
+        amt_client.power_status()
+        self.host.latency = 0.1
+        threads = [start(amt_client.power_off)]
+        wait_for(lambda: self.guard._host(amt_client.uri).owner)
+        threads.append(start(amt_client.power_on))
+        wait_for(lambda: len(self.guard._host(amt_client.uri).queue) == 1)
+        # queued behind the power on, so sees it
+        self.assertEqual(amt_client.power_status(use_cache=False), '2')
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(self.host.requests['RequestPowerStateChange'], 2)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_health
+----------------------------------
+
+Tests for `amt` module's health.py file
+"""
+
+import os
+import socket
+import time
+
+import fixtures
+import requests
+import testtools
+
+from amt import client
+from amt import fakeamt
+from amt import health
+
+URI = 'http://10.42.0.1:16992/wsman'
+
+
+class TestHealth(testtools.TestCase):
+
+    def setUp(self):
+        super(TestHealth, self).setUp()
+        self.time = self.useFixture(
+            fixtures.MockPatch('amt.health.time')).mock.time
+        self.time.return_value = 1000.0
+        self.health = health.Health(threshold=2, cooldown=10,
+                                    max_cooldown=25)
+
+    def test_breaker(self):
+        self.assertEqual(self.health.state(URI), 'closed')
+        self.health.failed(URI)
+        self.assertTrue(self.health.allow(URI))
+        self.health.failed(URI)
+        self.assertEqual(self.health.state(URI), 'open')
+        self.assertFalse(self.health.allow(URI))
+        self.assertEqual(self.health.retry_in(URI), 10)
+        self.assertEqual(self.health.unavailable(), [URI])
+
+        # one trial at a time once the cooldown is over
+        self.time.return_value = 1010.0
+        self.assertEqual(self.health.state(URI), 'half-open')
+        self.assertTrue(self.health.allow(URI))
+        self.assertFalse(self.health.allow(URI))
+        self.health.failed(URI)
+        self.assertEqual(self.health.retry_in(URI), 20)
+        self.time.return_value = 1030.0
+        self.assertTrue(self.health.allow(URI))
+        self.health.failed(URI)
+        # capped
+        self.assertEqual(self.health.retry_in(URI), 25)
+
+        self.time.return_value = 1055.0
+        self.assertTrue(self.health.allow(URI))
+        self.health.succeeded(URI)
+        self.assertEqual(self.health.state(URI), 'closed')
+        self.assertEqual(self.health.unavailable(), [])
+
+    def test_abandon(self):
+        self.health.failed(URI)
+        self.health.failed(URI)
+        self.time.return_value = 1010.0
+        self.assertTrue(self.health.allow(URI))
+        self.health.abandon(URI)
+        self.assertTrue(self.health.allow(URI))
+
+    def test_check(self):
+        listener = socket.socket()
+        self.addCleanup(listener.close)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        uri = client.wsman_uri('127.0.0.1', port=listener.getsockname()[1])
+        self.health.failed(uri)
+        self.health.failed(uri)
+        self.assertTrue(self.health.check(uri))
+        self.assertEqual(self.health.state(uri), 'half-open')
+        listener.close()
+        self.assertFalse(self.health.check(uri, timeout=1))
+
+    def test_probing(self):
+        listener = socket.socket()
+        self.addCleanup(listener.close)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(5)
+        uri = client.wsman_uri('127.0.0.1', port=listener.getsockname()[1])
+        self.health.failed(uri)
+        self.health.failed(uri)
+        self.health.start(interval=0.01)
+        self.addCleanup(self.health.stop)
+        for i in range(500):
+            if self.health.state(uri) == 'half-open':
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.health.state(uri), 'half-open')
+
+    def test_save_load(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            health.HEALTH_NAME)
+        self.health.path = path
+        self.health.failed(URI)
+        self.health.failed(URI)
+        self.health.failed('http://10.42.0.2:16992/wsman')
+        self.health.save()
+        loaded = health.Health(path=path).load()
+        # only the hosts that are down are kept
+        self.assertEqual(loaded.unavailable(), [URI])
+        self.assertEqual(loaded.retry_in(URI), 10)
+
+        with open(path, 'w') as f:
+            f.write('{"broken": ')
+        self.assertEqual(health.Health(path=path).load().unavailable(), [])
+        self.assertEqual(
+            health.Health(path=path + '.missing').load().unavailable(), [])
+
+
+class TestClientHealth(testtools.TestCase):
+
+    def setUp(self):
+        super(TestClientHealth, self).setUp()
+        self.server = fakeamt.FakeAMT().start()
+        self.addCleanup(self.server.stop)
+        self.host = self.server.hosts['127.0.0.1']
+        self.health = health.Health()
+        self.client = client.Client('127.0.0.1', fakeamt.DEFAULT_PASSWORD,
+                                    port=self.server.port, retries=0,
+                                    health=self.health)
+        self.addCleanup(self.client.close)
+
+    def test_fail_fast(self):
+        self.server.stop()
+        self.assertRaises(requests.exceptions.ConnectionError,
+                          self.client.power_status)
+        self.assertEqual(self.health.state(self.client.uri), 'open')
+        e = self.assertRaises(client.HostUnavailable, self.client.power_on)
+        self.assertIsInstance(e, requests.exceptions.ConnectionError)
+        self.assertIn('failed to connect recently', str(e))
+
+    def test_http_errors_are_answers(self):
+        self.host.errors = [500]
+        self.assertRaises(requests.exceptions.HTTPError,
+                          self.client.power_status)
+        self.assertEqual(self.health.state(self.client.uri), 'closed')
+
+    def test_trial_closes(self):
+        self.health.failed(self.client.uri)
+        self.assertRaises(client.HostUnavailable, self.client.power_status)
+        self.assertTrue(self.health.check(self.client.uri))
+        self.assertEqual(self.client.power_status(), '2')
+        self.assertEqual(self.health.state(self.client.uri), 'closed')
+
+    def test_power_wait_ignores_breaker(self):
+        self.health.failed(self.client.uri)
+        self.assertTrue(self.client.wait_for_power_state('on', timeout=5))
+        self.assertEqual(self.health.state(self.client.uri), 'closed')
+
+    def test_power_wait_doesnt_trip(self):
+        self.server.stop()
+        self.assertFalse(self.client.wait_for_power_state('on', timeout=0))
+        self.assertEqual(self.health.state(self.client.uri), 'closed')
+        self.assertTrue(self.health.allow(self.client.uri))
@@ -17,6 +17,10 @@ test_hostdb
 Tests for `amt` module's wsman.py file
 """
 
+import os
+import sqlite3
+import stat
+
 import fixtures
 import mock
 import testtools
@@ -24,16 +28,27 @@ import testtools
 from amt import hostdb
 
 
+def entry(host, passwd, **options):
+    data = dict(host=host, passwd=passwd)
+    data.update((option, options.get(option)) for option in hostdb.OPTIONS)
+    return data
+
+
 class TestHostDB(testtools.TestCase):
 
     def setUp(self):
         super(TestHostDB, self).setUp()
-        dirname = fixtures.TempDir()
-        self.useFixture(dirname)
+        self.dirname = self.useFixture(fixtures.TempDir()).path
         self.out = self.useFixture(fixtures.StringStream('stdout'))
         self.useFixture(fixtures.MonkeyPatch('sys.stdout', self.out.stream))
-        with mock.patch('appdirs.user_config_dir', return_value=dirname.path):
-            self.db = hostdb.HostDB()
+        self.db = self.make_db()
+
+    def make_db(self):
+        with mock.patch('appdirs.user_config_dir',
+                        return_value=self.dirname):
+            db = hostdb.HostDB()
+        self.addCleanup(db.close)
+        return db
 
     @property
     def stdout(self):
@@ -60,4 +75,282 @@ class TestHostDB(testtools.TestCase):
         self.db.set_server("os2", "10.42.0.51", "foo")
         server = self.db.get_server("os1")
         self.assertEqual(server,
-                         dict(host="10.42.0.50", passwd="foo", vncpasswd=None))
+                         entry("10.42.0.50", "foo"))
+
+    def test_get_server_missing(self):
+        self.assertIsNone(self.db.get_server("os1", quiet=True))
+        self.assertEqual(self.stdout, "")
+
+    def test_resolve(self):
+        for name in ("rack-1", "rack-2", "os1", "rack-10"):
+            self.db.set_server(name, "10.42.0.50", "foo")
+        self.assertEqual(self.db.resolve("os1"), ["os1"])
+        self.assertEqual(self.db.resolve("rack-?"), ["rack-1", "rack-2"])
+        self.assertEqual(self.db.resolve("os1,rack-1*,rack-2,missing"),
+                         ["os1", "rack-1", "rack-10", "rack-2", "missing"])
+        self.assertEqual(self.db.resolve("nope-*"), [])
+
+    def test_set_server_update(self):
+        self.db.set_server("os1", "10.42.0.50", "foo", "vnc")
+        self.db.set_server("os1", "10.42.0.51", "bar")
+        self.assertEqual(self.db.get_server("os1"),
+                         entry("10.42.0.51", "bar", vncpasswd="vnc"))
+        self.assertEqual(self.db.names(), ["os1"])
+
+    def test_set_server_options(self):
+        self.db.set_server("os1", "10.42.0.50", "foo", protocol="https",
+                           cafile="/etc/amt-ca.pem")
+        self.assertEqual(self.db.get_server("os1"),
+                         entry("10.42.0.50", "foo", protocol="https",
+                               cafile="/etc/amt-ca.pem"))
+        self.db.set_server("os1", "10.42.0.50", "foo", cafile="",
+                           fingerprint="ab" * 32)
+        self.assertEqual(self.db.get_server("os1"),
+                         entry("10.42.0.50", "foo", protocol="https",
+                               fingerprint="ab" * 32))
+
+    def test_find_host(self):
+        self.db.set_server("os1", "10.42.0.50", "foo")
+        self.db.set_server("os2", "10.42.0.51", "foo")
+        self.db.set_server("os1-alias", "10.42.0.50", "foo")
+        self.assertEqual(self.db.find_host("10.42.0.50"),
+                         ["os1", "os1-alias"])
+        self.assertEqual(self.db.find_host("10.42.0.99"), [])
+
+    def test_export_import_ini(self):
+        self.db.set_server("os1", "10.42.0.50", "foo", "vnc")
+        self.db.set_server("os2", "10.42.0.51", "bar")
+        path = os.path.join(self.dirname, 'export.cfg')
+        self.db.export_ini(path)
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+
+        self.db.rm_server("os1")
+        self.db.set_server("os2", "10.42.0.99", "baz")
+        self.assertEqual(self.db.import_ini(path), 2)
+        self.assertEqual(self.db.get_server("os1"),
+                         entry("10.42.0.50", "foo", vncpasswd="vnc"))
+        self.assertEqual(self.db.get_server("os2")["host"], "10.42.0.51")
+
+    def test_shared(self):
+        other = self.make_db()
+        self.db.set_server("os1", "10.42.0.50", "foo")
+        other.set_server("os2", "10.42.0.51", "foo")
+        self.assertEqual(self.db.names(), ["os1", "os2"])
+        other.rm_server("os1")
+        self.assertIsNone(self.db.get_server("os1", quiet=True))
+
+    def make_tagged(self):
+        self.db.set_server("n1", "10.42.0.1", "foo",
+                           tags=[("rack", "r12"), ("role", "worker")])
+        self.db.set_server("n2", "10.42.0.2", "foo",
+                           tags=[("rack", "r12"), ("role", "db")])
+        self.db.set_server("n3", "10.42.0.3", "foo",
+                           tags=[("rack", "r13"), ("role", "worker"),
+                                 ("role", "gpu")])
+        self.db.set_server("other", "10.42.0.4", "foo")
+
+    def test_tags(self):
+        self.make_tagged()
+        self.assertEqual(self.db.get_tags("n3"),
+                         [("rack", "r13"), ("role", "gpu"),
+                          ("role", "worker")])
+        self.assertEqual(self.db.get_tags("other"), [])
+
+        self.db.tag_server("other", [("rack", "r12"), ("rack", "r12")])
+        self.db.untag_server("n3", [("role", None)])
+        self.db.untag_server("n1", [("role", "nope"), ("rack", "r12")])
+        self.assertEqual(self.db.get_tags("other"), [("rack", "r12")])
+        self.assertEqual(self.db.get_tags("n3"), [("rack", "r13")])
+        self.assertEqual(self.db.get_tags("n1"), [("role", "worker")])
+
+        # replaced when given on set, kept when not
+        self.db.set_server("n1", "10.42.0.1", "bar")
+        self.assertEqual(self.db.get_tags("n1"), [("role", "worker")])
+        self.db.set_server("n1", "10.42.0.1", "bar", tags=[])
+        self.assertEqual(self.db.get_tags("n1"), [])
+
+    def test_tags_missing(self):
+        self.db.tag_server("nope", [("rack", "r12")])
+        self.assertIn("No config found for server (nope)", self.stdout)
+        self.assertEqual(self.db.names(), [])
+
+    def test_rm_server_tags(self):
+        self.make_tagged()
+        self.db.rm_server("n1")
+        self.db.set_server("n1", "10.42.0.1", "foo")
+        self.assertEqual(self.db.get_tags("n1"), [])
+        self.assertEqual(self.db.resolve("role=worker"), ["n3"])
+
+    def test_resolve_tags(self):
+        self.make_tagged()
+        self.assertEqual(self.db.resolve("rack=r12"), ["n1", "n2"])
+        self.assertEqual(self.db.resolve("rack=r12,role=worker"), ["n1"])
+        self.assertEqual(self.db.resolve("role=worker"), ["n1", "n3"])
+        self.assertEqual(self.db.resolve("rack=r1*,role=worker"),
+                         ["n1", "n3"])
+        self.assertEqual(self.db.resolve("n3,n2,missing,rack=r1?"),
+                         ["n3", "n2"])
+        self.assertEqual(self.db.resolve("rack=r99"), [])
+        self.assertRaises(ValueError, self.db.resolve, "rack=")
+
+    def test_list_servers_tags(self):
+        self.make_tagged()
+        self.db.list_servers("role=worker")
+        self.assertEqual(self.stdout.splitlines(), [
+            "Available servers (2):",
+            "    n1                   rack=r12,role=worker",
+            "    n3                   rack=r13,role=gpu,role=worker"])
+
+    def test_export_import_tags(self):
+        self.make_tagged()
+        path = os.path.join(self.dirname, 'export.cfg')
+        self.db.export_ini(path)
+        self.db.rm_server("n3")
+        self.db.import_ini(path)
+        self.assertEqual(self.db.resolve("role=gpu"), ["n3"])
+
+    def test_load(self):
+        self.db.set_server("os1", "10.42.0.50", "foo", "vnc",
+                           tags=[("rack", "r12")])
+        self.db.set_server("os2", "10.42.0.51", "foo")
+        records = [
+            ("line 2", {"name": "os1", "host": "10.42.0.50",
+                        "passwd": "foo", "tags": "rack=r12"}),
+            ("line 3", {"name": "os2", "host": "10.42.0.99",
+                        "passwd": "foo", "vncpasswd": ""}),
+            ("line 4", {"name": "os3", "host": "10.42.0.52",
+                        "passwd": "bar", "tags": ["role=db", "rack=r13"]}),
+        ]
+        self.assertEqual(self.db.load(iter(records)),
+                         {"added": 1, "updated": 1, "unchanged": 1})
+        # left out, so left alone
+        self.assertEqual(self.db.get_server("os1")["vncpasswd"], "vnc")
+        self.assertEqual(self.db.get_server("os2")["host"], "10.42.0.99")
+        self.assertEqual(self.db.get_tags("os3"),
+                         [("rack", "r13"), ("role", "db")])
+
+        # empty clears
+        records = [("line 2", {"name": "os1", "host": "10.42.0.50",
+                               "passwd": "foo", "vncpasswd": None,
+                               "tags": ""})]
+        self.assertEqual(self.db.load(records)["updated"], 1)
+        self.assertEqual(self.db.get_server("os1"),
+                         entry("10.42.0.50", "foo"))
+        self.assertEqual(self.db.get_tags("os1"), [])
+
+    def test_load_invalid(self):
+        self.db.set_server("os1", "10.42.0.50", "foo")
+        good = ("line 2", {"name": "os2", "host": "10.42.0.51",
+                           "passwd": "foo"})
+        for bad in ({"name": "os3", "host": "10.42.0.52"},
+                    {"name": "os*", "host": "10.42.0.52", "passwd": "foo"},
+                    {"name": "os3", "host": "10.42.0.52", "passwd": "foo",
+                     "password": "foo"},
+                    {"name": "os3", "host": "10.42.0.52", "passwd": "foo",
+                     "protocol": "ftp"},
+                    {"name": "os3", "host": "10.42.0.52", "passwd": "foo",
+                     "fingerprint": "abc"},
+                    {"name": "os3", "host": "10.42.0.52", "passwd": "foo",
+                     "tags": "rack"},
+                    {"name": "os2", "host": "10.42.0.52", "passwd": "foo"}):
+            e = self.assertRaises(ValueError, self.db.load,
+                                  [good, ("line 3", bad)])
+            self.assertIn("line 3: ", str(e))
+            # all or nothing
+            self.assertEqual(self.db.names(), ["os1"])
+
+
+class TestParse(testtools.TestCase):
+
+    def test_parse_tag(self):
+        self.assertEqual(hostdb.parse_tag("rack=r12"), ("rack", "r12"))
+        self.assertEqual(hostdb.parse_tag(" rack = r1* "), ("rack", "r1*"))
+        self.assertEqual(hostdb.parse_tag("rack", value_required=False),
+                         ("rack", None))
+        for bad in ("rack", "=r12", "rack=", "a=b=c", "a=b,c"):
+            self.assertRaises(ValueError, hostdb.parse_tag, bad)
+
+    def test_parse_fingerprint(self):
+        sha1 = "AB:cd:" + "00:" * 17 + "01"
+        self.assertEqual(hostdb.parse_fingerprint(sha1),
+                         "abcd" + "00" * 17 + "01")
+        for bad in ("abc", "zz" * 32, "ab" * 33):
+            self.assertRaises(ValueError, hostdb.parse_fingerprint, bad)
+
+    def test_parse_selector(self):
+        self.assertEqual(hostdb.parse_selector("n1, rack=r12,n*,,role=db"),
+                         (["n1", "n*"], [("rack", "r12"), ("role", "db")]))
+        self.assertTrue(hostdb.is_pattern("rack=r12"))
+
+
+class TestSQLiteHostDB(testtools.TestCase):
+
+    def setUp(self):
+        super(TestSQLiteHostDB, self).setUp()
+        self.dirname = self.useFixture(fixtures.TempDir()).path
+        self.patch = mock.patch('appdirs.user_config_dir',
+                                return_value=self.dirname)
+        self.patch.start()
+        self.addCleanup(self.patch.stop)
+
+    def test_private(self):
+        db = hostdb.HostDB()
+        self.addCleanup(db.close)
+        self.assertEqual(stat.S_IMODE(os.stat(db.dbname).st_mode), 0o600)
+
+    def test_import_hosts_cfg(self):
+        ini = hostdb.IniBackend(os.path.join(self.dirname, 'hosts.cfg'))
+        ini.set("os1", "10.42.0.50", "foo", vncpasswd="vnc")
+        ini.set("os2", "10.42.0.51", "bar")
+
+        db = hostdb.HostDB()
+        self.addCleanup(db.close)
+        self.assertIsInstance(db.backend, hostdb.SQLiteBackend)
+        self.assertEqual(db.names(), ["os1", "os2"])
+        self.assertEqual(db.get_server("os1"),
+                         entry("10.42.0.50", "foo", vncpasswd="vnc"))
+        # nothing left over from building it
+        self.assertEqual([f for f in os.listdir(self.dirname)
+                          if f.endswith('.tmp')], [])
+
+        # only on first use, hosts.db is authoritative after that
+        ini.set("os3", "10.42.0.52", "baz")
+        db2 = hostdb.HostDB()
+        self.addCleanup(db2.close)
+        self.assertEqual(db2.names(), ["os1", "os2"])
+
+    def test_upgrade(self):
+        conn = sqlite3.connect(os.path.join(self.dirname, 'hosts.db'))
+        conn.executescript("""
+            CREATE TABLE hosts (name TEXT PRIMARY KEY, host TEXT NOT NULL,
+                                passwd TEXT NOT NULL, vncpasswd TEXT);
+            INSERT INTO hosts VALUES ('os1', '10.42.0.50', 'foo', NULL);
+            PRAGMA user_version=1;
+        """)
+        conn.close()
+        db = hostdb.HostDB()
+        self.addCleanup(db.close)
+        db.tag_server("os1", [("rack", "r12")])
+        self.assertEqual(db.resolve("rack=r12"), ["os1"])
+
+    def test_update_atomic(self):
+        db = hostdb.HostDB()
+        self.addCleanup(db.close)
+        db.set_server("os1", "10.42.0.50", "foo")
+        servers = [("os2", {"host": "10.42.0.51", "passwd": "foo"}),
+                   ("os3", {"host": "10.42.0.52"})]
+        self.assertRaises(TypeError, db.backend.update, servers)
+        self.assertEqual(db.names(), ["os1"])
+
+
+class TestIniHostDB(TestHostDB):
+
+    def make_db(self):
+        with mock.patch('appdirs.user_config_dir',
+                        return_value=self.dirname):
+            db = hostdb.HostDB(hostdb.IniBackend(
+                os.path.join(self.dirname, 'hosts.cfg')))
+        return db
+
+    def test_shared(self):
+        self.skipTest("the INI backend is not safe for concurrent use")
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_inventory
+----------------------------------
+
+Tests for `amt` module's inventory.py file
+"""
+
+import io
+import json
+
+import fixtures
+import mock
+import testtools
+
+from amt import hostdb
+from amt import inventory
+
+CSV = u"""name,host,passwd,tags,protocol
+n1,10.42.0.1,foo,"rack=r12,role=worker",https
+n2,10.42.0.2,bar,,
+"""
+
+
+class TestInventory(testtools.TestCase):
+
+    def setUp(self):
+        super(TestInventory, self).setUp()
+        dirname = self.useFixture(fixtures.TempDir()).path
+        with mock.patch('appdirs.user_config_dir', return_value=dirname):
+            self.db = hostdb.HostDB()
+        self.addCleanup(self.db.close)
+
+    def test_read_csv(self):
+        self.assertEqual(self.db.load(inventory.read(io.StringIO(CSV),
+                                                     'csv')),
+                         {'added': 2, 'updated': 0, 'unchanged': 0})
+        self.assertEqual(self.db.get_server('n1')['protocol'], 'https')
+        self.assertEqual(self.db.resolve('role=worker'), ['n1'])
+
+    def test_read_csv_errors(self):
+        e = self.assertRaises(ValueError, list, inventory.read(
+            io.StringIO(u"name,host,password\n"), 'csv'))
+        self.assertIn('line 1', str(e))
+        e = self.assertRaises(ValueError, self.db.load, inventory.read(
+            io.StringIO(CSV + u"n3,10.42.0.3\n"), 'csv'))
+        self.assertIn('line 4: passwd is required', str(e))
+        e = self.assertRaises(ValueError, self.db.load, inventory.read(
+            io.StringIO(CSV + u"n3,10.42.0.3,baz,,,extra\n"), 'csv'))
+        self.assertIn('line 4', str(e))
+        self.assertEqual(self.db.names(), [])
+
+    def test_read_jsonl(self):
+        text = u'{"name": "n1", "host": "10.42.0.1", "passwd": "foo"}\n\n'
+        self.assertEqual(self.db.load(inventory.read(io.StringIO(text),
+                                                     'jsonl'))['added'], 1)
+        for bad in (u'{"name": "n2"\n', u'["n2"]\n'):
+            e = self.assertRaises(ValueError, self.db.load, inventory.read(
+                io.StringIO(text + bad), 'jsonl'))
+            self.assertIn('line 3', str(e))
+
+    def test_round_trip(self):
+        self.db.load(inventory.read(io.StringIO(CSV), 'csv'))
+        self.db.set_server('n2', '10.42.0.2', 'bar', vncpasswd='vnc')
+        servers = list(self.db.servers())
+        for fmt in inventory.FORMATS:
+            f = io.StringIO()
+            self.assertEqual(inventory.write(f, self.db.servers(), fmt), 2)
+            f.seek(0)
+            self.assertEqual(self.db.load(inventory.read(f, fmt)),
+                             {'added': 0, 'updated': 0, 'unchanged': 2})
+            self.assertEqual(list(self.db.servers()), servers)
+
+    def test_write_jsonl(self):
+        self.db.set_server('n1', '10.42.0.1', 'foo', tags=[('rack', 'r12')])
+        f = io.StringIO()
+        inventory.write(f, self.db.servers(), 'jsonl')
+        record = json.loads(f.getvalue())
+        self.assertEqual(record['tags'], ['rack=r12'])
+        self.assertIsNone(record['vncpasswd'])
+
+    def test_formats(self):
+        self.assertEqual(inventory.guess_format('fleet.CSV'), 'csv')
+        self.assertEqual(inventory.guess_format('fleet.ndjson'), 'jsonl')
+        self.assertEqual(inventory.guess_format('hosts.cfg'), 'ini')
+        self.assertIsNone(inventory.guess_format('fleet.txt'))
+        self.assertRaises(ValueError, inventory.read, io.StringIO(), 'xml')
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_metrics
+----------------------------------
+
+Tests for `amt` module's metrics.py file
+"""
+
+import fixtures
+import requests
+import testtools
+
+from amt import client
+from amt import fakeamt
+from amt import metrics
+
+
+class TestHistogram(testtools.TestCase):
+
+    def test_cumulative(self):
+        histogram = metrics.Histogram((0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.cumulative()), [(0.1, 1), (1.0, 3)])
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.sum, 6.05)
+
+
+class TestMetrics(testtools.TestCase):
+
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        self.server = fakeamt.FakeAMT().start()
+        self.addCleanup(self.server.stop)
+        self.host = self.server.hosts['127.0.0.1']
+        self.metrics = metrics.Metrics(buckets=(0.1, 1.0))
+        self.events = []
+        self.metrics.add_hook(after=self.events.append)
+        self.client = self.make_client()
+
+    def make_client(self, **kwargs):
+        amt_client = client.Client('127.0.0.1', fakeamt.DEFAULT_PASSWORD,
+                                   port=self.server.port,
+                                   metrics=self.metrics, **kwargs)
+        self.addCleanup(amt_client.close)
+        return amt_client
+
+    def test_phases(self):
+        self.host.latency = 0.05
+        self.client.power_status()
+        self.client.power_status()
+        first, second = self.events
+        self.assertEqual(first.action,
+                         'CIM_AssociatedPowerManagementService/Get')
+        self.assertEqual(first.host, self.client.uri)
+        self.assertEqual(first.outcome, '200')
+        self.assertEqual(set(first.phases), set(metrics.PHASES))
+        self.assertGreater(first.phases['connect'], 0)
+        self.assertGreater(first.phases['challenge'], 0)
+        self.assertGreaterEqual(first.phases['server'], 0.05)
+        self.assertLessEqual(sum(first.phases.values()), first.elapsed)
+        # the connection and the nonce are reused
+        self.assertEqual(second.phases['connect'], 0)
+        self.assertEqual(second.phases['challenge'], 0)
+        self.assertGreaterEqual(second.phases['server'], 0.05)
+
+    def test_before_hook(self):
+        started = []
+        self.metrics.add_hook(before=started.append)
+        self.client.power_on()
+        self.assertEqual(started, self.events)
+        self.assertEqual(started[0].action,
+                         'CIM_PowerManagementService/RequestPowerStateChange')
+
+    def test_errors(self):
+        self.host.errors = [500]
+        self.assertRaises(requests.exceptions.HTTPError,
+                          self.client.power_off)
+        self.client.power_off()
+        self.assertEqual([e.outcome for e in self.events],
+                         ['HTTPError', '200'])
+        self.assertEqual(self.events[0].status, 500)
+        self.assertNotIn('parse', self.events[0].phases)
+
+    def test_retries(self):
+        self.useFixture(fixtures.MockPatch('amt.client.time.sleep'))
+        self.host.errors = [503]
+        self.client.power_status()
+        self.assertEqual(self.events[0].attempts, 2)
+        self.assertIn('amt_request_retries_total{host="%s"} 1'
+                      % self.client.uri, self.metrics.prometheus())
+
+    def test_prometheus(self):
+        self.client.power_status()
+        self.client.power_status()
+        self.client.power_on()
+        text = self.metrics.prometheus()
+        uri = self.client.uri
+        self.assertIn(
+            'amt_requests_total{host="%s",action="CIM_AssociatedPower'
+            'ManagementService/Get",outcome="200"} 2' % uri, text)
+        self.assertIn('amt_digest_challenges_total{host="%s"} 1' % uri,
+                      text)
+        self.assertIn('# TYPE amt_request_duration_seconds histogram', text)
+        self.assertIn(
+            'amt_request_duration_seconds_count{action="CIM_Associated'
+            'PowerManagementService/Get"} 2', text)
+        self.assertIn(
+            'amt_request_phase_seconds_bucket{action="CIM_Associated'
+            'PowerManagementService/Get",phase="parse",le="+Inf"} 2', text)
+        self.assertIn('le="0.1"', text)
+        self.assertEqual(self.metrics.requests(host=uri), 3)
+        self.assertEqual(self.metrics.requests(
+            action='CIM_PowerManagementService/RequestPowerStateChange'), 1)
+
+    def test_per_host(self):
+        self.metrics.per_host = True
+        self.client.power_status()
+        self.assertIn(
+            'amt_request_duration_seconds_count{host="%s",action="CIM_'
+            'AssociatedPowerManagementService/Get"} 1' % self.client.uri,
+            self.metrics.prometheus())
+
+    def test_label_escaping(self):
+        self.assertEqual(metrics._labels(('a',), ('x"y\\z\n',)),
+                         '{a="x\\"y\\\\z\\n"}')
+
+    def test_disabled(self):
+        plain = client.Client('127.0.0.1', fakeamt.DEFAULT_PASSWORD,
+                              port=self.server.port)
+        self.addCleanup(plain.close)
+        plain.power_status()
+        adapter = plain.session.get_adapter(plain.uri)
+        self.assertFalse(adapter.timed)
+        self.assertEqual(self.events, [])
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_pipeline
+----------------------------------
+
+Tests for `amt` module's pipeline.py file
+"""
+
+import threading
+
+import fixtures
+import testtools
+
+from amt import client
+from amt import fakeamt
+from amt import pipeline
+
+
+class TestPipeline(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPipeline, self).setUp()
+        # a server per host, so they can all be on 127.0.0.1
+        self.hosts = []
+        self.clients = []
+        for i in range(5):
+            server = fakeamt.FakeAMT().start()
+            self.addCleanup(server.stop)
+            self.hosts.append(server.hosts['127.0.0.1'])
+            amt_client = client.Client('127.0.0.1', fakeamt.DEFAULT_PASSWORD,
+                                       port=server.port, retries=0)
+            self.addCleanup(amt_client.close)
+            self.clients.append(('n%d' % i, amt_client))
+        self.sleep = self.useFixture(
+            fixtures.MockPatch('amt.pipeline.time.sleep')).mock
+
+    def test_reprovision(self):
+        stages = []
+        self.hosts[1].set_power_state(8)
+        # the fake hosts reset too quickly to be seen going down
+        report = pipeline.reprovision(self.clients, wave_size=2,
+                                      wave_interval=30, reset_settle=0,
+                                      progress=stages.append)
+        self.assertTrue(report.ok)
+        self.assertEqual(report.succeeded, ['n0', 'n1', 'n2', 'n3', 'n4'])
+        self.assertEqual([s.name for s in stages], list(pipeline.STAGES))
+        self.assertEqual(report.stage('power').results[0].value, 'reboot')
+        # the host that was off is powered on rather than reset
+        self.assertEqual(report.stage('power').results[1].value, 'on')
+        for host in self.hosts:
+            self.assertEqual(host.boot_source,
+                             'Intel(r) AMT: Force PXE Boot')
+            self.assertEqual(host.power_state, 2)
+            # used up by the boot
+            self.assertIsNone(host.boot_role)
+
+    def test_waves(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+        power_cycle = client.Client.power_cycle
+
+        def counting(amt_client):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            try:
+                return power_cycle(amt_client)
+            finally:
+                with lock:
+                    state['running'] -= 1
+
+        self.useFixture(fixtures.MockPatchObject(
+            client.Client, 'power_cycle', counting))
+        pipeline.reprovision(self.clients, wave_size=2, wave_interval=30,
+                             reset_settle=0)
+        self.assertLessEqual(state['peak'], 2)
+        # 3 waves, so 2 waits between them
+        self.assertEqual(self.sleep.call_count, 2)
+        for call in self.sleep.call_args_list:
+            self.assertGreater(call[0][0], 29)
+
+    def test_failed_stage(self):
+        self.hosts[2].errors = [500]
+        report = pipeline.reprovision(self.clients, wave_size=10,
+                                      reset_settle=0)
+        self.assertFalse(report.ok)
+        self.assertEqual(list(report.failed), ['n2'])
+        self.assertEqual(report.failed['n2'][0], 'boot')
+        self.assertEqual(len(report.stage('boot').results), 5)
+        # left out of the later stages
+        self.assertEqual(len(report.stage('power').results), 4)
+        self.assertEqual(report.succeeded, ['n0', 'n1', 'n3', 'n4'])
+        self.assertEqual(self.hosts[2].requests['RequestPowerStateChange'],
+                         0)
+        self.assertEqual(self.hosts[3].requests['RequestPowerStateChange'],
+                         1)
+        self.assertEqual(self.sleep.call_count, 0)
+
+    def test_verify_timeout(self):
+        self.hosts[0].power_delay = 60
+        report = pipeline.reprovision(self.clients[:1], verify_timeout=0)
+        self.assertEqual(report.failed['n0'][0], 'verify')
+        self.assertIn('not powered on', str(report.failed['n0'][1]))
+
+    def test_verify_waits_for_reset(self):
+        # still reports on for a moment after the reset is sent
+        self.hosts[0].reset_lag = 0.2
+        self.hosts[0].power_delay = 0.2
+        seen = []
+        power_status = client.Client.power_status
+
+        def recording(amt_client, use_cache=True):
+            state = power_status(amt_client, use_cache=use_cache)
+            seen.append(state)
+            return state
+
+        self.useFixture(fixtures.MockPatchObject(
+            client.Client, 'power_status', recording))
+        report = pipeline.reprovision(self.clients[:1])
+        self.assertTrue(report.ok)
+        self.assertEqual(report.stage('power').results[0].value, 'reboot')
+        # verify only passed once the reset had been seen
+        self.assertIn('8', seen)
+        self.assertEqual(seen[-1], '2')
+        self.assertEqual(self.hosts[0].power_state, 2)
+
+    def test_bad_arguments(self):
+        self.assertRaises(ValueError, pipeline.Pipeline, self.clients,
+                          boot_device='floppy')
+        self.assertRaises(ValueError, pipeline.Pipeline, self.clients,
+                          wave_size=0)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_sweep
+----------------------------------
+
+Tests for `amt` module's sweep.py file
+"""
+
+import json
+import os
+
+import fixtures
+import mock
+import testtools
+
+from amt import fakeamt
+from amt import hostdb
+from amt import sweep
+
+
+class TestSweep(testtools.TestCase):
+
+    def setUp(self):
+        super(TestSweep, self).setUp()
+        self.dirname = self.useFixture(fixtures.TempDir()).path
+        with mock.patch('appdirs.user_config_dir',
+                        return_value=self.dirname):
+            self.db = hostdb.HostDB()
+        self.addCleanup(self.db.close)
+        self.server = fakeamt.FakeAMT().start()
+        self.addCleanup(self.server.stop)
+        self.host = self.server.hosts['127.0.0.1']
+        # every server is the one fake host
+        for name in ('n1', 'n2', 'n3'):
+            self.db.set_server(name, '127.0.0.1', fakeamt.DEFAULT_PASSWORD,
+                               tags=[('rack', 'r12' if name != 'n3'
+                                      else 'r13')])
+        self.path = os.path.join(self.dirname, sweep.SNAPSHOT_NAME)
+        self.time = self.useFixture(
+            fixtures.MockPatch('amt.sweep.time')).mock.time
+        self.time.return_value = 1000.0
+
+    def sweep(self, **kwargs):
+        return sweep.sweep(self.db,
+                           client_kwargs={'port': self.server.port,
+                                          'retries': 0},
+                           **kwargs)
+
+    def snapshot(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_sweep(self):
+        self.host.boot_source = 'Intel(r) AMT: Force PXE Boot'
+        self.host.kvm_state = 2
+        self.host.firmware = '12.0.45'
+        self.assertEqual(self.sweep(),
+                         {'queried': 3, 'reused': 0, 'failed': 0})
+        records = self.snapshot()
+        self.assertEqual([r['name'] for r in records], ['n1', 'n2', 'n3'])
+        record = records[0]
+        self.assertEqual(record['uri'], 'http://127.0.0.1:16992/wsman')
+        self.assertEqual(record['swept'], 1000.0)
+        self.assertEqual(record['power'], 'on')
+        self.assertEqual(record['boot_source'], 'pxe')
+        self.assertFalse(record['boot_next'])
+        self.assertEqual(record['kvm'], 'enabled')
+        self.assertEqual(record['firmware'], '12.0.45')
+        self.assertIsNone(record['error'])
+        self.assertEqual(list(record), list(sweep._KEYS))
+
+    def test_incremental(self):
+        self.sweep()
+        requests = sum(self.host.requests.values())
+        self.time.return_value = 1100.0
+        self.db.set_server('n2', '127.0.0.1', fakeamt.DEFAULT_PASSWORD,
+                           protocol='https')
+        self.db.rm_server('n3')
+        self.db.set_server('n4', '127.0.0.1', fakeamt.DEFAULT_PASSWORD)
+        # n2's address changed (it fails as the fake speaks http) and
+        # n4 is new, n1 is fresh and n3 is gone
+        self.assertEqual(self.sweep(),
+                         {'queried': 2, 'reused': 1, 'failed': 1})
+        records = dict((r['name'], r) for r in self.snapshot())
+        self.assertEqual(sorted(records), ['n1', 'n2', 'n4'])
+        self.assertEqual(records['n1']['swept'], 1000.0)
+        self.assertTrue(records['n2']['error'])
+        self.assertIsNone(records['n2']['power'])
+        self.assertEqual(records['n4']['power'], 'on')
+        self.assertGreater(sum(self.host.requests.values()), requests)
+
+        # failures are retried, and old records refreshed
+        self.db.set_server('n2', '127.0.0.1', fakeamt.DEFAULT_PASSWORD,
+                           protocol='http')
+        self.time.return_value = 1350.0
+        self.assertEqual(self.sweep(),
+                         {'queried': 2, 'reused': 1, 'failed': 0})
+        self.assertEqual(self.sweep(max_age=0)['queried'], 3)
+
+    def test_selector(self):
+        self.sweep()
+        self.time.return_value = 2000.0
+        self.assertEqual(self.sweep(selector='rack=r13'),
+                         {'queried': 1, 'reused': 0, 'failed': 0})
+        records = self.snapshot()
+        self.assertEqual([r['swept'] for r in records],
+                         [1000.0, 1000.0, 2000.0])
+
+    def test_bad_snapshot(self):
+        with open(self.path, 'w') as f:
+            f.write('not json\n')
+        self.assertEqual(self.sweep()['queried'], 3)
+        self.assertEqual(len(self.snapshot()), 3)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_watch
+----------------------------------
+
+Tests for `amt` module's watch.py file
+"""
+
+import threading
+
+import fixtures
+import mock
+import requests
+import testtools
+
+from amt import client
+from amt import watch
+
+
+class FakeClient(object):
+    """Reports each of states in turn, then sticks on the last one."""
+
+    def __init__(self, *states):
+        self.states = list(states)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def power_status(self):
+        with self.lock:
+            self.calls += 1
+            if len(self.states) > 1:
+                state = self.states.pop(0)
+            else:
+                state = self.states[0]
+        if isinstance(state, Exception):
+            raise state
+        return state
+
+
+class TestWaitForPowerState(testtools.TestCase):
+
+    def setUp(self):
+        super(TestWaitForPowerState, self).setUp()
+        self.client = client.Client('10.42.0.50', 'secret')
+        self.sleep = self.useFixture(fixtures.MockPatch('time.sleep')).mock
+
+    def test_reached(self):
+        with mock.patch.object(self.client, 'power_status',
+                               side_effect=['2', '2', '8']) as status:
+            self.assertTrue(self.client.wait_for_power_state('off'))
+        self.assertEqual(status.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+        # backing off
+        delays = [c[0][0] for c in self.sleep.call_args_list]
+        self.assertTrue(delays[1] > delays[0])
+
+    def test_connection_errors_ignored(self):
+        error = requests.exceptions.ConnectionError()
+        with mock.patch.object(self.client, 'power_status',
+                               side_effect=[error, error, '2']):
+            self.assertTrue(self.client.wait_for_power_state(2))
+
+    def test_missing_power_state(self):
+        with mock.patch.object(self.client, 'power_status',
+                               return_value=None):
+            self.assertRaises(client.AMTError,
+                              self.client.wait_for_power_state, 'off')
+
+    def test_timeout(self):
+        with mock.patch.object(self.client, 'power_status',
+                               return_value='2'):
+            self.assertFalse(
+                self.client.wait_for_power_state('off', timeout=0))
+
+    def test_unknown_state(self):
+        with mock.patch.object(self.client, 'power_status') as status:
+            self.assertRaises(ValueError, self.client.wait_for_power_state,
+                              'sideways')
+        self.assertEqual(status.call_count, 0)
+
+    def test_power_change(self):
+        error = requests.exceptions.ConnectionError()
+        with mock.patch.object(self.client, 'power_status',
+                               side_effect=['2', '2', error]):
+            self.assertTrue(self.client.wait_for_power_change('on'))
+        with mock.patch.object(self.client, 'power_status',
+                               return_value='2'):
+            self.assertFalse(
+                self.client.wait_for_power_change('on', timeout=0))
+
+
+class TestPowerWatcher(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPowerWatcher, self).setUp()
+        self.changes = []
+        self.watcher = watch.PowerWatcher(
+            interval=0.001, max_interval=0.01,
+            callback=lambda *args: self.changes.append(args))
+        self.addCleanup(self.watcher.stop)
+
+    def test_change_events(self):
+        fake = FakeClient('2', '2', '8')
+        self.watcher.watch('os1', fake)
+        self.assertTrue(self.watcher.wait_for('os1', 'off', timeout=5))
+        self.assertEqual(self.changes, [('os1', None, 'on'),
+                                        ('os1', 'on', 'off')])
+        self.assertEqual(self.watcher.state('os1'), 'off')
+
+    def test_waiters_share_poller(self):
+        fake = FakeClient(*(['2'] * 20 + ['8']))
+        self.watcher.watch('os1', fake)
+        results = []
+
+        def waiter():
+            results.append(self.watcher.wait_for('os1', 'off', timeout=5))
+
+        threads = [threading.Thread(target=waiter) for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [True] * 10)
+        # one polling loop, not one per waiter
+        self.assertTrue(fake.calls < 40)
+
+    def test_wait_for_value(self):
+        self.watcher.watch('os1', FakeClient('2', '8'))
+        self.assertTrue(self.watcher.wait_for('os1', 8, timeout=5))
+        self.assertTrue(self.watcher.wait_for('os1', '8', timeout=5))
+        self.assertRaises(ValueError, self.watcher.wait_for, 'os1',
+                          'sideways')
+
+    def test_wait_timeout(self):
+        self.watcher.watch('os1', FakeClient('2'))
+        self.assertFalse(self.watcher.wait_for('os1', 'off', timeout=0.05))
+
+    def test_errors_keep_polling(self):
+        fake = FakeClient(requests.exceptions.ConnectionError(), '8')
+        self.watcher.watch('os1', fake)
+        self.assertTrue(self.watcher.wait_for('os1', 'off', timeout=5))
+
+    def test_unwatch(self):
+        self.watcher.watch('os1', FakeClient('2'))
+        self.watcher.unwatch('os1')
+        self.assertRaises(KeyError, self.watcher.state, 'os1')
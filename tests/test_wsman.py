@@ -6,19 +6,23 @@ test_amt
 
 Tests for `amt` module's wsman.py file
 """
+import uuid
+
 import mock
 import testtools
 
 from amt import wsman
 
 
-def fake_uuid4():
+def fake_message_id():
     return "00000000-1111-2222-3333-444455556666"
 
 
 class BaseTestCase(testtools.TestCase):
 
     def assertXmlEqual(self, one, two):
+        if isinstance(one, bytes):
+            one = one.decode('utf-8')
         one = one.strip()
         two = two.strip()
         array1 = [x.strip() for x in str(one).split("\n")]
@@ -29,7 +33,7 @@ class BaseTestCase(testtools.TestCase):
 
 class TestXMLGen(BaseTestCase):
 
-    @mock.patch('uuid.uuid4', fake_uuid4)
+    @mock.patch('amt.wsman.message_id', fake_message_id)
     def test_get_request(self):
         uri = 'http://10.42.0.50:16992/wsman'
         res = ('http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/'
@@ -51,7 +55,7 @@ class TestXMLGen(BaseTestCase):
 
         self.assertXmlEqual(wsman.get_request(uri, res), shouldbe)
 
-    @mock.patch('uuid.uuid4', fake_uuid4)
+    @mock.patch('amt.wsman.message_id', fake_message_id)
     def test_change_boot_to_pxe_request(self):
         uri = 'http://10.42.0.50:16992/wsman'
 
@@ -91,6 +95,193 @@ class TestXMLGen(BaseTestCase):
                           wsman.change_boot_order_request,
                           uri, 'pxe2')
 
+    @mock.patch('amt.wsman.message_id', fake_message_id)
+    def test_enable_remote_kvm_escapes_password(self):
+        uri = 'http://10.42.0.50:16992/wsman'
+        payload = wsman.enable_remote_kvm(uri, 'P&ss<word>')
+        self.assertIsInstance(payload, bytes)
+        self.assertIn(b'<g:RFBPassword>P&amp;ss&lt;word&gt;</g:RFBPassword>',
+                      payload)
+
+    def test_requests_are_bytes(self):
+        uri = 'http://10.42.0.50:16992/wsman'
+        for payload in (wsman.power_state_request(uri, 'on'),
+                        wsman.kvm_redirect(uri),
+                        wsman.enable_boot_config_request(uri)):
+            self.assertIsInstance(payload, bytes)
+            self.assertIn(b'<wsa:To s:mustUnderstand="true">'
+                          b'http://10.42.0.50:16992/wsman</wsa:To>', payload)
+
+    def test_power_state_request(self):
+        uri = 'http://10.42.0.50:16992/wsman'
+        self.assertIn(b'<n1:PowerState>5</n1:PowerState>',
+                      wsman.power_state_request(uri, 'reboot'))
+        self.assertIn(b'<n1:PowerState>8</n1:PowerState>',
+                      wsman.power_state_request(uri, 'off'))
+
+    def test_enumerate_request(self):
+        uri = 'http://10.42.0.50:16992/wsman'
+        res = ('http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/'
+               'CIM_BootSourceSetting')
+        payload = wsman.enumerate_request(uri, res, max_elements=10)
+        self.assertIn(b'enumeration/Enumerate</wsa:Action>', payload)
+        self.assertIn(b'<wsman:OptimizeEnumeration/>', payload)
+        self.assertIn(b'<wsman:MaxElements>10</wsman:MaxElements>', payload)
+
+        payload = wsman.enumerate_request(uri, res, optimized=False)
+        self.assertNotIn(b'OptimizeEnumeration', payload)
+        self.assertIn(b'<wsen:Enumerate/>', payload)
+
+    def test_enumerate_class_name(self):
+        uri = 'http://10.42.0.50:16992/wsman'
+        resource = (b'<wsman:ResourceURI s:mustUnderstand="true">'
+                    b'http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/'
+                    b'CIM_SoftwareIdentity</wsman:ResourceURI>')
+        self.assertIn(resource, wsman.enumerate_request(
+            uri, 'CIM_SoftwareIdentity'))
+        self.assertIn(resource, wsman.pull_request(
+            uri, 'CIM_SoftwareIdentity', 'ctx-1'))
+
+    def test_pull_request(self):
+        uri = 'http://10.42.0.50:16992/wsman'
+        res = ('http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/'
+               'CIM_BootSourceSetting')
+        payload = wsman.pull_request(uri, res, 'ctx-1', max_elements=5)
+        self.assertIn(b'enumeration/Pull</wsa:Action>', payload)
+        self.assertIn(b'<wsen:EnumerationContext>ctx-1'
+                      b'</wsen:EnumerationContext>', payload)
+        self.assertIn(b'<wsen:MaxElements>5</wsen:MaxElements>', payload)
+
+
+class TestGeneric(BaseTestCase):
+
+    uri = 'http://10.42.0.50:16992/wsman'
+
+    def test_resource_uri(self):
+        self.assertEqual(wsman.resource_uri('CIM_BootService'),
+                         wsman.CIM_SCHEMA + 'CIM_BootService')
+        self.assertEqual(wsman.resource_uri('AMT_GeneralSettings'),
+                         wsman.AMT_SCHEMA + 'AMT_GeneralSettings')
+        self.assertEqual(wsman.resource_uri(wsman.IPS_SCHEMA + 'IPS_X'),
+                         wsman.IPS_SCHEMA + 'IPS_X')
+        self.assertRaises(ValueError, wsman.resource_uri, 'Unknown')
+
+    def test_get_selectors(self):
+        payload = wsman.get_request(self.uri, 'CIM_SoftwareIdentity',
+                                    {'InstanceID': 'A&B'})
+        self.assertIn(b'<wsman:Selector Name="InstanceID">A&amp;B'
+                      b'</wsman:Selector>', payload)
+        self.assertIn(b'<s:Body/>', payload)
+
+    @mock.patch('amt.wsman.message_id', fake_message_id)
+    def test_invoke_request(self):
+        payload = wsman.invoke_request(
+            self.uri, 'AMT_BootSettingData', 'Example', {'InstanceID': 'x'},
+            [('Flag', True), ('Values', [1, 2]),
+             ('Target', wsman.Reference('CIM_ComputerSystem',
+                                        {'Name': 'ManagedSystem'}))])
+        amt = 'http://intel.com/wbem/wscim/1/amt-schema/1/AMT_BootSettingData'
+        shouldbe = """<?xml version="1.0" encoding="UTF-8"?>
+<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:wsa="http://schemas.xmlsoap.org/ws/2004/08/addressing" xmlns:wsman="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:n1="%(amt)s">
+<s:Header>
+<wsa:Action s:mustUnderstand="true">%(amt)s/Example</wsa:Action>
+<wsa:To s:mustUnderstand="true">http://10.42.0.50:16992/wsman</wsa:To>
+<wsman:ResourceURI s:mustUnderstand="true">%(amt)s</wsman:ResourceURI>
+<wsa:MessageID s:mustUnderstand="true">uuid:00000000-1111-2222-3333-444455556666</wsa:MessageID>
+<wsa:ReplyTo>
+<wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address>
+</wsa:ReplyTo>
+<wsman:SelectorSet>
+<wsman:Selector Name="InstanceID">x</wsman:Selector>
+</wsman:SelectorSet>
+</s:Header>
+<s:Body>
+<n1:Example_INPUT>
+<n1:Flag>true</n1:Flag>
+<n1:Values>1</n1:Values>
+<n1:Values>2</n1:Values>
+<n1:Target>
+<wsa:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</wsa:Address>
+<wsa:ReferenceParameters>
+<wsman:ResourceURI>http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/CIM_ComputerSystem</wsman:ResourceURI>
+<wsman:SelectorSet>
+<wsman:Selector wsman:Name="Name">ManagedSystem</wsman:Selector>
+</wsman:SelectorSet>
+</wsa:ReferenceParameters>
+</n1:Target>
+</n1:Example_INPUT>
+</s:Body></s:Envelope>""" % {'amt': amt}  # noqa
+
+        self.assertXmlEqual(payload, shouldbe)
+
+    def test_put_request(self):
+        payload = wsman.put_request(self.uri, 'AMT_GeneralSettings',
+                                    {'b': 'two', 'a': 1})
+        self.assertIn(b'transfer/Put</wsa:Action>', payload)
+        self.assertIn(b'<g:AMT_GeneralSettings xmlns:g="http://intel.com/'
+                      b'wbem/wscim/1/amt-schema/1/AMT_GeneralSettings">\n'
+                      b'<g:a>1</g:a>\n<g:b>two</g:b>\n'
+                      b'</g:AMT_GeneralSettings>', payload)
+
+    def test_serializers_cached(self):
+        wsman.invoke_request(self.uri, 'CIM_BootService', 'M',
+                             params={'Role': 1})
+        count = len(wsman._serializers)
+        # only the values differ
+        payload = wsman.invoke_request('http://other/wsman',
+                                       'CIM_BootService', 'M',
+                                       params={'Role': 2})
+        self.assertIn(b'<n1:Role>2</n1:Role>', payload)
+        self.assertEqual(len(wsman._serializers), count)
+        # a different shape
+        wsman.invoke_request(self.uri, 'CIM_BootService', 'M',
+                             params={'Role': [1, 2]})
+        self.assertEqual(len(wsman._serializers), count + 1)
+
+    @mock.patch('amt.wsman._SERIALIZER_CACHE_SIZE', 1)
+    def test_serializer_cache_bounded(self):
+        one = wsman.get_request(self.uri, 'CIM_BootService')
+        wsman.get_request(self.uri, 'CIM_BootSourceSetting')
+        self.assertEqual(len(wsman._serializers), 1)
+        self.assertIn(b'CIM_BootService</wsman:ResourceURI>', one)
+        self.assertIn(b'CIM_BootService</wsman:ResourceURI>',
+                      wsman.get_request(self.uri, 'CIM_BootService'))
+
+    @mock.patch('amt.wsman._BOUND_CACHE_SIZE', 1)
+    def test_bound_cache_bounded(self):
+        template = wsman._serializer(('get', wsman.resource_uri(
+            'CIM_BootService'), ()))
+        wsman.get_request(self.uri, 'CIM_BootService')
+        payload = wsman.get_request('http://other/wsman', 'CIM_BootService')
+        self.assertIn(b'>http://other/wsman</wsa:To>', payload)
+        # kept on the template they were bound from
+        self.assertEqual(list(template._bound),
+                         [(('uri', 'http://other/wsman'),)])
+
+
+class TestMessageID(testtools.TestCase):
+
+    def test_unique(self):
+        ids = [wsman.message_id() for i in range(1000)]
+        self.assertEqual(len(set(ids)), 1000)
+
+    def test_valid_uuid(self):
+        value = uuid.UUID(wsman.message_id())
+        self.assertEqual(value.version, 4)
+
+    def test_in_request(self):
+        uri = 'http://10.42.0.50:16992/wsman'
+        one = wsman.kvm_redirect(uri)
+        two = wsman.kvm_redirect(uri)
+        self.assertNotEqual(one, two)
+
+    @mock.patch('os.getpid', return_value=-1)
+    def test_reseed_after_fork(self, getpid):
+        before = wsman.message_id()
+        getpid.return_value = -2
+        after = wsman.message_id()
+        self.assertNotEqual(before[:24], after[:24])
+
 
 class TestFriendlyPowerState(testtools.TestCase):
 
@@ -123,6 +314,19 @@ class TestFriendlyPowerState(testtools.TestCase):
                           'not-a-number')
 
 
+class TestPowerStateValue(testtools.TestCase):
+
+    def test_names_and_values(self):
+        for state in ('off', 8, '8'):
+            self.assertEqual(wsman.power_state_value(state), 8)
+
+    def test_unknown(self):
+        for state in ('sideways', 42, '42', None):
+            e = self.assertRaises(ValueError, wsman.power_state_value,
+                                  state)
+            self.assertIn('Unknown power state', str(e))
+
+
 class TestAmt(testtools.TestCase):
 
     def test_something(self):